@@ -1,24 +1,37 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends, status, Body
+from fastapi import APIRouter, BackgroundTasks, WebSocket, WebSocketDisconnect, HTTPException, Depends, status, Body, Query
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 from datetime import timedelta
 import os
-from typing import Dict
-
-from uow import UnitOfWork
-from services.message_handler import MessageHandler
+import logging_config
+from fastapi.responses import StreamingResponse
+from api.responses import FastJSONResponse, ndjson_stream
+
+from uow import UnitOfWork, AsyncUnitOfWork
+from services.message_handler import AsyncMessageHandler
+from services.connection_registry import registry
+from services.group_fanout import group_broadcaster
+from services.write_behind import message_write_buffer
+from services.presence import presence_service
 from services.queries import (
     UserQueryService,
     MessageQueryService,
     GroupQueryService,
     DirectMessageQueryService,
+    ChatQueryService,
 )
 from services.commands import (
     UserCommandService,
     MessageCommandService,
     GroupCommandService,
     DirectMessageCommandService,
+    ChatCommandService,
 )
-from auth import verify_password, create_access_token, get_current_user
+from services.async_queries import AsyncUserQueryService, AsyncMessageQueryService
+from repos.indexes import index_report
+from repos.cache import user_cache
+from repos.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, DEFAULT_USER_DIRECTORY_FIELDS, EXPORT_BATCH_SIZE, MAX_EXPORT_BATCH_SIZE, decode_cursor
+from auth import create_access_token, get_current_user, decode_token, token_cache, password_pool, PasswordPoolBusy, InvalidToken
 
 router = APIRouter()
 
@@ -30,6 +43,14 @@ def get_uow():
     finally:
         uow.commit_close()
 
+# Async dependency for async def routes so they don't block the event loop
+async def get_async_uow():
+    uow = AsyncUnitOfWork()
+    try:
+        yield uow
+    finally:
+        await uow.commit_close()
+
 # Pydantic models for request bodies
 
 class CreateUserRequest(BaseModel):
@@ -75,6 +96,10 @@ def db_connection_check():
     else:
         raise HTTPException(status_code=500, detail="Database connection failed")
 
+@router.get("/health/indexes")
+def db_index_check(uow: UnitOfWork = Depends(get_uow)):
+    return index_report(uow.db)
+
 # ==== Query Endpoints ====
 
 @router.get("/users/{user_id}")
@@ -85,11 +110,25 @@ def get_user(user_id: str, uow: UnitOfWork = Depends(get_uow)):
         raise HTTPException(status_code=404, detail="User not found")
     return user.dict()
 
+# The user directory is ordered by username and keyset paginated: pass
+# `next_cursor` back as `after` for the next page. `prefix` narrows it to
+# usernames starting with the given text and `fields` picks the columns.
+
 @router.get("/users")
-def get_all_users(uow: UnitOfWork = Depends(get_uow)):
-    user_query = UserQueryService(uow)
-    users = user_query.get_all_users()
-    return [user.dict() for user in users]
+def get_user_directory(
+    prefix: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    fields: str = ",".join(DEFAULT_USER_DIRECTORY_FIELDS),
+    uow: UnitOfWork = Depends(get_uow),
+):
+    try:
+        user_query = UserQueryService(uow)
+        field_list = [field.strip() for field in fields.split(",") if field.strip()]
+        page = user_query.get_user_directory(prefix, limit, after, field_list)
+        return page.dict()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/messages/{message_id}")
 def get_message(message_id: str, uow: UnitOfWork = Depends(get_uow)):
@@ -99,28 +138,124 @@ def get_message(message_id: str, uow: UnitOfWork = Depends(get_uow)):
         raise HTTPException(status_code=404, detail="Message not found")
     return message.dict()
 
+# Message history endpoints are keyset paginated: the newest `limit` messages are
+# returned first, pass `next_cursor` back as `before` for older pages (or use
+# `after` to fetch messages newer than a cursor). `fast=true` returns the same
+# JSON serialized straight from the projected documents, without building
+# and re-encoding a MessageDTO per message.
+
 @router.get("/messages/user/{user_id}")
-def get_messages_for_user(user_id: str, uow: UnitOfWork = Depends(get_uow)):
-    msg_query = MessageQueryService(uow)
-    messages = msg_query.get_messages_for_user(user_id)
-    return {"messages": [m.dict() for m in messages]}
+def get_messages_for_user(
+    user_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: str | None = None,
+    after: str | None = None,
+    fast: bool = False,
+    uow: UnitOfWork = Depends(get_uow),
+):
+    try:
+        msg_query = MessageQueryService(uow)
+        if fast:
+            return FastJSONResponse(msg_query.get_messages_for_user_page(user_id, limit, before, after, raw=True))
+        page = msg_query.get_messages_for_user_page(user_id, limit, before, after)
+        return {"messages": [m.dict() for m in page.messages], "next_cursor": page.next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/messages/sender/{sender_id}")
-def get_messages_by_sender(sender_id: str, uow: UnitOfWork = Depends(get_uow)):
-    msg_query = MessageQueryService(uow)
-    messages = msg_query.get_messages_by_sender(sender_id)
-    return {"messages": [m.dict() for m in messages]}
+def get_messages_by_sender(
+    sender_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: str | None = None,
+    after: str | None = None,
+    fast: bool = False,
+    uow: UnitOfWork = Depends(get_uow),
+):
+    try:
+        msg_query = MessageQueryService(uow)
+        if fast:
+            return FastJSONResponse(msg_query.get_messages_by_sender_page(sender_id, limit, before, after, raw=True))
+        page = msg_query.get_messages_by_sender_page(sender_id, limit, before, after)
+        return {"messages": [m.dict() for m in page.messages], "next_cursor": page.next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/messages/conversation/{user1}/{user2}")
-def get_conversation(user1: str, user2: str, uow: UnitOfWork = Depends(get_uow)):
+def get_conversation(
+    user1: str,
+    user2: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: str | None = None,
+    after: str | None = None,
+    fast: bool = False,
+    uow: UnitOfWork = Depends(get_uow),
+):
     try:
         msg_query = MessageQueryService(uow)
-        conversation = msg_query.get_conversation(user1, user2)
-        print(f"convo: {conversation}")
-        return {"messages": [m.dict() for m in conversation]}
+        if fast:
+            return FastJSONResponse(msg_query.get_conversation_page(user1, user2, limit, before, after, raw=True))
+        page = msg_query.get_conversation_page(user1, user2, limit, before, after)
+        return {"messages": [m.dict() for m in page.messages], "next_cursor": page.next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Exports stream a user's or a conversation's whole message history, oldest
+# first, as NDJSON (gzip-compressed with gzip=true). A {"checkpoint": ...}
+# line follows every batch, pass the last one received back as `after` to
+# resume an interrupted export.
+
+def export_response(filename: str, export, after: str | None, gzip: bool) -> StreamingResponse:
+    if after is not None:
+        try:
+            decode_cursor(after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def batches():
+        # the stream outlives the request dependencies, so it owns its unit of work
+        uow = AsyncUnitOfWork()
+        try:
+            async for batch in export(AsyncMessageQueryService(uow)):
+                yield batch
+        finally:
+            await uow.commit_close()
+
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.ndjson"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(ndjson_stream(batches(), gzip), media_type="application/x-ndjson", headers=headers)
+
+@router.get("/messages/export/user/{user_id}")
+async def export_messages_for_user(
+    user_id: str,
+    after: str | None = None,
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+    gzip: bool = False,
+):
+    return export_response(
+        f"messages-{user_id}",
+        lambda msg_query: msg_query.export_messages_for_user(user_id, batch_size, after),
+        after,
+        gzip,
+    )
+
+@router.get("/messages/export/conversation/{user1}/{user2}")
+async def export_conversation(
+    user1: str,
+    user2: str,
+    after: str | None = None,
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+    gzip: bool = False,
+):
+    return export_response(
+        f"conversation-{user1}-{user2}",
+        lambda msg_query: msg_query.export_conversation(user1, user2, batch_size, after),
+        after,
+        gzip,
+    )
+
 @router.get("/groups/{group_id}")
 def get_group(group_id: str, uow: UnitOfWork = Depends(get_uow)):
     grp_query = GroupQueryService(uow)
@@ -138,8 +273,48 @@ def get_user_groups(user_id: str, uow: UnitOfWork = Depends(get_uow)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# Chats are identified by their group_id, or for direct messages by the
+# dm_pair_key of the two users ("<lower user_id>|<higher user_id>")
+
+@router.get("/users/{user_id}/unread")
+def get_unread_counts(user_id: str, uow: UnitOfWork = Depends(get_uow)):
+    chat_query = ChatQueryService(uow)
+    chats = chat_query.get_unread_counts(user_id)
+    return {"chats": [chat.dict() for chat in chats], "total_unread": sum(chat.unread for chat in chats)}
+
+# The inbox is ordered by last message, newest first: pass `next_cursor`
+# back as `before` for the next page.
+
+@router.get("/users/{user_id}/inbox")
+def get_inbox(
+    user_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: str | None = None,
+    uow: UnitOfWork = Depends(get_uow),
+):
+    try:
+        chat_query = ChatQueryService(uow)
+        page = chat_query.get_inbox(user_id, limit, before)
+        return page.dict()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # ==== Command Endpoints (POST/PUT/DELETE) ====
 
+@router.post("/users/{user_id}/chats/{chat_id}/read")
+def mark_chat_read(
+    user_id: str,
+    chat_id: str,
+    message_id: str | None = Body(None, embed=True),
+    uow: UnitOfWork = Depends(get_uow),
+):
+    chat_command = ChatCommandService(uow)
+    try:
+        read_dto = chat_command.mark_read(user_id, chat_id, message_id)
+        return read_dto.dict()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/users")
 def create_user(
     username: str = Body(...),
@@ -151,18 +326,22 @@ def create_user(
     try:
         user_dto = user_command.create_user(username, email, password)
         return user_dto.dict()
+    except PasswordPoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/messages")
 def create_message(
+    background_tasks: BackgroundTasks,
     sender_id: str = Body(...),
     content: str = Body(...),
     reciever_user_id: str | None = Body(None),
     reciever_group_id: str | None = Body(None),
     uow: UnitOfWork = Depends(get_uow),
 ):
-    msg_command = MessageCommandService(uow)
+    # chat summary writes run after the response is sent
+    msg_command = MessageCommandService(uow, defer=background_tasks.add_task)
     try:
         message_dto = msg_command.create_message(
             sender_id, content, reciever_user_id, reciever_group_id
@@ -171,13 +350,27 @@ def create_message(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/messages/batch")
+def create_messages(
+    background_tasks: BackgroundTasks,
+    messages: list[CreateMessageRequest] = Body(..., embed=True),
+    uow: UnitOfWork = Depends(get_uow),
+):
+    msg_command = MessageCommandService(uow, defer=background_tasks.add_task)
+    try:
+        results = msg_command.create_messages([m.dict() for m in messages])
+        return {"results": results}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.put("/messages/{message_id}")
 def update_message(
     message_id: str,
+    background_tasks: BackgroundTasks,
     new_content: str = Body(...),
     uow: UnitOfWork = Depends(get_uow),
 ):
-    msg_command = MessageCommandService(uow)
+    msg_command = MessageCommandService(uow, defer=background_tasks.add_task)
     try:
         message_dto = msg_command.update_message(message_id, new_content)
         return message_dto.dict()
@@ -224,8 +417,8 @@ def update_user_status(
         
 
 @router.delete("/messages/{message_id}")
-def delete_message(message_id: str, uow: UnitOfWork = Depends(get_uow)):
-    msg_command = MessageCommandService(uow)
+def delete_message(message_id: str, background_tasks: BackgroundTasks, uow: UnitOfWork = Depends(get_uow)):
+    msg_command = MessageCommandService(uow, defer=background_tasks.add_task)
     try:
         msg_command.delete_message(message_id)
         return {"status": "deleted", "message_id": message_id}
@@ -286,6 +479,32 @@ def remove_group_member(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/groups/{group_id}/add_members")
+def add_group_members(
+    group_id: str,
+    member_ids: list[str] = Body(..., embed=True),
+    uow: UnitOfWork = Depends(get_uow),
+):
+    grp_command = GroupCommandService(uow)
+    try:
+        group_dto = grp_command.add_members(group_id, member_ids)
+        return group_dto.dict()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/groups/{group_id}/remove_members")
+def remove_group_members(
+    group_id: str,
+    member_ids: list[str] = Body(..., embed=True),
+    uow: UnitOfWork = Depends(get_uow),
+):
+    grp_command = GroupCommandService(uow)
+    try:
+        group_dto = grp_command.remove_members(group_id, member_ids)
+        return group_dto.dict()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/direct_messages")
 def create_dm_chat(
     user1_id: str = Body(...),
@@ -303,15 +522,16 @@ def create_dm_chat(
 async def login(
     username: str = Body(...),
     password: str = Body(...),
-    uow: UnitOfWork = Depends(get_uow)
+    uow: AsyncUnitOfWork = Depends(get_async_uow)
 ):
     try:
         # 1) Look up user by username
-        user_query_service = UserQueryService(uow)
-        user = user_query_service.get_user_by_username(username)
+        user_query_service = AsyncUserQueryService(uow)
+        user = await user_query_service.get_user_by_username(username)
         
         # 2) If user doesn't exist or password is wrong, immediately raise 401
-        if not user or not verify_password(password, user.password):
+        # bcrypt runs on the password pool, off the event loop
+        if not user or not await password_pool.verify(password, user.password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect username or password",
@@ -322,7 +542,8 @@ async def login(
             minutes=int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
         )
         access_token = create_access_token(
-            data={"sub": user.username},
+            # uid lets the WebSocket handshake identify the user without a lookup
+            data={"sub": user.username, "uid": str(user.user_id)},
             expires_delta=access_token_expires
         )
         return {
@@ -334,11 +555,13 @@ async def login(
 
     except HTTPException:
         raise
+    except PasswordPoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         try:
-            uow.close()
+            await uow.close()
         except Exception:
             pass
 
@@ -347,14 +570,82 @@ async def logout(current_user: str = Depends(get_current_user)):
     # Logout at the API layer may be as simple as returning a response
     return {"message": f"User {current_user} successfully logged out"}
 
-# Store active WebSocket connections
-active_connections: Dict[str, WebSocket] = {}
-
-# WebSocket API for persistent connection for chat app implementation
+@router.get("/metrics/connections")
+def connection_metrics():
+    return registry.queue_metrics()
+
+@router.get("/metrics/cache")
+def cache_metrics():
+    return {"users": user_cache.stats()}
+
+@router.get("/metrics/auth")
+def auth_metrics():
+    return {"token_cache": token_cache.stats()}
+
+@router.get("/metrics/logging")
+def logging_metrics():
+    return logging_config.metrics()
+
+@router.get("/metrics/password_hashing")
+def password_hashing_metrics():
+    return password_pool.metrics()
+
+@router.get("/metrics/presence")
+def presence_metrics():
+    return presence_service.metrics()
+
+@router.get("/metrics/write_behind")
+def write_behind_metrics():
+    if message_write_buffer is None:
+        return {"enabled": False}
+    return {"enabled": True, **message_write_buffer.metrics()}
+
+# Active WebSocket connections live in services.connection_registry.registry,
+# which routes events across workers/hosts through the configured broker
+
+async def broadcast_new_message(user_id: str, message: dict) -> None:
+    receiver_id = message.get("reciever_user_id")
+    group_id = message.get("reciever_group_id")
+    event = {
+        "action": "new_message",
+        "payload": {
+            "sender_id": message["sender_id"],
+            "content": message["content"],
+            "reciever_user_id": receiver_id,
+            "reciever_group_id": group_id,
+            "timestamp": message.get("timestamp")
+        }
+    }
+    if receiver_id:
+        await registry.send_to_user(receiver_id, event)
+    elif group_id:
+        await group_broadcaster.broadcast(group_id, event, exclude=user_id)
+
+async def websocket_user_id(token: str | None, uow: AsyncUnitOfWork) -> str | None:
+    # Verifies the access token once per connection, returns the user it was issued to
+    if not token:
+        return None
+    try:
+        claims = decode_token(token)
+    except InvalidToken:
+        return None
+    if claims.get("uid"):
+        return claims["uid"]
+    # tokens issued before the uid claim only carry the username
+    user = await uow.user_repository.get_by_username(claims.get("sub"))
+    return user.user_id if user else None
+
+# WebSocket API for persistent connection for chat app implementation.
+# The first action must be {"action": "authenticate", "payload": {"token": <access token>}},
+# every later frame is trusted as that user without re-checking the token.
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     user_id = None
+    connection = None
+    # One unit of work and handler for the lifetime of the socket
+    uow = AsyncUnitOfWork()
+    handler = AsyncMessageHandler(uow)
     
     try:
         while True:
@@ -363,47 +654,51 @@ async def websocket_endpoint(websocket: WebSocket):
             payload = data.get("payload", {})
 
             if action == "authenticate":
-                user_id = payload.get("user_id")
+                if user_id:
+                    await connection.send({"error": "Already authenticated"})
+                    continue
+                user_id = await websocket_user_id(payload.get("token"), uow)
                 if not user_id:
                     await websocket.send_json({"error": "Invalid authentication"})
                     continue
                     
-                active_connections[user_id] = websocket
-                await websocket.send_json({"action": "authenticated", "status": "success"})
+                # From here on every send to this socket goes through its send queue
+                connection = await registry.register(user_id, websocket)
+                handler.user_id = user_id
+                presence_service.connected(user_id)
+                await connection.send({"action": "authenticated", "status": "success", "user_id": user_id})
                 continue
 
             if not user_id:
                 await websocket.send_json({"error": "Not authenticated"})
                 continue
 
-            handler = MessageHandler(UnitOfWork())
-            result = handler.handle(action, payload)
-
-            # For new messages, broadcast to the recipient
-            if action == "create_message":
-                receiver_id = payload.get("reciever_user_id")
-                if receiver_id and receiver_id in active_connections:
-                    receiver_ws = active_connections[receiver_id]
-                    try:
-                        await receiver_ws.send_json({
-                            "action": "new_message",
-                            "payload": {
-                                "sender_id": payload["sender_id"],
-                                "content": payload["content"],
-                                "reciever_user_id": receiver_id,
-                                "timestamp": result.get("message", {}).get("timestamp")
-                            }
-                        })
-                    except Exception as e:
-                        print(f"Error sending to receiver with id: {receiver_id} Exception: {e}")
+            # Encoded once here so datetimes are ISO strings for the reply and any fan-out
+            result = jsonable_encoder(await handler.handle(action, payload))
+
+            # For new messages, broadcast to the recipient or the group
+            if action == "create_message" and "error" not in result:
+                # the stored message, not the client payload, so the sender is the authenticated user
+                await broadcast_new_message(user_id, result["message"])
+            elif action == "create_messages" and "error" not in result:
+                for item in result["results"]:
+                    if item["status"] == "created":
+                        message = item["message"]
+                        await broadcast_new_message(user_id, {**message, "timestamp": message["sent_at"]})
 
             # Send confirmation back to sender
-            await websocket.send_json({
+            await connection.send({
                 "action": action,
                 "status": "success",
                 "data": result
             })
 
     except WebSocketDisconnect:
-        if user_id and user_id in active_connections:
-            del active_connections[user_id]
+        pass
+    finally:
+        if user_id:
+            await registry.unregister(user_id, websocket)
+            # a reconnect may have replaced this socket, the user is still online then
+            if not registry.is_connected(user_id):
+                await presence_service.disconnected(user_id)
+        await uow.close()
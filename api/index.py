@@ -1,5 +1,6 @@
 from mangum import Mangum
-from main import app
+from serverless import app
 
-# Create mangum handler
-handler = Mangum(app)
\ No newline at end of file
+# Create mangum handler. Lifespan is off so an invocation never closes the
+# pooled Mongo client that warm invocations reuse
+handler = Mangum(app, lifespan="off")
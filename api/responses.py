@@ -0,0 +1,49 @@
+import json
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterator
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+class FastJSONResponse(Response):
+    """
+    Serializes plain dicts/lists straight to JSON bytes (orjson when it is
+    installed), skipping FastAPI's response validation and jsonable_encoder.
+    Routes returning it must build the content themselves, e.g. raw message
+    pages projected to the MessageDTO fields by the repository.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+async def ndjson_stream(batches: AsyncIterator[tuple[list[dict], str]], compress: bool = False) -> AsyncIterator[bytes]:
+    """
+    Writes (records, cursor) batches as NDJSON: one line per record followed
+    by a {"checkpoint": cursor} line per batch, which a client that lost the
+    connection passes back to resume after the last complete batch. With
+    compress the stream is gzipped on the fly and flushed after each batch
+    so the client keeps receiving data.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    async for records, cursor in batches:
+        chunk = b"".join(dumps(record) + b"\n" for record in records) + dumps({"checkpoint": cursor}) + b"\n"
+        if compressor is not None:
+            chunk = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield chunk
+    if compressor is not None:
+        yield compressor.flush()
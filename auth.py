@@ -1,11 +1,15 @@
+import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from dotenv import load_dotenv
 import os
+from repos.cache import TTLCache
 
 
 load_dotenv()
@@ -13,14 +17,120 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# passlib/bcrypt and jose are imported on first use rather than at import
+# time, so cold starts that don't touch passwords or tokens skip them
+pwd_context = None
+
+class InvalidToken(Exception):
+    # Raised by decode_token for malformed, forged or expired tokens
+    pass
+
+def get_pwd_context():
+    global pwd_context
+    if pwd_context is None:
+        from passlib.context import CryptContext
+        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return pwd_context
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+class PasswordPoolBusy(Exception):
+    # Raised instead of queueing when the password pool is at its limit
+    pass
+
+class PasswordHasherPool:
+    """
+    Runs bcrypt hashing/verification on a dedicated thread pool so it never
+    blocks the event loop (bcrypt releases the GIL, so threads run in
+    parallel). At most max_workers hashes run at once and max_queue more
+    may wait; beyond that calls fail fast with PasswordPoolBusy. Queue wait
+    times are tracked for the metrics endpoint.
+    """
+    def __init__(self, max_workers: int = 2, max_queue: int = 64) -> None:
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password")
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"completed": 0, "rejected": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+
+    def _admit(self) -> None:
+        with self.lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.stats["rejected"] += 1
+                raise PasswordPoolBusy("Too many password operations in progress, retry shortly")
+            self.in_flight += 1
+
+    def _release(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+
+    def _job(self, fn, args):
+        queued_at = time.monotonic()
+        def run():
+            wait_ms = (time.monotonic() - queued_at) * 1000
+            try:
+                return fn(*args)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                    self.stats["completed"] += 1
+                    self.stats["wait_ms_total"] += wait_ms
+                    self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], wait_ms)
+        return run
+
+    def _submit(self, fn, args):
+        self._admit()
+        try:
+            future = self.executor.submit(self._job(fn, args))
+        except Exception:
+            # e.g. submitted after shutdown, the job never runs to release its slot
+            self._release()
+            raise
+        # A job cancelled before it started (its caller was cancelled) never
+        # runs either, so its slot is released here instead
+        future.add_done_callback(lambda f: self._release() if f.cancelled() else None)
+        return future
+
+    async def run(self, fn, *args):
+        # Cancelling the awaiting coroutine cancels the wrapped future
+        return await asyncio.wrap_future(self._submit(fn, args))
+
+    def run_blocking(self, fn, *args):
+        # For sync routes, which already run on FastAPI's threadpool
+        return self._submit(fn, args).result()
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password)
+
+    def metrics(self) -> dict:
+        with self.lock:
+            completed = self.stats["completed"]
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queued": max(self.in_flight - self.max_workers, 0),
+                "wait_ms_avg": self.stats["wait_ms_total"] / completed if completed else 0.0,
+                **self.stats,
+            }
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+password_pool = PasswordHasherPool(
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    max_queue=int(os.getenv("PASSWORD_HASH_QUEUE", "64")),
+)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -29,9 +139,33 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    from jose import jwt
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Verified claims keyed by the token's sha256 digest, so a token is only
+# decoded and its signature checked once. Entries expire with the token.
+token_cache = TTLCache(
+    max_size=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+    ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+)
+
+def decode_token(token: str) -> dict:
+    # Returns the verified claims, raises InvalidToken for invalid or expired tokens
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    claims = token_cache.get(digest)
+    if claims is not None:
+        return claims
+    from jose import JWTError, jwt
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        raise InvalidToken(str(e))
+    ttl = claims["exp"] - time.time() if "exp" in claims else None
+    if ttl is None or ttl > 0:
+        token_cache.set(digest, claims, ttl=ttl)
+    return claims
+
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -39,10 +173,10 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-    except JWTError:
+    except InvalidToken:
         raise credentials_exception
     return username
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+Compares the two ways a page of messages can be serialized by the message
+history endpoints, without a database: documents are generated in the shape
+the driver returns them (projected to the MessageDTO fields, None fields
+left out as messages are stored with exclude_none, BSON dates as datetimes).
+
+    python -m benchmarks.message_serialization [--messages 10000] [--repeat 5]
+
+default: MessageDTO per document -> .dict() -> jsonable_encoder -> JSONResponse
+fast:    projected documents -> FastJSONResponse (orjson when installed)
+"""
+import argparse
+import time
+from datetime import timedelta
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from api.responses import FastJSONResponse, orjson
+from domains.models import now_millis
+from domains.view_models import MessageDTO
+
+def make_docs(count: int) -> list[dict]:
+    start = now_millis()
+    docs = []
+    for i in range(count):
+        sent_at = start + timedelta(milliseconds=i)
+        docs.append({
+            "sender_id": "user-a" if i % 2 else "user-b",
+            "content": f"message {i} " + "lorem ipsum " * 8,
+            "sent_at": sent_at,
+            "message_id": f"{i:024x}",
+            "updated_at": sent_at,
+            "reciever_user_id": "user-b" if i % 2 else "user-a",
+        })
+    return docs
+
+def default_path(docs: list[dict]) -> bytes:
+    page = {"messages": [MessageDTO(**doc).dict() for doc in docs], "next_cursor": None}
+    return JSONResponse(jsonable_encoder(page)).body
+
+def fast_path(docs: list[dict]) -> bytes:
+    # the repository fills in missing receiver fields, as MessageRepository.find_page does
+    for doc in docs:
+        doc.setdefault("reciever_user_id", None)
+        doc.setdefault("reciever_group_id", None)
+    return FastJSONResponse({"messages": docs, "next_cursor": None}).body
+
+def measure(path, docs: list[dict], repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = path(docs)
+        best = min(best, time.perf_counter() - started)
+    return best, len(body)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    docs = make_docs(args.messages)
+    print(f"{args.messages} messages, best of {args.repeat}, orjson {'on' if orjson is not None else 'off'}")
+    results = {}
+    for name, path in (("default", default_path), ("fast", fast_path)):
+        seconds, size = measure(path, docs, args.repeat)
+        results[name] = seconds
+        print(f"{name:>8}: {seconds * 1000:8.1f} ms  {args.messages / seconds:>10,.0f} msg/s  {size:,} bytes")
+    print(f"speedup: {results['default'] / results['fast']:.1f}x")
@@ -1,11 +1,21 @@
 import uuid as uuid
-from datetime import datetime
+from datetime import datetime, timezone
 from domains.view_models import UserDTO, MessageDTO, GroupDTO, DirectMessageDTO
 
 DEFAULT_STATUS = "Hi I just joined Baqir's chat app!"
 MESSAGE_EDIT_ALLOWED_TIME = 60 #seconds
 MESSAGE_DELETE_ALLOWED_TIME = 120 #seconds
 
+def dm_pair_key(user1_id: str, user2_id: str) -> str:
+    # Canonical id of the conversation between two users, whoever sent first
+    return f"{min(user1_id, user2_id)}|{max(user1_id, user2_id)}"
+
+def now_millis() -> datetime:
+    # Aware UTC (the Mongo clients are tz_aware, so stored dates read back the
+    # same), truncated to the millisecond precision of BSON dates
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
 class User():
     def __init__(self):
         self.username = None
@@ -17,6 +27,17 @@ class User():
         self.email = None
         self.password = None
 
+    @classmethod
+    def from_dto(cls, user_dto: UserDTO) -> "User":
+        user = cls()
+        user.username = user_dto.username
+        user.status = user_dto.status
+        user.email = user_dto.email
+        user.user_id = user_dto.user_id
+        user.joined_at = datetime.fromisoformat(user_dto.joined_at) if user_dto.joined_at else None
+        user.updated_at = datetime.fromisoformat(user_dto.updated_at) if user_dto.updated_at else None
+        return user
+
     def create_user(self, username: str, email: str, password: str) -> None:
         self.username = username
         self.status = DEFAULT_STATUS
@@ -71,14 +92,14 @@ class Message():
     def create_message(self, sender_id: str, content: str,reciever_user_id : str | None,reciever_group_id: str|None) -> None:
         self.sender_id = sender_id
         self.content = content
-        self.sent_at = datetime.now()
+        self.sent_at = now_millis()
         self.message_id = str(uuid.uuid4())
-        self.updated_at = datetime.now()
+        self.updated_at = self.sent_at
         self.reciever_user_id = reciever_user_id
         self.reciever_group_id = reciever_group_id
 
     def update_time_checker(self) -> bool:
-        current_time = datetime.now()
+        current_time = datetime.now(timezone.utc)
         if (current_time - self.sent_at).total_seconds() > MESSAGE_EDIT_ALLOWED_TIME:
             return False
         else:
@@ -92,10 +113,10 @@ class Message():
                 raise ValueError("Content cannot be empty.")
             else:
                 self.content = new_content
-                self.updated_at = datetime.now()
+                self.updated_at = now_millis()
 
     def delete_message(self) -> bool:
-        current_time = datetime.now()
+        current_time = datetime.now(timezone.utc)
         if (current_time - self.sent_at).total_seconds() > MESSAGE_DELETE_ALLOWED_TIME:
             raise ValueError("Message delete time limit exceeded.")
         else:
@@ -105,9 +126,9 @@ class Message():
         message_dto = MessageDTO(
             sender_id=self.sender_id,
             content=self.content,
-            sent_at=self.sent_at.isoformat(),
+            sent_at=self.sent_at,
             message_id=str(self.message_id),
-            updated_at=self.updated_at.isoformat(),
+            updated_at=self.updated_at,
             reciever_user_id=self.reciever_user_id,
             reciever_group_id=self.reciever_group_id
         )
@@ -117,6 +138,19 @@ class Group():
     def __init__(self):
         pass
 
+    @classmethod
+    def from_dto(cls, group_dto: GroupDTO) -> "Group":
+        group = cls()
+        group.group_id = group_dto.group_id
+        group.group_name = group_dto.group_name
+        group.group_description = group_dto.group_description
+        group.created_at = datetime.fromisoformat(group_dto.created_at)
+        group.updated_at = datetime.fromisoformat(group_dto.updated_at)
+        group.members = list(group_dto.members)
+        group.member_set = set(group.members)
+        group.admin_id = group_dto.admin
+        return group
+
     def create_group(self, group_name: str, group_description: str | None, admin_id: str | None) -> None:
         self.group_id = str(uuid.uuid4())
         self.group_name = group_name
@@ -124,18 +158,21 @@ class Group():
         self.created_at = datetime.now()
         self.updated_at = datetime.now()
         self.members = []
+        self.member_set = set()  # O(1) membership checks, members keeps the order
         self.admin_id = admin_id
 
     def add_member(self, member_id: str) -> None:
-        if member_id not in self.members:
+        if member_id not in self.member_set:
             self.members.append(member_id)
+            self.member_set.add(member_id)
             self.updated_at = datetime.now()
         else:
             raise ValueError("Member already exists in the group.")
     
     def remove_member(self, member_id: str) -> None:
-        if member_id in self.members:
+        if member_id in self.member_set:
             self.members.remove(member_id)
+            self.member_set.discard(member_id)
             self.updated_at = datetime.now()
         else:
             raise ValueError("Member does not exist in the group.")
@@ -167,6 +204,7 @@ class DirectMessage():
         self.chat_id = str(uuid.uuid4())
         self.user1_id = user1_id
         self.user2_id = user2_id
+        self.pair_key = dm_pair_key(user1_id, user2_id)
         self.created_at = datetime.now()
         self.updated_at = datetime.now()
     
@@ -176,7 +214,8 @@ class DirectMessage():
             user1_id = self.user1_id,
             user2_id = self.user2_id,
             created_at = self.created_at.isoformat(),
-            updated_at = self.updated_at.isoformat()
+            updated_at = self.updated_at.isoformat(),
+            pair_key = self.pair_key
         )
         return dm_dto
 
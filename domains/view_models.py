@@ -1,6 +1,7 @@
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 MESSAGE_DELETE_ALLOWED_TIME = 60 * 60
+SNIPPET_LENGTH = 100  # characters of the last message kept in chat summaries
 
 class UserDTO(BaseModel): #actual dto for api responses since it contains pw hash
     username: str
@@ -24,20 +25,43 @@ class UserDTODBO(BaseModel):
 class MessageDTO(BaseModel):
     sender_id: str
     content: str
-    sent_at: str
+    sent_at: datetime  # UTC, stored as BSON dates, serialized to ISO strings at the API edge
     message_id: str
-    updated_at: str
+    updated_at: datetime
     reciever_user_id: str | None = None
     reciever_group_id: str | None = None
 
     def delete_message(self) -> bool:
-        current_time = datetime.now()
-        sent_at_dt = datetime.fromisoformat(self.sent_at)  #converting string to datetime isoformat obj
-        if (current_time - sent_at_dt).total_seconds() > MESSAGE_DELETE_ALLOWED_TIME:
+        current_time = datetime.now(timezone.utc)
+        if (current_time - self.sent_at).total_seconds() > MESSAGE_DELETE_ALLOWED_TIME:
             raise ValueError("Message delete time limit exceeded.")
         else:
             return True
 
+class MessagePage(BaseModel):
+    messages: list[MessageDTO] = []
+    next_cursor: str | None = None  # pass back as the same before/after parameter to continue
+
+class UserDirectoryPage(BaseModel):
+    users: list[dict] = []  # only the requested fields
+    next_cursor: str | None = None  # pass back as after to continue
+    total_estimate: int | None = None
+
+class ChatSummaryDTO(BaseModel):
+    user_id: str
+    chat_id: str  # group_id, or dm_pair_key of the two users for direct messages
+    chat_type: str | None = None  # "group" or "dm"
+    peer_id: str | None = None  # the other user of a direct message chat
+    unread: int = 0
+    last_read_at: datetime | None = None
+    last_read_message_id: str | None = None
+    last_message: dict | None = None  # message_id, sender_id, snippet, sent_at
+    last_message_at: datetime | None = None
+
+class InboxPage(BaseModel):
+    chats: list[ChatSummaryDTO] = []
+    next_cursor: str | None = None  # pass back as before to continue
+
 class GroupDTO(BaseModel):
     group_id: str
     group_name: str
@@ -52,4 +76,5 @@ class DirectMessageDTO(BaseModel):
     user1_id : str
     user2_id : str
     created_at : str
-    updated_at : str
\ No newline at end of file
+    updated_at : str
+    pair_key : str | None = None  # dm_pair_key(user1_id, user2_id), missing on chats not yet backfilled
\ No newline at end of file
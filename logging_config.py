@@ -0,0 +1,128 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+
+# Logging is configured once per process by configure_logging(), called from
+# main.py and the CLI entry points. Application code only does
+# logging.getLogger(__name__) and passes arguments lazily ("%s", value) so
+# records that are filtered out are never formatted.
+#
+# Records go through a QueueHandler and are written by a background
+# QueueListener, so request handlers never block on stdout. Before being
+# queued they are:
+#   - sampled: below WARNING, LOG_SAMPLE_RATES="repos=0.01,services.commands=0.1"
+#     keeps that fraction of records per logger prefix (longest prefix wins)
+#   - redacted: password/token values and JWTs are masked
+#   - truncated to LOG_MAX_LENGTH characters
+# LOG_FORMAT=json writes one JSON object per line, anything else plain text.
+
+REDACTED = "***"
+SECRET_FIELDS = re.compile(r"""(['"]?(?:password|hashed_password|token|access_token|secret)['"]?\s*[:=]\s*)(['"])[^'"]*\2""", re.IGNORECASE)
+JWT = re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]+")
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: dict[str, float]) -> None:
+        super().__init__()
+        # longest prefix first so "repos.cache" can override "repos"
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                return rate >= 1 or random.random() < rate
+        return True
+
+class RedactingFilter(logging.Filter):
+    # Formats the message once, masks secrets and caps its length
+    def __init__(self, max_length: int = 2000) -> None:
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        message = SECRET_FIELDS.sub(lambda m: f"{m.group(1)}{m.group(2)}{REDACTED}{m.group(2)}", message)
+        message = JWT.sub(REDACTED, message)
+        if len(message) > self.max_length:
+            message = f"{message[:self.max_length]}... ({len(message)} chars)"
+        record.msg = message
+        record.args = None
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def parse_sample_rates(value: str) -> dict[str, float]:
+    rates = {}
+    for part in value.split(","):
+        if "=" in part:
+            prefix, rate = part.split("=", 1)
+            rates[prefix.strip()] = float(rate)
+    return rates
+
+class NonBlockingQueueHandler(QueueHandler):
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # A full queue means stdout can't keep up, drop instead of stalling the caller
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+listener: QueueListener | None = None
+
+def configure_logging() -> None:
+    global listener
+    if listener is not None:
+        return
+    load_dotenv()
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+
+    output = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    records = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(SamplingFilter(parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))))
+    handler.addFilter(RedactingFilter(int(os.getenv("LOG_MAX_LENGTH", "2000"))))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    listener = QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging() -> None:
+    # Flushes queued records, registered with atexit by configure_logging
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+def metrics() -> dict:
+    return {
+        "queued": listener.queue.qsize() if listener is not None else 0,
+        "dropped": NonBlockingQueueHandler.dropped,
+    }
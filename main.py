@@ -1,7 +1,18 @@
 
+from logging_config import configure_logging
+configure_logging()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from api.api import router
+import os
+from uow import pool, async_pool
+from repos.indexes import ensure_indexes
+from services.connection_registry import registry
+from services.write_behind import message_write_buffer
+from services.presence import presence_service
+from services.group_fanout import group_broadcaster
+from auth import password_pool
 
 app = FastAPI(
     title="Baqir's Chat app backend",
@@ -18,6 +29,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# SERVERLESS=true (set by serverless.py) skips the work that only pays off
+# in a long running server: index creation on every cold start and the
+# WebSocket background services (fan-out broker, presence flushes,
+# write-behind), which serverless functions can't keep running.
+SERVERLESS = os.getenv("SERVERLESS", "false").lower() == "true"
+
+@app.on_event("startup")
+async def open_db_pool():
+    connection = pool.open()
+    async_pool.open()
+    if os.getenv("ENSURE_INDEXES", "false" if SERVERLESS else "true").lower() == "true":
+        ensure_indexes(connection.db)
+    if SERVERLESS:
+        return
+    await registry.start()
+    await group_broadcaster.start()
+    await presence_service.start()
+    if message_write_buffer is not None:
+        await message_write_buffer.start()
+
+@app.on_event("shutdown")
+async def close_db_pool():
+    if not SERVERLESS:
+        await presence_service.stop()
+        await group_broadcaster.stop()
+        await registry.stop()
+        if message_write_buffer is not None:
+            await message_write_buffer.stop()
+    password_pool.shutdown()
+    pool.close()
+    await async_pool.close()
+
 app.include_router(router, prefix="/api/v1", tags=["todos"])
 
 @app.get("/")
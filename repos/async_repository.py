@@ -0,0 +1,567 @@
+import logging
+from typing import Optional
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.asynchronous.mongo_client import AsyncMongoClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+from datetime import datetime
+from domains.models import dm_pair_key
+from domains.view_models import UserDTO, UserDirectoryPage, MessageDTO, MessagePage, GroupDTO, DirectMessageDTO, ChatSummaryDTO, InboxPage, SNIPPET_LENGTH
+from repos.pagination import encode_cursor, keyset_branches, encode_username_cursor, directory_query, directory_projection, encode_inbox_cursor, inbox_query, MESSAGE_PROJECTION, conversation_query, user_messages_query, keyset_range
+
+# Async counterparts of repos.repository, same method surface but every
+# database call is awaited so the event loop is never blocked.
+
+logger = logging.getLogger(__name__)
+
+class AsyncUserRepository:
+    db: AsyncDatabase
+    collection: AsyncCollection
+    client: AsyncMongoClient
+
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.db = connection.db
+        self.collection = self.db["users"]
+        self.client = connection.client
+
+    async def save(self, user_dto: UserDTO) -> str:
+        try:
+            user_data = user_dto.dict(exclude_none=True)
+            if "_id" in user_data:
+                del user_data["_id"]
+            result = await self.collection.insert_one(user_data)
+            logger.debug("User inserted (ID: %s) | Data: %s", result.inserted_id, user_data)
+            return result.inserted_id
+        except Exception as e:
+            logger.error("Error saving user to database: %s", e)
+            raise Exception(f"Database error while saving user: {str(e)}")
+
+    async def get(self, user_id: str) -> Optional[UserDTO]:
+        try:
+            user_data = await self.collection.find_one({"user_id": user_id})
+            if user_data:
+                logger.debug("User retrieved: %s", user_data)
+                return UserDTO(**user_data)
+            logger.info("No user found with user_id: %s", user_id)
+            return None
+        except Exception as e:
+            logger.error("Error retrieving user from database: %s", e)
+            raise Exception(f"Database error while retrieving user: {str(e)}")
+
+    async def get_by_username(self, username: str) -> Optional[UserDTO]:
+        try:
+            user_data = await self.collection.find_one({"username": username})
+            if user_data:
+                return UserDTO(**user_data)
+            return None
+        except Exception as e:
+            logger.error("Error retrieving user by username: %s", e)
+            raise
+
+    async def existing_user_ids(self, user_ids: list[str]) -> set[str]:
+        # One $in round trip to check many users exist, only the id is projected
+        try:
+            docs = self.collection.find({"user_id": {"$in": list(set(user_ids))}}, {"user_id": 1, "_id": 0})
+            return {doc["user_id"] async for doc in docs}
+        except Exception as e:
+            logger.error("Error checking users in database: %s", e)
+            raise Exception(f"Database error while checking users: {str(e)}")
+
+    async def find_directory(self, prefix: str | None, limit: int, after: str | None, fields) -> UserDirectoryPage:
+        try:
+            cursor = self.collection.find(directory_query(prefix, after), directory_projection(fields)).sort("username", 1).limit(limit + 1)
+            users = [user async for user in cursor]
+            has_more = len(users) > limit
+            users = users[:limit]
+            next_cursor = encode_username_cursor(users[-1]["username"]) if has_more else None
+            # metadata based count, cheap but ignores the prefix
+            total = await self.collection.estimated_document_count()
+            return UserDirectoryPage(users=users, next_cursor=next_cursor, total_estimate=total)
+        except ValueError:
+            raise
+        except Exception as e:
+            logger.error("Error retrieving user directory: %s", e)
+            raise Exception(f"Database error while retrieving user directory: {str(e)}")
+
+    async def get_last_seen(self, user_ids: list[str]) -> dict:
+        try:
+            docs = self.collection.find({"user_id": {"$in": list(set(user_ids))}}, {"user_id": 1, "last_seen": 1, "_id": 0})
+            return {doc["user_id"]: doc.get("last_seen") async for doc in docs}
+        except Exception as e:
+            logger.error("Error retrieving last seen times: %s", e)
+            raise Exception(f"Database error while retrieving last seen times: {str(e)}")
+
+    async def set_last_seen(self, last_seen: dict) -> None:
+        # user_id -> datetime, written in one unordered bulk write
+        try:
+            await self.collection.bulk_write(
+                [UpdateOne({"user_id": user_id}, {"$set": {"last_seen": seen}}) for user_id, seen in last_seen.items()],
+                ordered=False,
+            )
+        except Exception as e:
+            logger.error("Error saving last seen times: %s", e)
+            raise Exception(f"Database error while saving last seen times: {str(e)}")
+
+    async def update(self, user_id: str, user_dto: UserDTO) -> None:
+        try:
+            user_data = user_dto.dict(exclude_unset=True, exclude_none=True)
+            if "_id" in user_data:
+                del user_data["_id"]
+            result = await self.collection.update_one({"user_id": user_id}, {"$set": user_data})
+            logger.info("User updated (user_id: %s) | Matched: %s | Modified: %s", user_id, result.matched_count, result.modified_count)
+            if result.matched_count == 0:
+                logger.warning("No user found with user_id %s for update", user_id)
+        except Exception as e:
+            logger.error("Error updating user in database: %s", e)
+            raise Exception(f"Database error while updating user: {str(e)}")
+
+    async def delete(self, user_id: str) -> None:
+        try:
+            result = await self.collection.delete_one({"user_id": user_id})
+            logger.info("User deleted (user_id: %s) | Deleted count: %s", user_id, result.deleted_count)
+            if result.deleted_count == 0:
+                logger.warning("No user found with user_id %s for deletion", user_id)
+        except Exception as e:
+            logger.error("Error deleting user from database: %s", e)
+            raise Exception(f"Database error while deleting user: {str(e)}")
+
+class AsyncMessageRepository:
+    db: AsyncDatabase
+    collection: AsyncCollection
+    client: AsyncMongoClient
+
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.db = connection.db
+        self.collection = self.db["messages"]
+        self.client = connection.client
+
+    async def save(self, message_dto: MessageDTO) -> str:
+        try:
+            message_data = message_dto.dict(exclude_none=True)
+            if "reciever_user_id" in message_data:
+                message_data["reciever_user_id"] = str(message_data["reciever_user_id"])
+
+            result = await self.collection.insert_one(message_data)
+            logger.debug("Message inserted (ID: %s) | Data: %s", result.inserted_id, message_data)
+            return result.inserted_id
+        except Exception as e:
+            logger.error("Error saving message to database: %s", e)
+            raise Exception(f"Database error while saving message: {str(e)}")
+
+    async def save_many(self, message_dtos: list[MessageDTO]) -> dict[int, str]:
+        # see MessageRepository.save_many
+        if not message_dtos:
+            return {}
+        documents = [dto.dict(exclude_none=True) for dto in message_dtos]
+        try:
+            result = await self.collection.insert_many(documents, ordered=False)
+            logger.info("Messages inserted: %s", len(result.inserted_ids))
+            return {}
+        except BulkWriteError as e:
+            errors = {err["index"]: err.get("errmsg", "write error") for err in e.details.get("writeErrors", [])}
+            logger.error("Bulk insert of messages partially failed: %s/%s", len(errors), len(documents))
+            return errors
+        except Exception as e:
+            logger.error("Error saving messages to database: %s", e)
+            raise Exception(f"Database error while saving messages: {str(e)}")
+
+    async def get(self, message_id: str | None, sender_id: str | None) -> Optional[MessageDTO]:
+        try:
+            if message_id is not None:
+                message_data = await self.collection.find_one({"message_id": message_id})
+            elif sender_id is not None:
+                message_data = await self.collection.find_one({"sender_id": sender_id})
+            else:
+                message_data = None
+
+            if message_data:
+                logger.debug("Message retrieved: %s", message_data)
+                return MessageDTO(**message_data)
+            logger.info("No message found with provided criteria")
+            return None
+        except Exception as e:
+            logger.error("Error retrieving message: %s", e)
+            raise
+
+    async def get_conversation(self, user1_id: str, user2_id: str) -> list[MessageDTO]:
+        try:
+            messages = self.collection.find({
+                "$or": [
+                    {
+                        "sender_id": user1_id,
+                        "reciever_user_id": user2_id
+                    },
+                    {
+                        "sender_id": user2_id,
+                        "reciever_user_id": user1_id
+                    }
+                ]
+            }).sort("sent_at", 1)
+
+            return [MessageDTO(**msg) async for msg in messages]
+        except Exception as e:
+            logger.error("Error retrieving conversation: %s", e)
+            raise
+
+    async def get_messages_for_user(self, user_id: str) -> list[MessageDTO]:
+        try:
+            messages = self.collection.find({
+                "$or": [
+                    {"sender_id": user_id},
+                    {"reciever_user_id": user_id}
+                ]
+            }).sort("sent_at", -1)
+
+            return [MessageDTO(**msg) async for msg in messages]
+        except Exception as e:
+            logger.error("Error retrieving messages for user: %s", e)
+            raise
+
+    async def find_page(self, query: dict, limit: int, before: str | None = None, after: str | None = None, ascending: bool = False, raw: bool = False) -> MessagePage | dict:
+        # see MessageRepository.find_page
+        try:
+            older = after is None
+            direction = -1 if older else 1
+            page_query = keyset_branches(query, before if older else after, older)
+            cursor = self.collection.find(page_query, MESSAGE_PROJECTION).sort(
+                [("sent_at", direction), ("message_id", direction)]
+            ).limit(limit + 1)
+
+            docs = [msg async for msg in cursor]
+            has_more = len(docs) > limit
+            docs = docs[:limit]
+            next_cursor = encode_cursor(docs[-1]["sent_at"], docs[-1]["message_id"]) if has_more else None
+            if ascending == older:
+                docs.reverse()
+            for msg in docs:
+                msg.setdefault("updated_at", msg.get("sent_at"))
+                # stored with exclude_none, raw pages still return both receiver fields
+                msg.setdefault("reciever_user_id", None)
+                msg.setdefault("reciever_group_id", None)
+            if raw:
+                return {"messages": docs, "next_cursor": next_cursor}
+            return MessagePage(messages=[MessageDTO(**msg) for msg in docs], next_cursor=next_cursor)
+        except Exception as e:
+            logger.error("Error retrieving message page: %s", e)
+            raise
+
+    async def get_conversation_page(self, user1_id: str, user2_id: str, limit: int, before: str | None = None, after: str | None = None, raw: bool = False) -> MessagePage | dict:
+        return await self.find_page(conversation_query(user1_id, user2_id), limit, before, after, ascending=True, raw=raw)
+
+    async def get_messages_for_user_page(self, user_id: str, limit: int, before: str | None = None, after: str | None = None, raw: bool = False) -> MessagePage | dict:
+        return await self.find_page(user_messages_query(user_id), limit, before, after, raw=raw)
+
+    async def get_messages_by_sender_page(self, sender_id: str, limit: int, before: str | None = None, after: str | None = None, raw: bool = False) -> MessagePage | dict:
+        return await self.find_page({"sender_id": sender_id}, limit, before, after, raw=raw)
+
+    async def count_unread(self, query: dict, sent_at: datetime, message_id: str, user_id: str) -> int:
+        # see MessageRepository.count_unread
+        after = keyset_range(query, sent_at, message_id, older=False)
+        own = await self.collection.find_one(
+            {"$and": [after, {"sender_id": user_id}]},
+            {"sent_at": 1, "message_id": 1},
+            sort=[("sent_at", -1), ("message_id", -1)],
+        )
+        if own is not None:
+            after = keyset_range(query, own["sent_at"], own["message_id"], older=False)
+        return await self.collection.count_documents({"$and": [after, {"sender_id": {"$ne": user_id}}]})
+
+    async def export(self, query: dict, batch_size: int, after: str | None = None):
+        # see MessageRepository.export
+        cursor = self.collection.find(keyset_branches(query, after, older=False), MESSAGE_PROJECTION).sort(
+            [("sent_at", 1), ("message_id", 1)]
+        ).batch_size(batch_size)
+        batch = []
+        async for msg in cursor:
+            msg.setdefault("updated_at", msg.get("sent_at"))
+            batch.append(msg)
+            if len(batch) == batch_size:
+                yield batch, encode_cursor(msg["sent_at"], msg["message_id"])
+                batch = []
+        if batch:
+            yield batch, encode_cursor(batch[-1]["sent_at"], batch[-1]["message_id"])
+
+    def export_conversation(self, user1_id: str, user2_id: str, batch_size: int, after: str | None = None):
+        return self.export(conversation_query(user1_id, user2_id), batch_size, after)
+
+    def export_messages_for_user(self, user_id: str, batch_size: int, after: str | None = None):
+        return self.export(user_messages_query(user_id), batch_size, after)
+
+    async def update(self, message_id: str, message_dto: MessageDTO) -> None:
+        message_data = message_dto.dict()
+        result = await self.collection.update_one({"message_id": message_id}, {"$set": message_data})
+        logger.debug("Message updated (ID: %s) | Matched: %s | Data: %s", message_id, result.matched_count, message_data)
+
+    async def delete(self, message_id: str) -> None:
+        result = await self.collection.delete_one({"message_id": message_id})
+        logger.info("Message deleted (ID: %s) | Deleted count: %s", message_id, result.deleted_count)
+
+class AsyncGroupRepository:
+    db: AsyncDatabase
+    collection: AsyncCollection
+    client: AsyncMongoClient
+
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.db = connection.db
+        self.collection = self.db["groups"]
+        self.client = connection.client
+
+    async def save(self, group_dto: GroupDTO) -> str:
+        group_data = group_dto.dict()
+        result = await self.collection.insert_one(group_data)
+        logger.debug("Group inserted (ID: %s) | Data: %s", result.inserted_id, group_data)
+        return result.inserted_id
+
+    async def get(self, group_id: str | None, member_id: str | None) -> Optional[GroupDTO]:
+        if group_id is not None:
+            group_data = await self.collection.find_one({"group_id": group_id})
+        elif member_id is not None:
+            group_data = await self.collection.find_one({"members": member_id})
+        else:
+            group_data = None
+
+        if group_data:
+            logger.debug("Group retrieved: %s", group_data)
+            return GroupDTO(**group_data)
+        logger.info("No group found with provided criteria")
+        return None
+
+    async def update(self, group_id: str, group_dto: GroupDTO) -> Optional[GroupDTO]:
+        # see GroupRepository.update
+        group_data = group_dto.dict(include={"group_name", "group_description", "admin", "updated_at"})
+        updated = await self.collection.find_one_and_update(
+            {"group_id": group_id},
+            {"$set": group_data},
+            return_document=ReturnDocument.AFTER,
+        )
+        logger.debug("Group updated (ID: %s) | Matched: %s | Data: %s", group_id, updated is not None, group_data)
+        return GroupDTO(**updated) if updated else None
+
+    async def add_members(self, group_id: str, member_ids: list[str], updated_at: str, strict: bool = False) -> Optional[GroupDTO]:
+        # see GroupRepository.add_members
+        query = {"group_id": group_id}
+        if strict:
+            query["members"] = {"$nin": member_ids}
+        group_data = await self.collection.find_one_and_update(
+            query,
+            {"$addToSet": {"members": {"$each": member_ids}}, "$set": {"updated_at": updated_at}},
+            return_document=ReturnDocument.AFTER,
+        )
+        logger.info("Group members added (ID: %s) | Members: %s | Matched: %s", group_id, len(member_ids), group_data is not None)
+        return GroupDTO(**group_data) if group_data else None
+
+    async def remove_members(self, group_id: str, member_ids: list[str], updated_at: str, strict: bool = False) -> Optional[GroupDTO]:
+        # see GroupRepository.remove_members
+        query = {"group_id": group_id}
+        if strict:
+            query["members"] = {"$all": member_ids}
+        group_data = await self.collection.find_one_and_update(
+            query,
+            {"$pull": {"members": {"$in": member_ids}}, "$set": {"updated_at": updated_at}},
+            return_document=ReturnDocument.AFTER,
+        )
+        logger.info("Group members removed (ID: %s) | Members: %s | Matched: %s", group_id, len(member_ids), group_data is not None)
+        return GroupDTO(**group_data) if group_data else None
+
+    async def delete(self, group_id: str) -> None:
+        result = await self.collection.delete_one({"group_id": group_id})
+        logger.info("Group deleted (ID: %s) | Deleted count: %s", group_id, result.deleted_count)
+
+class AsyncDirectMessageRepository:
+    db: AsyncDatabase
+    collection: AsyncCollection
+    client: AsyncMongoClient
+
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.db = connection.db
+        self.collection = self.db["direct_messages"]
+        self.client = connection.client
+
+    async def save(self, direct_message_dto: DirectMessageDTO) -> str:
+        dm_data = direct_message_dto.dict()
+        result = await self.collection.insert_one(dm_data)
+        logger.debug("DirectMessage inserted (ID: %s) | Data: %s", result.inserted_id, dm_data)
+        return result.inserted_id
+
+    async def get(self, chat_id: str | None, user1_id: str | None, user2_id: str | None) -> Optional[DirectMessageDTO]:
+        if chat_id is not None:
+            dm_data = await self.collection.find_one({"chat_id": chat_id})
+        elif user1_id is not None:
+            dm_data = await self.collection.find_one({"user1_id": user1_id})
+        elif user2_id is not None:
+            dm_data = await self.collection.find_one({"user2_id": user2_id})
+        else:
+            dm_data = None
+
+        if dm_data:
+            logger.debug("DirectMessage retrieved: %s", dm_data)
+            return DirectMessageDTO(**dm_data)
+        logger.info("No direct message found with provided criteria")
+        return None
+
+    async def get_or_create(self, direct_message_dto: DirectMessageDTO) -> tuple[DirectMessageDTO, bool]:
+        query = {"pair_key": direct_message_dto.pair_key}
+        try:
+            dm_data = await self.collection.find_one_and_update(
+                query,
+                {"$setOnInsert": direct_message_dto.dict()},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # lost an upsert race to another request, its chat is the one to use
+            dm_data = await self.collection.find_one(query)
+        created = dm_data["chat_id"] == direct_message_dto.chat_id
+        logger.info("DirectMessage get-or-create (Pair: %s) | Created: %s", direct_message_dto.pair_key, created)
+        return DirectMessageDTO(**dm_data), created
+
+    async def get_by_pair(self, user1_id: str, user2_id: str) -> Optional[DirectMessageDTO]:
+        dm_data = await self.collection.find_one({"pair_key": dm_pair_key(user1_id, user2_id)})
+        return DirectMessageDTO(**dm_data) if dm_data else None
+
+    async def update(self, chat_id: str, direct_message_dto: DirectMessageDTO) -> None:
+        dm_data = direct_message_dto.dict()
+        result = await self.collection.update_one({"chat_id": chat_id}, {"$set": dm_data})
+        logger.debug("DirectMessage updated (Chat ID: %s) | Matched: %s | Data: %s", chat_id, result.matched_count, dm_data)
+
+    async def delete(self, chat_id: str) -> None:
+        result = await self.collection.delete_one({"chat_id": chat_id})
+        logger.info("DirectMessage deleted (Chat ID: %s) | Deleted count: %s", chat_id, result.deleted_count)
+
+class AsyncChatSummaryRepository:
+    # see ChatSummaryRepository
+    db: AsyncDatabase
+    collection: AsyncCollection
+    client: AsyncMongoClient
+
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.db = connection.db
+        self.collection = self.db["chat_summaries"]
+        self.client = connection.client
+
+    async def record_messages(self, updates: dict) -> None:
+        ops = []
+        for (user_id, chat_id), update in updates.items():
+            last = update["last"]
+            changes = {
+                "chat_type": update["chat_type"],
+                "peer_id": update["peer_id"],
+                "last_message_at": last.sent_at,
+                "last_message": {
+                    "message_id": last.message_id,
+                    "sender_id": last.sender_id,
+                    "snippet": last.content[:SNIPPET_LENGTH],
+                    "sent_at": last.sent_at,
+                },
+            }
+            operation = {"$set": changes}
+            if update["read"] is not None:
+                read_dto, unread = update["read"]
+                changes.update(unread=unread, last_read_at=read_dto.sent_at, last_read_message_id=read_dto.message_id)
+            else:
+                operation["$inc"] = {"unread": update["unread"]}
+            ops.append(UpdateOne({"user_id": user_id, "chat_id": chat_id}, operation, upsert=True))
+        if not ops:
+            return
+        try:
+            await self.collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            logger.error("Error updating chat summaries: %s", e)
+            raise Exception(f"Database error while updating chat summaries: {str(e)}")
+
+    async def ensure_chats(self, chat_id: str, chat_type: str, user_ids: list[str], created_at: datetime, peers: dict | None = None) -> None:
+        # Adds an empty summary for users joining a chat, existing rows are left alone
+        ops = [
+            UpdateOne(
+                {"user_id": user_id, "chat_id": chat_id},
+                {"$setOnInsert": {
+                    "chat_type": chat_type,
+                    "peer_id": (peers or {}).get(user_id),
+                    "unread": 0,
+                    "last_message": None,
+                    "last_message_at": created_at,
+                }},
+                upsert=True,
+            )
+            for user_id in user_ids
+        ]
+        if ops:
+            await self.collection.bulk_write(ops, ordered=False)
+
+    async def remove_chats(self, chat_id: str, user_ids: list[str] | None = None) -> None:
+        # Drops the chat from user_ids' inboxes, or from everyone's without user_ids
+        query = {"chat_id": chat_id}
+        if user_ids is not None:
+            query["user_id"] = {"$in": user_ids}
+        result = await self.collection.delete_many(query)
+        logger.info("Chat summaries deleted (Chat ID: %s) | Deleted count: %s", chat_id, result.deleted_count)
+
+    async def message_edited(self, chat_id: str, message_dto: MessageDTO) -> None:
+        # Refreshes the preview of the rows showing this message as the chat's last one
+        await self.collection.update_many(
+            {"chat_id": chat_id, "last_message.message_id": message_dto.message_id},
+            {"$set": {"last_message.snippet": message_dto.content[:SNIPPET_LENGTH]}},
+        )
+
+    async def message_deleted(self, chat_id: str, message_dto: MessageDTO, latest: MessageDTO | None) -> None:
+        unread = {
+            "chat_id": chat_id,
+            "user_id": {"$ne": message_dto.sender_id},
+            "unread": {"$gt": 0},
+            "$or": [
+                {"last_read_at": None},
+                {"last_read_at": {"$lt": message_dto.sent_at}},
+                {"last_read_at": message_dto.sent_at, "last_read_message_id": {"$lt": message_dto.message_id}},
+            ],
+        }
+        preview = {"last_message": None}
+        if latest is not None:
+            preview = {
+                "last_message_at": latest.sent_at,
+                "last_message": {
+                    "message_id": latest.message_id,
+                    "sender_id": latest.sender_id,
+                    "snippet": latest.content[:SNIPPET_LENGTH],
+                    "sent_at": latest.sent_at,
+                },
+            }
+        await self.collection.bulk_write([
+            UpdateMany(unread, {"$inc": {"unread": -1}}),
+            UpdateMany({"chat_id": chat_id, "last_message.message_id": message_dto.message_id}, {"$set": preview}),
+        ], ordered=False)
+
+    async def mark_read(self, user_id: str, chat_id: str, message_id: str | None, read_at: datetime, unread: int = 0) -> Optional[ChatSummaryDTO]:
+        # Only existing rows are updated, None means the user isn't in the chat
+        summary_data = await self.collection.find_one_and_update(
+            {"user_id": user_id, "chat_id": chat_id},
+            {"$set": {"unread": unread, "last_read_at": read_at, "last_read_message_id": message_id}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        return ChatSummaryDTO(**summary_data) if summary_data else None
+
+    async def get_for_user(self, user_id: str) -> list[ChatSummaryDTO]:
+        summaries = self.collection.find({"user_id": user_id}, {"_id": 0, "last_message": 0})
+        return [ChatSummaryDTO(**summary_data) async for summary_data in summaries]
+
+    async def find_inbox(self, user_id: str, limit: int, before: str | None = None) -> InboxPage:
+        try:
+            cursor = self.collection.find(inbox_query(user_id, before), {"_id": 0}).sort(
+                [("last_message_at", -1), ("chat_id", -1)]
+            ).limit(limit + 1)
+            summaries = [summary_data async for summary_data in cursor]
+            has_more = len(summaries) > limit
+            summaries = summaries[:limit]
+            next_cursor = encode_inbox_cursor(summaries[-1]["last_message_at"], summaries[-1]["chat_id"]) if has_more else None
+            return InboxPage(chats=[ChatSummaryDTO(**summary_data) for summary_data in summaries], next_cursor=next_cursor)
+        except ValueError:
+            raise
+        except Exception as e:
+            logger.error("Error retrieving inbox: %s", e)
+            raise Exception(f"Database error while retrieving inbox: {str(e)}")
@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+from domains.view_models import UserDTO
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries also expire after ttl seconds.
+    Each worker has its own copy, use RedisCache to share entries (and
+    invalidations) between workers. Sync routes share it across FastAPI's
+    threadpool, so every access holds a lock.
+    """
+    def __init__(self, max_size: int = 10000, ttl: float = 60) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value, ttl: float | None = None) -> None:
+        # ttl overrides the cache default for this entry
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys: str) -> None:
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    # async aliases so the async repositories can share the same backends
+    async def aget(self, key: str):
+        return self.get(key)
+
+    async def aset(self, key: str, value) -> None:
+        self.set(key, value)
+
+    async def adelete(self, *keys: str) -> None:
+        self.delete(*keys)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"backend": "memory", "size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+class RedisCache:
+    """
+    Shared cache for multi-worker deployments, values are stored as JSON
+    with a Redis TTL. Sync and async clients are created on first use.
+    """
+    def __init__(self, url: str, ttl: float = 60, prefix: str = "cache:") -> None:
+        self.url = url
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.client = None
+        self.async_client = None
+        self.hits = 0
+        self.misses = 0
+
+    def _sync(self):
+        if self.client is None:
+            import redis
+            self.client = redis.from_url(self.url)
+        return self.client
+
+    def _async(self):
+        if self.async_client is None:
+            import redis.asyncio as redis
+            self.async_client = redis.from_url(self.url)
+        return self.async_client
+
+    def _loaded(self, raw):
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def get(self, key: str):
+        return self._loaded(self._sync().get(self.prefix + key))
+
+    def set(self, key: str, value) -> None:
+        self._sync().set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self._sync().delete(*(self.prefix + key for key in keys))
+
+    async def aget(self, key: str):
+        return self._loaded(await self._async().get(self.prefix + key))
+
+    async def aset(self, key: str, value) -> None:
+        await self._async().set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    async def adelete(self, *keys: str) -> None:
+        if keys:
+            await self._async().delete(*(self.prefix + key for key in keys))
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
+
+def user_id_key(user_id: str) -> str:
+    return f"user:id:{user_id}"
+
+def username_key(username: str) -> str:
+    return f"user:name:{username}"
+
+class CachedUserRepository:
+    """
+    Read-through cache in front of UserRepository for get/get_by_username,
+    invalidated on update/delete. Every other attribute is delegated to the
+    wrapped repository. Cache failures fall back to the database.
+    """
+    def __init__(self, repository, cache) -> None:
+        self.repository = repository
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.repository, name)
+
+    def _cached(self, key: str) -> Optional[UserDTO]:
+        try:
+            data = self.cache.get(key)
+            return UserDTO(**data) if data else None
+        except Exception as e:
+            logger.warning("User cache read failed: %s", e)
+            return None
+
+    def _store(self, user: UserDTO) -> None:
+        try:
+            data = user.dict()
+            self.cache.set(user_id_key(user.user_id), data)
+            self.cache.set(username_key(user.username), data)
+        except Exception as e:
+            logger.warning("User cache write failed: %s", e)
+
+    def _invalidate(self, *keys: str) -> None:
+        try:
+            self.cache.delete(*keys)
+        except Exception as e:
+            logger.warning("User cache invalidation failed: %s", e)
+
+    def get(self, user_id: str) -> Optional[UserDTO]:
+        user = self._cached(user_id_key(user_id))
+        if user is None:
+            user = self.repository.get(user_id)
+            if user is not None:
+                self._store(user)
+        return user
+
+    def get_by_username(self, username: str) -> Optional[UserDTO]:
+        user = self._cached(username_key(username))
+        if user is None:
+            user = self.repository.get_by_username(username)
+            if user is not None:
+                self._store(user)
+        return user
+
+    def existing_user_ids(self, user_ids: list[str]) -> set[str]:
+        found = {u for u in set(user_ids) if self._cached(user_id_key(u)) is not None}
+        missing = [u for u in set(user_ids) if u not in found]
+        if missing:
+            found |= self.repository.existing_user_ids(missing)
+        return found
+
+    def update(self, user_id: str, user_dto: UserDTO) -> None:
+        previous = self.get(user_id)
+        self.repository.update(user_id, user_dto)
+        keys = [user_id_key(user_id), username_key(user_dto.username)]
+        if previous is not None:
+            keys.append(username_key(previous.username))
+        self._invalidate(*keys)
+
+    def delete(self, user_id: str) -> None:
+        previous = self.get(user_id)
+        self.repository.delete(user_id)
+        keys = [user_id_key(user_id)]
+        if previous is not None:
+            keys.append(username_key(previous.username))
+        self._invalidate(*keys)
+
+class AsyncCachedUserRepository:
+    # Async counterpart of CachedUserRepository wrapping AsyncUserRepository
+    def __init__(self, repository, cache) -> None:
+        self.repository = repository
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.repository, name)
+
+    async def _cached(self, key: str) -> Optional[UserDTO]:
+        try:
+            data = await self.cache.aget(key)
+            return UserDTO(**data) if data else None
+        except Exception as e:
+            logger.warning("User cache read failed: %s", e)
+            return None
+
+    async def _store(self, user: UserDTO) -> None:
+        try:
+            data = user.dict()
+            await self.cache.aset(user_id_key(user.user_id), data)
+            await self.cache.aset(username_key(user.username), data)
+        except Exception as e:
+            logger.warning("User cache write failed: %s", e)
+
+    async def _invalidate(self, *keys: str) -> None:
+        try:
+            await self.cache.adelete(*keys)
+        except Exception as e:
+            logger.warning("User cache invalidation failed: %s", e)
+
+    async def get(self, user_id: str) -> Optional[UserDTO]:
+        user = await self._cached(user_id_key(user_id))
+        if user is None:
+            user = await self.repository.get(user_id)
+            if user is not None:
+                await self._store(user)
+        return user
+
+    async def get_by_username(self, username: str) -> Optional[UserDTO]:
+        user = await self._cached(username_key(username))
+        if user is None:
+            user = await self.repository.get_by_username(username)
+            if user is not None:
+                await self._store(user)
+        return user
+
+    async def existing_user_ids(self, user_ids: list[str]) -> set[str]:
+        found = {u for u in set(user_ids) if await self._cached(user_id_key(u)) is not None}
+        missing = [u for u in set(user_ids) if u not in found]
+        if missing:
+            found |= await self.repository.existing_user_ids(missing)
+        return found
+
+    async def update(self, user_id: str, user_dto: UserDTO) -> None:
+        previous = await self.get(user_id)
+        await self.repository.update(user_id, user_dto)
+        keys = [user_id_key(user_id), username_key(user_dto.username)]
+        if previous is not None:
+            keys.append(username_key(previous.username))
+        await self._invalidate(*keys)
+
+    async def delete(self, user_id: str) -> None:
+        previous = await self.get(user_id)
+        await self.repository.delete(user_id)
+        keys = [user_id_key(user_id)]
+        if previous is not None:
+            keys.append(username_key(previous.username))
+        await self._invalidate(*keys)
+
+def create_user_cache():
+    # USER_CACHE_URL=redis://... shares the cache between workers, otherwise it is per process
+    load_dotenv()
+    ttl = float(os.getenv("USER_CACHE_TTL", "60"))
+    url = os.getenv("USER_CACHE_URL")
+    if url:
+        return RedisCache(url, ttl=ttl)
+    return TTLCache(max_size=int(os.getenv("USER_CACHE_SIZE", "10000")), ttl=ttl)
+
+user_cache = create_user_cache()
@@ -0,0 +1,101 @@
+import logging
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Indexes required by the repositories and query services, keyed by collection.
+# Each compound index matches the equality fields of a hot query followed by its sort key.
+INDEXES: dict[str, list[IndexModel]] = {
+    "messages": [
+        IndexModel([("message_id", ASCENDING)], name="message_id_unique", unique=True),
+        # Every message query is a set of equality branches sorted by (sent_at, message_id)
+        # for keyset pagination, so each index ends with those two keys.
+        # get_conversation: {sender_id, reciever_user_id} per $or branch
+        IndexModel([("sender_id", ASCENDING), ("reciever_user_id", ASCENDING), ("sent_at", ASCENDING), ("message_id", ASCENDING)], name="conversation_keyset"),
+        # get_messages_for_user / get_messages_by_sender: one index per $or branch
+        IndexModel([("sender_id", ASCENDING), ("sent_at", DESCENDING), ("message_id", DESCENDING)], name="sender_keyset"),
+        IndexModel([("reciever_user_id", ASCENDING), ("sent_at", DESCENDING), ("message_id", DESCENDING)], name="receiver_user_keyset"),
+        IndexModel([("reciever_group_id", ASCENDING), ("sent_at", DESCENDING), ("message_id", DESCENDING)], name="receiver_group_keyset"),
+    ],
+    "users": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    "groups": [
+        IndexModel([("group_id", ASCENDING)], name="group_id_unique", unique=True),
+        # multikey index over the members array
+        IndexModel([("members", ASCENDING)], name="members"),
+    ],
+    "direct_messages": [
+        IndexModel([("chat_id", ASCENDING)], name="chat_id_unique", unique=True),
+        # get_or_create / get_by_pair, partial so chats the backfill hasn't reached are allowed
+        IndexModel([("pair_key", ASCENDING)], name="pair_key_unique", unique=True, partialFilterExpression={"pair_key": {"$type": "string"}}),
+        IndexModel([("user1_id", ASCENDING), ("user2_id", ASCENDING)], name="user1_user2"),
+        IndexModel([("user2_id", ASCENDING)], name="user2"),
+    ],
+    "chat_summaries": [
+        # one row per (user, chat), get_for_user reads a user's rows with the prefix
+        IndexModel([("user_id", ASCENDING), ("chat_id", ASCENDING)], name="user_chat_unique", unique=True),
+        # find_inbox: most recent chats first, keyset on (last_message_at, chat_id)
+        IndexModel([("user_id", ASCENDING), ("last_message_at", DESCENDING), ("chat_id", DESCENDING)], name="user_inbox"),
+        # every member's row of a chat: message edits/deletes and remove_chats
+        IndexModel([("chat_id", ASCENDING), ("user_id", ASCENDING)], name="chat_users"),
+    ],
+}
+
+def ensure_indexes(db: Database) -> None:
+    # createIndexes is a no-op for indexes that already exist with the same spec,
+    # so this is safe to run on every startup
+    for collection_name, indexes in INDEXES.items():
+        try:
+            names = db[collection_name].create_indexes(indexes)
+            logger.info("Ensured indexes on %s: %s", collection_name, names)
+        except OperationFailure as e:
+            # e.g. a unique index over existing duplicates, don't block startup on it
+            logger.error("Failed to ensure indexes on %s: %s", collection_name, e)
+
+def index_report(db: Database) -> dict:
+    """
+    Compares the declared indexes with what exists on the server.
+    Returns, per collection, the declared indexes that are missing and the
+    existing indexes with no recorded usage since the server last restarted.
+    """
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = set(collection.index_information().keys())
+        declared = {index.document["name"] for index in indexes}
+        try:
+            stats = collection.aggregate([{"$indexStats": {}}])
+            unused = sorted(
+                s["name"] for s in stats
+                if s["name"] != "_id_" and s["accesses"]["ops"] == 0
+            )
+        except OperationFailure as e:
+            logger.warning("Unable to read index stats for %s: %s", collection_name, e)
+            unused = []
+        report[collection_name] = {
+            "missing": sorted(declared - existing),
+            "undeclared": sorted(existing - declared - {"_id_"}),
+            "unused": unused,
+        }
+    return report
+
+if __name__ == "__main__":
+    # python -m repos.indexes [--report]
+    import json
+    import sys
+    from uow import pool
+
+    from logging_config import configure_logging
+    configure_logging()
+    db = pool.open().db
+    try:
+        if "--report" in sys.argv:
+            print(json.dumps(index_report(db), indent=2))
+        else:
+            ensure_indexes(db)
+    finally:
+        pool.close()
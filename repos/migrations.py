@@ -0,0 +1,138 @@
+import logging
+import time
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+from domains.models import dm_pair_key
+
+logger = logging.getLogger(__name__)
+
+# One-off data migrations, run with python -m repos.migrations <name>.
+# Each migration only selects documents that still need converting, so an
+# interrupted run is resumed by simply running it again.
+
+MESSAGE_DATE_FIELDS = ("sent_at", "updated_at")
+
+def _parse_date(value):
+    # The old strings were naive local time, astimezone treats them as such
+    try:
+        return datetime.fromisoformat(value).astimezone(timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+def convert_message_dates(db: Database, batch_size: int = 1000, dry_run: bool = False) -> dict:
+    """
+    Converts ISO string sent_at/updated_at fields on messages to BSON dates.
+    Documents are streamed in _id order, batch_size at a time, and updated
+    with one unordered bulk write per batch. Every update is conditional on
+    the string still being there, so it never overwrites a concurrent edit.
+    """
+    collection = db["messages"]
+    query = {"$or": [{field: {"$type": "string"}} for field in MESSAGE_DATE_FIELDS]}
+    projection = {field: 1 for field in MESSAGE_DATE_FIELDS}
+    total = collection.count_documents(query)
+    stats = {"total": total, "converted": 0, "invalid": 0}
+    logger.info("Converting dates on %s messages (batch size %s%s)", total, batch_size, ', dry run' if dry_run else '')
+
+    started = time.monotonic()
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        docs = list(collection.find(batch_query, projection).sort("_id", 1).limit(batch_size))
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+
+        updates = []
+        for doc in docs:
+            changes = {}
+            for field in MESSAGE_DATE_FIELDS:
+                if isinstance(doc.get(field), str):
+                    parsed = _parse_date(doc[field])
+                    if parsed is not None:
+                        changes[field] = parsed
+            if not changes:
+                logger.warning("Skipping message %s: unparseable dates", doc['_id'])
+                stats["invalid"] += 1
+                continue
+            condition = {"_id": doc["_id"], **{field: doc[field] for field in changes}}
+            updates.append(UpdateOne(condition, {"$set": changes}))
+
+        if updates and not dry_run:
+            result = collection.bulk_write(updates, ordered=False)
+            stats["converted"] += result.modified_count
+        else:
+            stats["converted"] += len(updates)
+
+        done = stats["converted"] + stats["invalid"]
+        rate = done / max(time.monotonic() - started, 1e-6)
+        logger.info("Progress: %s/%s messages (%.0f/s)", done, total, rate)
+
+    logger.info("Message date conversion finished: %s", stats)
+    return stats
+
+def backfill_dm_pair_keys(db: Database, batch_size: int = 1000, dry_run: bool = False) -> dict:
+    """
+    Sets pair_key on direct message chats created before it existed, in _id
+    order so the oldest chat of a pair gets the key. Later duplicates of the
+    same pair are rejected by pair_key_unique and left without a key (they
+    are reported, not deleted), so run python -m repos.indexes first.
+    """
+    collection = db["direct_messages"]
+    query = {"pair_key": {"$exists": False}}
+    total = collection.count_documents(query)
+    stats = {"total": total, "updated": 0, "duplicates": 0}
+    logger.info("Backfilling pair_key on %s DM chats (batch size %s%s)", total, batch_size, ', dry run' if dry_run else '')
+
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        docs = list(collection.find(batch_query, {"user1_id": 1, "user2_id": 1}).sort("_id", 1).limit(batch_size))
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+        updates = [
+            UpdateOne({"_id": doc["_id"], **query}, {"$set": {"pair_key": dm_pair_key(doc["user1_id"], doc["user2_id"])}})
+            for doc in docs
+        ]
+        if dry_run:
+            stats["updated"] += len(updates)
+        else:
+            try:
+                result = collection.bulk_write(updates, ordered=False)
+                stats["updated"] += result.modified_count
+            except BulkWriteError as e:
+                stats["updated"] += e.details.get("nModified", 0)
+                for error in e.details.get("writeErrors", []):
+                    if error.get("code") != 11000:
+                        raise
+                    stats["duplicates"] += 1
+        logger.info("Progress: %s/%s chats", stats['updated'] + stats['duplicates'], total)
+
+    logger.info("DM pair key backfill finished: %s", stats)
+    return stats
+
+MIGRATIONS = {
+    "message_dates": convert_message_dates,
+    "dm_pair_keys": backfill_dm_pair_keys,
+}
+
+if __name__ == "__main__":
+    # python -m repos.migrations <name> [--batch-size N] [--dry-run]
+    import argparse
+    from uow import pool
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name", choices=sorted(MIGRATIONS))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    from logging_config import configure_logging
+    configure_logging()
+    db = pool.open().db
+    try:
+        MIGRATIONS[args.name](db, batch_size=args.batch_size, dry_run=args.dry_run)
+    finally:
+        pool.close()
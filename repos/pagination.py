@@ -0,0 +1,131 @@
+import base64
+import json
+import re
+from datetime import datetime
+
+# Keyset pagination over messages ordered by (sent_at, message_id).
+# Cursors are opaque to clients: a urlsafe base64 encoding of the sort key
+# of the last message on the previous page.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Message pages only fetch the MessageDTO fields, so raw pages can be
+# serialized as they come out of the driver
+MESSAGE_FIELDS = ("sender_id", "content", "sent_at", "message_id", "updated_at", "reciever_user_id", "reciever_group_id")
+MESSAGE_PROJECTION = {"_id": 0, **{field: 1 for field in MESSAGE_FIELDS}}
+
+# Exports stream a whole history in (sent_at, message_id) order, fetching
+# EXPORT_BATCH_SIZE documents per round trip
+EXPORT_BATCH_SIZE = 500
+MAX_EXPORT_BATCH_SIZE = 5000
+
+def conversation_query(user1_id: str, user2_id: str) -> dict:
+    return {
+        "$or": [
+            {"sender_id": user1_id, "reciever_user_id": user2_id},
+            {"sender_id": user2_id, "reciever_user_id": user1_id}
+        ]
+    }
+
+def user_messages_query(user_id: str) -> dict:
+    return {
+        "$or": [
+            {"sender_id": user_id},
+            {"reciever_user_id": user_id}
+        ]
+    }
+
+def chat_messages_query(chat_id: str) -> dict:
+    # chat_id is a group_id or the dm_pair_key ("<user>|<user>") of a DM
+    if "|" in chat_id:
+        return conversation_query(*chat_id.split("|", 1))
+    return {"reciever_group_id": chat_id}
+
+def encode_cursor(sent_at: datetime, message_id: str) -> str:
+    # sent_at is still a string on documents the date migration hasn't reached
+    sent_at = sent_at.isoformat() if isinstance(sent_at, datetime) else sent_at
+    return _encode([sent_at, message_id])
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        sent_at, message_id = _decode(cursor)
+        return datetime.fromisoformat(sent_at), message_id
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+def _encode(key: list) -> str:
+    raw = json.dumps(key, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode(cursor: str) -> list:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+def keyset_branches(query: dict, cursor: str | None, older: bool) -> dict:
+    """
+    Restricts query to messages strictly before (older=True) or after the
+    cursor. Every $or branch of query is split in two so each branch stays a
+    single bounded range scan on its (..., sent_at, message_id) index.
+    """
+    if cursor is None:
+        return query
+    sent_at, message_id = decode_cursor(cursor)
+    return keyset_range(query, sent_at, message_id, older)
+
+def keyset_range(query: dict, sent_at: datetime, message_id: str, older: bool) -> dict:
+    op = "$lt" if older else "$gt"
+    branches = query.get("$or", [query])
+    keyset = []
+    for branch in branches:
+        keyset.append({**branch, "sent_at": {op: sent_at}})
+        keyset.append({**branch, "sent_at": sent_at, "message_id": {op: message_id}})
+    return {"$or": keyset}
+
+# The user directory is keyset paginated on the unique username index, with
+# an optional username prefix (an anchored, case-sensitive regex still uses
+# the index as a range scan).
+
+USER_DIRECTORY_FIELDS = ("user_id", "username", "status", "email", "joined_at")
+DEFAULT_USER_DIRECTORY_FIELDS = ("user_id", "username", "status")
+
+def encode_username_cursor(username: str) -> str:
+    return _encode([username])
+
+def directory_query(prefix: str | None, after: str | None) -> dict:
+    condition = {}
+    if prefix:
+        condition["$regex"] = "^" + re.escape(prefix)
+    if after is not None:
+        try:
+            condition["$gt"] = _decode(after)[0]
+        except Exception:
+            raise ValueError("Invalid pagination cursor")
+    return {"username": condition} if condition else {}
+
+def directory_projection(fields) -> dict:
+    # username is always returned since it is the sort key
+    unknown = set(fields) - set(USER_DIRECTORY_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown user fields: {', '.join(sorted(unknown))}")
+    return {"_id": 0, "username": 1, **{field: 1 for field in fields}}
+
+# The inbox lists a user's chat summaries by recency, keyset paginated on
+# (last_message_at, chat_id) descending.
+
+def encode_inbox_cursor(last_message_at: datetime, chat_id: str) -> str:
+    return _encode([last_message_at.isoformat(), chat_id])
+
+def inbox_query(user_id: str, before: str | None) -> dict:
+    query = {"user_id": user_id}
+    if before is None:
+        return query
+    try:
+        last_message_at, chat_id = _decode(before)
+        last_message_at = datetime.fromisoformat(last_message_at)
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+    return {"$or": [
+        {**query, "last_message_at": {"$lt": last_message_at}},
+        {**query, "last_message_at": last_message_at, "chat_id": {"$lt": chat_id}},
+    ]}
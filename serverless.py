@@ -0,0 +1,85 @@
+import os
+import time
+
+# Entry point for serverless deployments (vercel.json routes every request
+# here, api/index.py wraps it for AWS Lambda). Module state survives warm
+# invocations of the same instance, so the expensive parts run once per cold
+# start:
+#   - the Mongo client is created before the app is imported, its monitor
+#     threads connect and handshake while the routers load, and the pooled
+#     client is reused by every later invocation
+#   - SERVERLESS=true skips index creation and the WebSocket background
+#     services (see main.py), bcrypt and jose load on first use (see auth.py)
+# Responses carry an X-Cold-Start header and a Server-Timing header with the
+# init time on the first request, and /api/v1/metrics/serverless reports cold vs
+# warm request timing for this instance.
+
+init_started = time.perf_counter()
+os.environ.setdefault("SERVERLESS", "true")
+
+from logging_config import configure_logging
+configure_logging()
+
+from uow import pool
+pool.open()
+
+from main import app as main_app
+
+init_ms = (time.perf_counter() - init_started) * 1000
+
+class ColdStartTiming:
+    """
+    ASGI wrapper timing each HTTP request until its response headers are
+    sent. The first request of the instance is the cold one, its Server-Timing
+    header also reports the init time.
+    """
+    def __init__(self, app) -> None:
+        self.app = app
+        self.cold = True
+        self.stats = {
+            "init_ms": init_ms,
+            "cold_request_ms": None,
+            "warm_requests": 0,
+            "warm_ms_total": 0.0,
+            "warm_ms_max": 0.0,
+        }
+
+    def metrics(self) -> dict:
+        warm = self.stats["warm_requests"]
+        return {**self.stats, "warm_ms_avg": self.stats["warm_ms_total"] / warm if warm else 0.0}
+
+    def _record(self, cold: bool, elapsed_ms: float) -> None:
+        if cold:
+            self.stats["cold_request_ms"] = elapsed_ms
+        else:
+            self.stats["warm_requests"] += 1
+            self.stats["warm_ms_total"] += elapsed_ms
+            self.stats["warm_ms_max"] = max(self.stats["warm_ms_max"], elapsed_ms)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        cold, self.cold = self.cold, False
+        started = time.perf_counter()
+
+        async def send_with_timing(message) -> None:
+            if message["type"] == "http.response.start":
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self._record(cold, elapsed_ms)
+                timing = f"app;dur={elapsed_ms:.1f}"
+                if cold:
+                    timing = f"init;dur={init_ms:.1f}, {timing}"
+                headers = list(message.get("headers", []))
+                headers.append((b"x-cold-start", b"true" if cold else b"false"))
+                headers.append((b"server-timing", timing.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+app = ColdStartTiming(main_app)
+
+@main_app.get("/api/v1/metrics/serverless")
+def serverless_metrics():
+    return app.metrics()
@@ -0,0 +1,426 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+from uow import AsyncUnitOfWork
+from domains.view_models import UserDTO, MessageDTO, GroupDTO,DirectMessageDTO,UserDTODBO,ChatSummaryDTO
+from domains.models import User,Message,Group,DirectMessage,dm_pair_key,now_millis
+from services.membership import membership_index
+from typing import Optional
+from datetime import datetime
+from auth import password_pool, PasswordPoolBusy
+from services.commands import MAX_MESSAGE_BATCH_SIZE, build_message_batch, batch_user_ids, batch_group_ids, apply_batch_errors, validate_member_batch, summary_updates, message_chat_id
+from repos.pagination import chat_messages_query
+
+# Async counterparts of services.commands, used by the WebSocket path and async routes.
+
+class AsyncUserCommandService:
+    def __init__(self, uow: AsyncUnitOfWork):
+        self.uow = uow
+
+    async def create_user(self, username: str, email: str, password: str) -> UserDTO:
+        try:
+            user = User()
+            hashed_pw = await password_pool.hash(password)
+            user.create_user(username,email,hashed_pw)
+            user_dto = UserDTODBO(
+                username=user.username,
+                status=user.status,
+                email=user.email,
+                _id=user._id,
+                user_id = user.user_id,
+                joined_at=user.joined_at.isoformat() if user.joined_at else None,
+                updated_at=user.updated_at.isoformat() if user.updated_at else None,
+                password=hashed_pw
+            )
+            await self.uow.user_repository.save(user_dto)
+            return user_dto
+        except PasswordPoolBusy:
+            # surfaced as 503 + Retry-After by the routes, like login
+            raise
+        except Exception as e:
+            raise ValueError(f"Error creating user: {e}")
+
+    async def update_user(self, user_id: str, username: Optional[str], status: Optional[str], email: Optional[str]) -> UserDTO:
+        user_dto = await self.uow.user_repository.get(user_id)
+        if not user_dto:
+            raise ValueError("User not found")
+        try:
+            user = User.from_dto(user_dto)
+            user.update_user_details(username, status, email)
+            updated_dto = user.convert_to_dto()
+            await self.uow.user_repository.update(user_id, updated_dto)
+            return updated_dto
+        except Exception as e:
+            raise ValueError(f"Error updating user: {e}")
+
+    async def change_password(self, user_id: str, new_password: str) -> None:
+        user = await self.uow.user_repository.get(user_id)
+        if not user:
+            raise ValueError("User not found")
+        try:
+            user_data = user.dict()
+            user_data.update(password=await password_pool.hash(new_password), updated_at=datetime.now().isoformat())
+            await self.uow.user_repository.update(user_id, UserDTODBO(**user_data))
+        except PasswordPoolBusy:
+            # surfaced as 503 + Retry-After by the routes, like login
+            raise
+        except Exception as e:
+            raise ValueError(f"Error changing password: {e}")
+
+    async def delete_user(self, user_id: str) -> None:
+        user = await self.uow.user_repository.get(user_id)
+        if not user:
+            raise ValueError("User not found")
+        try:
+            await self.uow.user_repository.delete(user_id)
+        except Exception as e:
+            raise ValueError(f"Unable to delete user: {e}")
+
+background_tasks: set[asyncio.Task] = set()
+
+def run_in_background(fn, *args) -> None:
+    # defer for the WebSocket handler, the task runs once the handler has returned its reply
+    task = asyncio.create_task(fn(*args))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+class AsyncMessageCommandService:
+    def __init__(self, uow: AsyncUnitOfWork, write_buffer=None, defer=None):
+        self.uow = uow
+        # Optional WriteBehindBuffer, when set new messages are acknowledged
+        # before they are persisted and written in groups
+        self.write_buffer = write_buffer
+        # Optional defer(fn, *args), see MessageCommandService
+        self.defer = defer
+
+    async def after_reply(self, fn, *args) -> None:
+        if self.defer is not None:
+            self.defer(fn, *args)
+        else:
+            await fn(*args)
+
+    async def create_message(self, sender_id: str, content: str, receiver_user_id: str | None, receiver_group_id: str | None) -> MessageDTO:
+        try:
+            sender = await self.uow.user_repository.get(sender_id)
+            if not sender:
+                logger.error("Sender not found: %s", sender_id)
+                raise ValueError(f"Sender not found: {sender_id}")
+
+            if receiver_user_id:
+                receiver = await self.uow.user_repository.get(receiver_user_id)
+                if not receiver:
+                    logger.error("Receiver not found: %s", receiver_user_id)
+                    raise ValueError(f"Receiver not found: {receiver_user_id}")
+
+            if receiver_group_id:
+                await self.check_group_sender(sender_id, receiver_group_id)
+
+            message = Message()
+            message.create_message(
+                sender_id=sender_id,
+                content=content,
+                reciever_user_id=receiver_user_id,
+                reciever_group_id=receiver_group_id
+            )
+
+            message_dto = message.convert_to_dto()
+            if self.write_buffer is not None:
+                # the buffer updates the chat summaries when it flushes
+                self.write_buffer.enqueue(message_dto)
+            else:
+                await self.uow.message_repository.save(message_dto)
+                await self.after_reply(self.record_summaries, [message_dto])
+            logger.info("Message created: %s", message_dto.message_id)
+            return message_dto
+
+        except Exception as e:
+            logger.error("Error creating message: %s", e)
+            raise ValueError(f"Error creating message: {e}")
+
+    async def create_messages(self, items: list[dict]) -> list[dict]:
+        if len(items) > MAX_MESSAGE_BATCH_SIZE:
+            raise ValueError(f"Batch too large, at most {MAX_MESSAGE_BATCH_SIZE} messages allowed")
+        try:
+            existing = await self.uow.user_repository.existing_user_ids(batch_user_ids(items))
+            group_members = {group_id: await self.group_members(group_id) for group_id in batch_group_ids(items)}
+            results, valid = build_message_batch(items, existing, group_members)
+            errors = await self.uow.message_repository.save_many([dto for _, dto in valid])
+            await self.after_reply(self.record_summaries, [dto for position, (_, dto) in enumerate(valid) if position not in errors])
+            logger.info("Message batch created: %s/%s", len(valid) - len(errors), len(items))
+            return apply_batch_errors(results, valid, errors)
+        except Exception as e:
+            logger.error("Error creating messages: %s", e)
+            raise ValueError(f"Error creating messages: {e}")
+
+    async def record_summaries(self, message_dtos: list[MessageDTO]) -> None:
+        try:
+            group_ids = {m.reciever_group_id for m in message_dtos if m.reciever_group_id}
+            group_members = {group_id: await self.group_members(group_id) or set() for group_id in group_ids}
+            await self.uow.chat_summary_repository.record_messages(summary_updates(message_dtos, group_members))
+        except Exception as e:
+            logger.error("Error updating chat summaries: %s", e)
+
+    async def group_members(self, group_id: str) -> set | None:
+        # None when the group doesn't exist
+        members = membership_index.members(group_id)
+        if members is None:
+            group_dto = await self.uow.groups_repository.get(group_id, None)
+            if group_dto is None:
+                return None
+            membership_index.put_group(group_dto)
+            members = set(group_dto.members)
+        return members
+
+    async def check_group_sender(self, sender_id: str, group_id: str) -> None:
+        # Only members may post to a group, the index answers without copying the member set
+        is_member = membership_index.is_member(group_id, sender_id)
+        if is_member is None:
+            members = await self.group_members(group_id)
+            if members is None:
+                raise ValueError(f"Group not found: {group_id}")
+            is_member = sender_id in members
+        if not is_member:
+            raise ValueError(f"Sender is not a member of group: {group_id}")
+
+    async def update_message(self, message_id: str, new_content: str, sender_id: str | None = None) -> MessageDTO:
+        if self.write_buffer is not None:
+            await self.write_buffer.persist(message_id)
+        message_dto = await self.uow.message_repository.get(message_id, None)
+        if not message_dto:
+            raise ValueError("Message not found")
+        if sender_id is not None and message_dto.sender_id != sender_id:
+            raise ValueError("Only the sender can edit this message")
+        try:
+            message = Message()
+            message.sender_id = message_dto.sender_id
+            message.content = message_dto.content
+            message.sent_at = message_dto.sent_at
+            message.message_id = message_dto.message_id
+            message.updated_at = message_dto.updated_at
+            message.reciever_user_id = message_dto.reciever_user_id
+            message.reciever_group_id = message_dto.reciever_group_id
+
+            message.update_message_content(new_content)
+            updated_dto = message.convert_to_dto()
+            await self.uow.message_repository.update(message_id, updated_dto)
+        except Exception as e:
+            raise ValueError(f"Error updating message: {e}")
+        await self.after_reply(self.record_edit, updated_dto)
+        return updated_dto
+
+    async def delete_message(self, message_id: str, sender_id: str | None = None) -> None:
+        if self.write_buffer is not None:
+            await self.write_buffer.persist(message_id)
+        message = await self.uow.message_repository.get(message_id,None)
+        if not message:
+            raise ValueError("Message not found")
+        if sender_id is not None and message.sender_id != sender_id:
+            raise ValueError("Only the sender can delete this message")
+        try:
+            if not message.delete_message():
+                return
+            await self.uow.message_repository.delete(message_id)
+        except Exception as e:
+            raise ValueError(f"Error deleting message: {e}")
+        await self.after_reply(self.record_delete, message)
+
+    async def record_edit(self, message_dto: MessageDTO) -> None:
+        try:
+            chat_id = message_chat_id(message_dto)
+            if chat_id is not None:
+                await self.uow.chat_summary_repository.message_edited(chat_id, message_dto)
+        except Exception as e:
+            logger.error("Error updating chat summaries for edited message: %s", e)
+
+    async def record_delete(self, message_dto: MessageDTO) -> None:
+        try:
+            chat_id = message_chat_id(message_dto)
+            if chat_id is None:
+                return
+            latest = (await self.uow.message_repository.find_page(chat_messages_query(chat_id), 1)).messages
+            await self.uow.chat_summary_repository.message_deleted(chat_id, message_dto, latest[0] if latest else None)
+        except Exception as e:
+            logger.error("Error updating chat summaries for deleted message: %s", e)
+
+class AsyncGroupCommandService:
+    def __init__(self, uow: AsyncUnitOfWork):
+        self.uow = uow
+
+    async def create_group(self, group_name: str, admin_id: str, group_description: str = None) -> GroupDTO:
+        try:
+            group = Group()
+            group.create_group(group_name, group_description, admin_id)
+            group.add_member(admin_id)
+            group_dto = group.convert_to_dto()
+            await self.uow.groups_repository.save(group_dto)
+            membership_index.group_changed(group_dto)
+            await AsyncChatCommandService(self.uow).add_participants(group_dto.group_id, "group", [admin_id])
+            return group_dto
+        except Exception as e:
+            raise ValueError(f"Error creating group: {e}")
+
+    async def add_member(self, group_id: str, member_id: str) -> GroupDTO:
+        try:
+            updated_dto = await self.uow.groups_repository.add_members(group_id, [member_id], datetime.now().isoformat(), strict=True)
+        except Exception as e:
+            raise ValueError(f"Error adding member: {e}")
+        if not updated_dto:
+            if not await self.uow.groups_repository.get(group_id, None):
+                raise ValueError("Group not found")
+            raise ValueError("Error adding member: Member already exists in the group.")
+        membership_index.group_changed(updated_dto)
+        await AsyncChatCommandService(self.uow).add_participants(group_id, "group", [member_id])
+        return updated_dto
+
+    async def remove_member(self, group_id: str, member_id: str) -> GroupDTO:
+        try:
+            updated_dto = await self.uow.groups_repository.remove_members(group_id, [member_id], datetime.now().isoformat(), strict=True)
+        except Exception as e:
+            raise ValueError(f"Error removing member: {e}")
+        if not updated_dto:
+            if not await self.uow.groups_repository.get(group_id, None):
+                raise ValueError("Group not found")
+            raise ValueError("Error removing member: Member does not exist in the group.")
+        membership_index.group_changed(updated_dto)
+        await AsyncChatCommandService(self.uow).remove_participants(group_id, [member_id])
+        return updated_dto
+
+    async def add_members(self, group_id: str, member_ids: list[str]) -> GroupDTO:
+        # Members that are already in the group are left as they are
+        member_ids = validate_member_batch(member_ids)
+        try:
+            updated_dto = await self.uow.groups_repository.add_members(group_id, member_ids, datetime.now().isoformat())
+        except Exception as e:
+            raise ValueError(f"Error adding members: {e}")
+        if not updated_dto:
+            raise ValueError("Group not found")
+        membership_index.group_changed(updated_dto)
+        await AsyncChatCommandService(self.uow).add_participants(group_id, "group", member_ids)
+        return updated_dto
+
+    async def remove_members(self, group_id: str, member_ids: list[str]) -> GroupDTO:
+        # Ids that aren't members are ignored
+        member_ids = validate_member_batch(member_ids)
+        try:
+            updated_dto = await self.uow.groups_repository.remove_members(group_id, member_ids, datetime.now().isoformat())
+        except Exception as e:
+            raise ValueError(f"Error removing members: {e}")
+        if not updated_dto:
+            raise ValueError("Group not found")
+        membership_index.group_changed(updated_dto)
+        await AsyncChatCommandService(self.uow).remove_participants(group_id, member_ids)
+        return updated_dto
+
+    async def update_group(self, group_id: str, group_name: str = None, group_description: str = None) -> GroupDTO:
+        group_dto = await self.uow.groups_repository.get(group_id, None)
+        if not group_dto:
+            raise ValueError("Group not found")
+        group = Group.from_dto(group_dto)
+        try:
+            group.update_group_details(group_name, group_description)
+            updated_dto = await self.uow.groups_repository.update(group_id, group.convert_to_dto())
+        except Exception as e:
+            raise ValueError(f"Error updating group: {e}")
+        if updated_dto is None:
+            raise ValueError("Group not found")
+        membership_index.group_changed(updated_dto)
+        return updated_dto
+
+    async def change_group_admin(self, group_id: str, new_admin_id: str) -> GroupDTO:
+        group_dto = await self.uow.groups_repository.get(group_id, None)
+        if not group_dto:
+            raise ValueError("Group not found")
+        group = Group.from_dto(group_dto)
+        try:
+            group.admin_id = new_admin_id
+            updated_dto = await self.uow.groups_repository.update(group_id, group.convert_to_dto())
+        except Exception as e:
+            raise ValueError(f"Error changing group admin: {e}")
+        if updated_dto is None:
+            raise ValueError("Group not found")
+        membership_index.group_changed(updated_dto)
+        return updated_dto
+
+    async def delete_group(self, group_id: str) -> None:
+        group = await self.uow.groups_repository.get(group_id, None)
+        if not group:
+            raise ValueError("Group not found")
+        try:
+            await self.uow.groups_repository.delete(group_id)
+            membership_index.group_deleted(group_id)
+            await AsyncChatCommandService(self.uow).remove_participants(group_id)
+        except Exception as e:
+            raise ValueError(f"Error deleting group: {e}")
+
+class AsyncDirectMessageCommandService:
+    def __init__(self, uow: AsyncUnitOfWork):
+        self.uow = uow
+
+    async def create_dm_chat(self, user1_id: str, user2_id: str) -> DirectMessageDTO:
+        # Get-or-create: opening an existing DM returns that chat instead of a duplicate
+        if not user1_id or not user2_id:
+            raise ValueError("Error creating DM chat: user1_id and user2_id are required")
+        try:
+            dm = DirectMessage()
+            dm.create_dm(user1_id, user2_id)
+            dm_dto, created = await self.uow.dm_repository.get_or_create(dm.convert_to_dto())
+            if created:
+                await AsyncChatCommandService(self.uow).add_participants(
+                    dm.pair_key, "dm", [user1_id, user2_id], peers={user1_id: user2_id, user2_id: user1_id}
+                )
+            return dm_dto
+        except Exception as e:
+            raise ValueError(f"Error creating DM chat: {e}")
+
+    async def delete_dm_chat(self, chat_id: str) -> None:
+        dm = await self.uow.dm_repository.get(chat_id, None, None)
+        if not dm:
+            raise ValueError("DM chat not found")
+        try:
+            await self.uow.dm_repository.delete(chat_id)
+            await AsyncChatCommandService(self.uow).remove_participants(dm_pair_key(dm.user1_id, dm.user2_id))
+        except Exception as e:
+            raise ValueError(f"Error deleting DM chat: {e}")
+
+class AsyncChatCommandService:
+    def __init__(self, uow: AsyncUnitOfWork, write_buffer=None):
+        self.uow = uow
+        # Optional WriteBehindBuffer, flushed before reading a message it may still hold
+        self.write_buffer = write_buffer
+
+    async def mark_read(self, user_id: str, chat_id: str, message_id: str | None = None) -> ChatSummaryDTO:
+        # Marks the chat read up to message_id, or entirely when it is omitted
+        if not user_id or not chat_id:
+            raise ValueError("user_id and chat_id are required")
+        unread = 0
+        if message_id:
+            if self.write_buffer is not None:
+                await self.write_buffer.persist(message_id)
+            message_dto = await self.uow.message_repository.get(message_id, None)
+            if message_dto is None or message_chat_id(message_dto) != chat_id:
+                raise ValueError("Message not found in this chat")
+        try:
+            if message_id:
+                unread = await self.uow.message_repository.count_unread(
+                    chat_messages_query(chat_id), message_dto.sent_at, message_id, user_id
+                )
+            summary = await self.uow.chat_summary_repository.mark_read(user_id, chat_id, message_id, now_millis(), unread)
+        except Exception as e:
+            raise ValueError(f"Error marking chat as read: {e}")
+        if summary is None:
+            raise ValueError("Chat not found")
+        return summary
+
+    async def add_participants(self, chat_id: str, chat_type: str, user_ids: list[str], peers: dict | None = None) -> None:
+        try:
+            await self.uow.chat_summary_repository.ensure_chats(chat_id, chat_type, user_ids, now_millis(), peers)
+        except Exception as e:
+            logger.error("Error adding chat summaries for %s: %s", chat_id, e)
+
+    async def remove_participants(self, chat_id: str, user_ids: list[str] | None = None) -> None:
+        try:
+            await self.uow.chat_summary_repository.remove_chats(chat_id, user_ids)
+        except Exception as e:
+            logger.error("Error removing chat summaries for %s: %s", chat_id, e)
@@ -0,0 +1,194 @@
+from typing import List
+from uow import AsyncUnitOfWork
+from domains.view_models import UserDTO, UserDirectoryPage, GroupDTO, MessageDTO, MessagePage, DirectMessageDTO, UserDTODBO, ChatSummaryDTO, InboxPage
+from repos.pagination import DEFAULT_PAGE_SIZE, EXPORT_BATCH_SIZE, DEFAULT_USER_DIRECTORY_FIELDS
+from services.membership import membership_index
+
+# Async counterparts of services.queries, used by the WebSocket path and async routes.
+
+class AsyncUserQueryService:
+    def __init__(self, uow: AsyncUnitOfWork):
+        self.uow = uow
+
+    async def get_user_by_id(self, user_id: str) -> UserDTO:
+        return await self.uow.user_repository.get(user_id)
+
+    async def get_user_by_username(self, username: str) -> UserDTODBO:
+        user = await self.uow.connection.db["users"].find_one({"username": username})
+        if not user:
+            return None
+        return UserDTODBO(**user)
+
+    async def get_user_directory(self, prefix: str | None = None, limit: int = DEFAULT_PAGE_SIZE, after: str | None = None, fields=DEFAULT_USER_DIRECTORY_FIELDS) -> UserDirectoryPage:
+        return await self.uow.user_repository.find_directory(prefix, limit, after, fields)
+
+    async def get_user_groups(self, user_id: str) -> list[GroupDTO]:
+        return await AsyncGroupQueryService(self.uow).get_groups_by_member(user_id)
+
+    async def get_user_messages(self, user_id: str) -> list[MessageDTO]:
+        messages = self.uow.connection.db["messages"].find({"$or": [{"sender_id": user_id}, {"reciever_user_id": user_id}, {"reciever_group_id": user_id}]})
+        return [MessageDTO(**message) async for message in messages]
+
+    async def get_chats_for_user(self, user_id):
+        # gets all the chats for a user which includes their groups as well as dms
+        dms = self.uow.connection.db["direct_messages"].find({"$or": [{"user1_id": user_id}, {"user2_id": user_id}]})
+        gcs = self.uow.connection.db["groups"].find({"members": user_id})
+
+        chats = {
+            "direct_messages": [DirectMessageDTO(**dm).dict() async for dm in dms],
+            "group_chats": [GroupDTO(**gc).dict() async for gc in gcs]
+        }
+
+        return chats
+
+    async def get_all_user_statuses(self) -> list[dict]:
+        users = self.uow.connection.db["users"].find({}, {"user_id": 1, "username": 1, "status": 1})
+        return [{"username": user["username"],
+             "status": user["status"],
+             "_id": str(user["_id"])} async for user in users]
+
+
+class AsyncMessageQueryService:
+    def __init__(self, uow: AsyncUnitOfWork, write_buffer=None):
+        self.uow = uow
+        # Optional WriteBehindBuffer, flushed before reading a message it may still hold
+        self.write_buffer = write_buffer
+
+    async def get_message_by_id(self, message_id: str) -> MessageDTO:
+        if self.write_buffer is not None:
+            await self.write_buffer.persist(message_id)
+        message = await self.uow.connection.db["messages"].find_one({"message_id": message_id})
+        if not message:
+            return None
+        return MessageDTO(**message)
+
+    async def get_messages_by_sender(self, sender_id: str) -> list[MessageDTO]:
+        messages = self.uow.connection.db["messages"].find({"sender_id": sender_id})
+        return [MessageDTO(**message) async for message in messages]
+
+    async def get_messages_for_user(self, user_id: str) -> list[MessageDTO]:
+        messages = self.uow.connection.db["messages"].find({
+            "$or": [
+                {"sender_id": user_id},
+                {"reciever_user_id": user_id}
+            ]
+        }).sort("sent_at", -1)
+        return [MessageDTO(**msg) async for msg in messages]
+
+    async def get_messages_for_group(self, group_id: str) -> list[MessageDTO]:
+        messages = self.uow.connection.db["messages"].find({"reciever_group_id": group_id})
+        return [MessageDTO(**message) async for message in messages]
+
+    async def get_messages_for_chat(self, chat_id: str) -> list[MessageDTO]:
+        messages = self.uow.connection.db["messages"].find({"$or": [{"reciever_group_id": chat_id}, {"reciever_user_id": chat_id}]})
+        return [MessageDTO(**message) async for message in messages]
+
+    async def get_conversation(self, user1: str, user2: str):
+        messages = self.uow.connection.db["messages"].find({
+            "$or": [
+                {"sender_id": user1, "reciever_user_id": user2},
+                {"sender_id": user2, "reciever_user_id": user1},
+            ]
+        }).sort("sent_at", 1)
+
+        message_dtos = []
+        async for msg in messages:
+            msg_data = {
+                "message_id": msg.get("message_id"),
+                "sender_id": msg.get("sender_id"),
+                "content": msg.get("content"),
+                "sent_at": msg.get("sent_at"),
+                "updated_at": msg.get("updated_at", msg.get("sent_at")),
+                "reciever_user_id": msg.get("reciever_user_id"),
+                "reciever_group_id": None
+            }
+            message_dtos.append(MessageDTO(**msg_data))
+
+        return message_dtos
+
+    # Keyset-paginated variants, see MessageRepository.find_page
+    async def get_conversation_page(self, user1: str, user2: str, limit: int = DEFAULT_PAGE_SIZE, before: str | None = None, after: str | None = None, raw: bool = False) -> MessagePage | dict:
+        return await self.uow.message_repository.get_conversation_page(user1, user2, limit, before, after, raw)
+
+    async def get_messages_for_user_page(self, user_id: str, limit: int = DEFAULT_PAGE_SIZE, before: str | None = None, after: str | None = None, raw: bool = False) -> MessagePage | dict:
+        return await self.uow.message_repository.get_messages_for_user_page(user_id, limit, before, after, raw)
+
+    async def get_messages_by_sender_page(self, sender_id: str, limit: int = DEFAULT_PAGE_SIZE, before: str | None = None, after: str | None = None, raw: bool = False) -> MessagePage | dict:
+        return await self.uow.message_repository.get_messages_by_sender_page(sender_id, limit, before, after, raw)
+
+    # Streaming exports, see MessageRepository.export
+    def export_conversation(self, user1: str, user2: str, batch_size: int = EXPORT_BATCH_SIZE, after: str | None = None):
+        return self.uow.message_repository.export_conversation(user1, user2, batch_size, after)
+
+    def export_messages_for_user(self, user_id: str, batch_size: int = EXPORT_BATCH_SIZE, after: str | None = None):
+        return self.uow.message_repository.export_messages_for_user(user_id, batch_size, after)
+
+class AsyncGroupQueryService:
+    def __init__(self, uow: AsyncUnitOfWork):
+        self.uow = uow
+
+    async def get_group_by_id(self, group_id: str) -> GroupDTO:
+        cached = membership_index.group(group_id)
+        if cached is not None:
+            return cached
+        group = await self.uow.connection.db["groups"].find_one({"group_id": group_id})
+        if not group:
+            return None
+        group_dto = GroupDTO(**group)
+        membership_index.put_group(group_dto)
+        return group_dto
+
+    async def get_groups_by_member(self, member_id: str) -> list[GroupDTO]:
+        cached = membership_index.groups_for_member(member_id)
+        if cached is not None:
+            return cached
+        groups = self.uow.connection.db["groups"].find({"members": member_id})
+        groups = [GroupDTO(**group) async for group in groups]
+        membership_index.put_member_groups(member_id, groups)
+        return groups
+
+    async def get_all_groups(self) -> list[GroupDTO]:
+        groups = self.uow.connection.db["groups"].find()
+        return [GroupDTO(**group) async for group in groups]
+
+    async def get_group_admin(self, group_id: str) -> UserDTO:
+        group = await self.uow.connection.db["groups"].find_one({"group_id": group_id})
+        if not group or "admin" not in group:
+            return None
+        admin = await self.uow.connection.db["users"].find_one({"user_id": group["admin"]})
+        if not admin:
+            return None
+        return UserDTO(**admin)
+
+    async def get_groups_by_user_id(self, user_id: str) -> List[GroupDTO]:
+        return await self.get_groups_by_member(user_id)
+
+class AsyncDirectMessageQueryService:
+    def __init__(self, uow: AsyncUnitOfWork):
+        self.uow = uow
+
+    async def get_direct_message_by_id(self, chat_id: str) -> DirectMessageDTO:
+        chat = await self.uow.connection.db["direct_messages"].find_one({"chat_id": chat_id})
+        if not chat:
+            return None
+        return DirectMessageDTO(**chat)
+
+    async def get_direct_messages_by_user(self, user_id: str) -> list[DirectMessageDTO]:
+        chats = self.uow.connection.db["direct_messages"].find({"$or": [{"user1_id": user_id}, {"user2_id": user_id}]})
+        return [DirectMessageDTO(**chat) async for chat in chats]
+
+    async def get_direct_messages_between_users(self, user1_id: str, user2_id: str) -> DirectMessageDTO:
+        # one lookup on the unique pair_key index
+        return await self.uow.dm_repository.get_by_pair(user1_id, user2_id)
+
+class AsyncChatQueryService:
+    def __init__(self, uow: AsyncUnitOfWork):
+        self.uow = uow
+
+    async def get_unread_counts(self, user_id: str) -> list[ChatSummaryDTO]:
+        # One indexed read of the user's read state rows, no message scan
+        return await self.uow.chat_summary_repository.get_for_user(user_id)
+
+    async def get_inbox(self, user_id: str, limit: int = DEFAULT_PAGE_SIZE, before: str | None = None) -> InboxPage:
+        # The user's chats with last message preview, most recent first
+        return await self.uow.chat_summary_repository.find_inbox(user_id, limit, before)
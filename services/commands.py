@@ -1,16 +1,16 @@
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 from uow import UnitOfWork
-from domains.view_models import UserDTO, MessageDTO, GroupDTO,DirectMessageDTO,UserDTODBO
-from domains.models import User,Message,Group,DirectMessage
+from domains.view_models import UserDTO, MessageDTO, GroupDTO,DirectMessageDTO,UserDTODBO,ChatSummaryDTO
+from domains.models import User,Message,Group,DirectMessage,dm_pair_key,now_millis
+from services.membership import membership_index
+from repos.pagination import chat_messages_query
 from typing import Optional
 from datetime import datetime
 import uuid
-from auth import get_password_hash, verify_password
+from auth import get_password_hash, password_pool, PasswordPoolBusy
 
 class UserCommandService:
     def __init__(self, uow: UnitOfWork):
@@ -19,7 +19,7 @@ class UserCommandService:
     def create_user(self, username: str, email: str, password: str) -> UserDTO:
         try:
             user = User()
-            hashed_pw = get_password_hash(password)
+            hashed_pw = password_pool.run_blocking(get_password_hash, password)
             user.create_user(username,email,hashed_pw)
             user_dto = UserDTODBO(
                 username=user.username,
@@ -33,17 +33,22 @@ class UserCommandService:
             )
             self.uow.user_repository.save(user_dto)
             return user_dto
+        except PasswordPoolBusy:
+            # surfaced as 503 + Retry-After by the routes, like login
+            raise
         except Exception as e:
             raise ValueError(f"Error creating user: {e}")
     
     def update_user(self, user_id: str, username: Optional[str], status: Optional[str], email: Optional[str]) -> UserDTO:
-        user = self.uow.user_repository.get(user_id)
-        if not user:
+        user_dto = self.uow.user_repository.get(user_id)
+        if not user_dto:
             raise ValueError("User not found")
         try:
+            user = User.from_dto(user_dto)
             user.update_user_details(username, status, email)
-            self.uow.user_repository.update(user_id, user)
-            return user.convert_to_dto()
+            updated_dto = user.convert_to_dto()
+            self.uow.user_repository.update(user_id, updated_dto)
+            return updated_dto
         except Exception as e:
             raise ValueError(f"Error updating user: {e}")
 
@@ -52,8 +57,12 @@ class UserCommandService:
         if not user:
             raise ValueError("User not found")
         try:
-            user.change_password(get_password_hash(new_password))
-            self.uow.user_repo.update(user_id, user)
+            user_data = user.dict()
+            user_data.update(password=password_pool.run_blocking(get_password_hash, new_password), updated_at=datetime.now().isoformat())
+            self.uow.user_repository.update(user_id, UserDTODBO(**user_data))
+        except PasswordPoolBusy:
+            # surfaced as 503 + Retry-After by the routes, like login
+            raise
         except Exception as e:
             raise ValueError(f"Error changing password: {e}")
 
@@ -62,29 +71,145 @@ class UserCommandService:
         if not user:
             raise ValueError("User not found")
         try:
-            self.uow.user_repo.delete(user_id)
+            self.uow.user_repository.delete(user_id)
         except Exception as e:
             raise ValueError(f"Unable to delete user: {e}")
 
+MAX_MESSAGE_BATCH_SIZE = 500
+
+def build_message_batch(items: list[dict], existing_user_ids: set[str], group_members: dict) -> tuple[list[dict], list[tuple[int, MessageDTO]]]:
+    """
+    Validates a batch of message payloads against the set of users known to
+    exist and the members of the receiving groups (None for groups that
+    don't exist). Returns the per-item results (errors filled in, successes
+    pending) and the (index, dto) pairs that should be persisted.
+    """
+    results = []
+    valid = []
+    for index, item in enumerate(items):
+        sender_id = item.get("sender_id")
+        receiver_user_id = item.get("reciever_user_id")
+        receiver_group_id = item.get("reciever_group_id")
+        if not sender_id or sender_id not in existing_user_ids:
+            results.append({"index": index, "status": "error", "error": f"Sender not found: {sender_id}"})
+            continue
+        if receiver_user_id and receiver_user_id not in existing_user_ids:
+            results.append({"index": index, "status": "error", "error": f"Receiver not found: {receiver_user_id}"})
+            continue
+        if receiver_group_id:
+            members = group_members.get(receiver_group_id)
+            if members is None:
+                results.append({"index": index, "status": "error", "error": f"Group not found: {receiver_group_id}"})
+                continue
+            if sender_id not in members:
+                results.append({"index": index, "status": "error", "error": f"Sender is not a member of group: {receiver_group_id}"})
+                continue
+        if not item.get("content"):
+            results.append({"index": index, "status": "error", "error": "Content cannot be empty."})
+            continue
+        message = Message()
+        message.create_message(
+            sender_id=sender_id,
+            content=item["content"],
+            reciever_user_id=receiver_user_id,
+            reciever_group_id=receiver_group_id
+        )
+        results.append({"index": index, "status": "pending"})
+        valid.append((index, message.convert_to_dto()))
+    return results, valid
+
+def batch_user_ids(items: list[dict]) -> list[str]:
+    user_ids = set()
+    for item in items:
+        for key in ("sender_id", "reciever_user_id"):
+            if item.get(key):
+                user_ids.add(item[key])
+    return list(user_ids)
+
+def batch_group_ids(items: list[dict]) -> list[str]:
+    return list({item["reciever_group_id"] for item in items if item.get("reciever_group_id")})
+
+def apply_batch_errors(results: list[dict], valid: list[tuple[int, MessageDTO]], errors: dict[int, str]) -> list[dict]:
+    # errors are indexed by position in the insert_many call, i.e. in valid
+    for position, (index, message_dto) in enumerate(valid):
+        if position in errors:
+            results[index] = {"index": index, "status": "error", "error": errors[position]}
+        else:
+            results[index] = {"index": index, "status": "created", "message": message_dto.dict()}
+    return results
+
+def message_chat_id(message_dto: MessageDTO) -> str | None:
+    if message_dto.reciever_group_id:
+        return message_dto.reciever_group_id
+    if message_dto.reciever_user_id:
+        return dm_pair_key(message_dto.sender_id, message_dto.reciever_user_id)
+    return None
+
+def summary_updates(message_dtos: list[MessageDTO], group_members: dict) -> dict:
+    """
+    Folds new messages, in order, into the argument of
+    ChatSummaryRepository.record_messages: per (user_id, chat_id) the latest
+    message, the number of new unread messages and, for users who sent in
+    that chat, their read position plus what arrived after it.
+    group_members maps each receiving group to its member ids.
+    """
+    updates = {}
+    for message_dto in message_dtos:
+        chat_id = message_chat_id(message_dto)
+        if chat_id is None:
+            continue
+        if message_dto.reciever_group_id:
+            chat_type = "group"
+            participants = set(group_members.get(message_dto.reciever_group_id, ())) | {message_dto.sender_id}
+        else:
+            chat_type = "dm"
+            participants = {message_dto.sender_id, message_dto.reciever_user_id}
+        for user_id in participants:
+            peer_id = None
+            if chat_type == "dm":
+                peer_id = message_dto.reciever_user_id if user_id == message_dto.sender_id else message_dto.sender_id
+            update = updates.setdefault((user_id, chat_id), {"chat_type": chat_type, "peer_id": peer_id, "unread": 0, "read": None})
+            update["last"] = message_dto
+            if user_id == message_dto.sender_id:
+                # senders have read their own chat
+                update["read"] = (message_dto, 0)
+            elif update["read"] is not None:
+                update["read"] = (update["read"][0], update["read"][1] + 1)
+            else:
+                update["unread"] += 1
+    return updates
+
 class MessageCommandService:
-    def __init__(self, uow: UnitOfWork):
+    def __init__(self, uow: UnitOfWork, defer=None):
         self.uow = uow
+        # Optional defer(fn, *args), e.g. BackgroundTasks.add_task, runs the
+        # chat summary writes after the response instead of before it
+        self.defer = defer
+
+    def after_reply(self, fn, *args) -> None:
+        if self.defer is not None:
+            self.defer(fn, *args)
+        else:
+            fn(*args)
 
     def create_message(self, sender_id: str, content: str, receiver_user_id: str | None, receiver_group_id: str | None) -> MessageDTO:
         try:
             # Verify sender exists
             sender = self.uow.user_repository.get(sender_id)
             if not sender:
-                logger.error(f"Sender not found: {sender_id}")
+                logger.error("Sender not found: %s", sender_id)
                 raise ValueError(f"Sender not found: {sender_id}")
 
             # Verify receiver exists if provided
             if receiver_user_id:
                 receiver = self.uow.user_repository.get(receiver_user_id)
                 if not receiver:
-                    logger.error(f"Receiver not found: {receiver_user_id}")
+                    logger.error("Receiver not found: %s", receiver_user_id)
                     raise ValueError(f"Receiver not found: {receiver_user_id}")
 
+            if receiver_group_id:
+                self.check_group_sender(sender_id, receiver_group_id)
+
             # Create and save message
             message = Message()
             message.create_message(
@@ -96,13 +221,65 @@ class MessageCommandService:
             
             message_dto = message.convert_to_dto()
             self.uow.message_repository.save(message_dto)
-            logger.info(f"Message created: {message_dto.message_id}")
+            self.after_reply(self.record_summaries, [message_dto])
+            logger.info("Message created: %s", message_dto.message_id)
             return message_dto
             
         except Exception as e:
-            logger.error(f"Error creating message: {e}")
+            logger.error("Error creating message: %s", e)
             raise ValueError(f"Error creating message: {e}")
 
+    def create_messages(self, items: list[dict]) -> list[dict]:
+        """
+        Batch variant of create_message: all senders/receivers are validated
+        with one $in query and the valid messages persisted with one
+        insert_many. Returns one result per item, in order.
+        """
+        if len(items) > MAX_MESSAGE_BATCH_SIZE:
+            raise ValueError(f"Batch too large, at most {MAX_MESSAGE_BATCH_SIZE} messages allowed")
+        try:
+            existing = self.uow.user_repository.existing_user_ids(batch_user_ids(items))
+            group_members = {group_id: self.group_members(group_id) for group_id in batch_group_ids(items)}
+            results, valid = build_message_batch(items, existing, group_members)
+            errors = self.uow.message_repository.save_many([dto for _, dto in valid])
+            self.after_reply(self.record_summaries, [dto for position, (_, dto) in enumerate(valid) if position not in errors])
+            logger.info("Message batch created: %s/%s", len(valid) - len(errors), len(items))
+            return apply_batch_errors(results, valid, errors)
+        except Exception as e:
+            logger.error("Error creating messages: %s", e)
+            raise ValueError(f"Error creating messages: {e}")
+
+    def record_summaries(self, message_dtos: list[MessageDTO]) -> None:
+        # Chat summaries are derived data, failing to update them must not fail the send
+        try:
+            group_ids = {m.reciever_group_id for m in message_dtos if m.reciever_group_id}
+            group_members = {group_id: self.group_members(group_id) or set() for group_id in group_ids}
+            self.uow.chat_summary_repository.record_messages(summary_updates(message_dtos, group_members))
+        except Exception as e:
+            logger.error("Error updating chat summaries: %s", e)
+
+    def group_members(self, group_id: str) -> set | None:
+        # None when the group doesn't exist
+        members = membership_index.members(group_id)
+        if members is None:
+            group_dto = self.uow.groups_repository.get(group_id, None)
+            if group_dto is None:
+                return None
+            membership_index.put_group(group_dto)
+            members = set(group_dto.members)
+        return members
+
+    def check_group_sender(self, sender_id: str, group_id: str) -> None:
+        # Only members may post to a group, the index answers without copying the member set
+        is_member = membership_index.is_member(group_id, sender_id)
+        if is_member is None:
+            members = self.group_members(group_id)
+            if members is None:
+                raise ValueError(f"Group not found: {group_id}")
+            is_member = sender_id in members
+        if not is_member:
+            raise ValueError(f"Sender is not a member of group: {group_id}")
+
     def update_message(self, message_id: str, new_content: str) -> MessageDTO:
         message_dto = self.uow.message_repository.get(message_id, None)
         if not message_dto:
@@ -112,9 +289,9 @@ class MessageCommandService:
             message = Message()
             message.sender_id = message_dto.sender_id
             message.content = message_dto.content
-            message.sent_at = datetime.fromisoformat(message_dto.sent_at)
+            message.sent_at = message_dto.sent_at
             message.message_id = message_dto.message_id
-            message.updated_at = datetime.fromisoformat(message_dto.updated_at)
+            message.updated_at = message_dto.updated_at
             message.reciever_user_id = message_dto.reciever_user_id
             message.reciever_group_id = message_dto.reciever_group_id
 
@@ -122,19 +299,52 @@ class MessageCommandService:
             message.update_message_content(new_content)
             updated_dto = message.convert_to_dto()
             self.uow.message_repository.update(message_id, updated_dto)
-            return updated_dto
         except Exception as e:
             raise ValueError(f"Error updating message: {e}")
+        self.after_reply(self.record_edit, updated_dto)
+        return updated_dto
 
     def delete_message(self, message_id: str) -> None:
         message = self.uow.message_repository.get(message_id,None)
         if not message:
             raise ValueError("Message not found")
         try:
-            if message.delete_message():
-                self.uow.message_repository.delete(message_id)
+            if not message.delete_message():
+                return
+            self.uow.message_repository.delete(message_id)
         except Exception as e:
             raise ValueError(f"Error deleting message: {e}")
+        self.after_reply(self.record_delete, message)
+
+    def record_edit(self, message_dto: MessageDTO) -> None:
+        try:
+            chat_id = message_chat_id(message_dto)
+            if chat_id is not None:
+                self.uow.chat_summary_repository.message_edited(chat_id, message_dto)
+        except Exception as e:
+            logger.error("Error updating chat summaries for edited message: %s", e)
+
+    def record_delete(self, message_dto: MessageDTO) -> None:
+        # Recomputes unread counts and, where it was the last message, the preview
+        try:
+            chat_id = message_chat_id(message_dto)
+            if chat_id is None:
+                return
+            latest = self.uow.message_repository.find_page(chat_messages_query(chat_id), 1).messages
+            self.uow.chat_summary_repository.message_deleted(chat_id, message_dto, latest[0] if latest else None)
+        except Exception as e:
+            logger.error("Error updating chat summaries for deleted message: %s", e)
+
+MAX_MEMBER_BATCH_SIZE = 1000
+
+def validate_member_batch(member_ids: list[str]) -> list[str]:
+    # De-duplicates member_ids (keeping order) and enforces the batch limit
+    member_ids = list(dict.fromkeys(m for m in member_ids if m))
+    if not member_ids:
+        raise ValueError("No member ids given")
+    if len(member_ids) > MAX_MEMBER_BATCH_SIZE:
+        raise ValueError(f"Batch too large, at most {MAX_MEMBER_BATCH_SIZE} members allowed")
+    return member_ids
 
 class GroupCommandService:
     def __init__(self, uow: UnitOfWork):
@@ -147,60 +357,102 @@ class GroupCommandService:
             group.add_member(admin_id)  # Add creator as first member
             group_dto = group.convert_to_dto()
             self.uow.groups_repository.save(group_dto)
+            membership_index.group_changed(group_dto)
+            ChatCommandService(self.uow).add_participants(group_dto.group_id, "group", [admin_id])
             return group_dto
         except Exception as e:
             raise ValueError(f"Error creating group: {e}")
 
     def add_member(self, group_id: str, member_id: str) -> GroupDTO:
-        group = self.uow.groups_repository.get(group_id)
-        if not group:
-            raise ValueError("Group not found")
         try:
-            group.add_member(member_id)
-            self.uow.groups_repository.update(group_id, group)
-            return group.convert_to_dto()
+            updated_dto = self.uow.groups_repository.add_members(group_id, [member_id], datetime.now().isoformat(), strict=True)
         except Exception as e:
             raise ValueError(f"Error adding member: {e}")
+        if not updated_dto:
+            if not self.uow.groups_repository.get(group_id, None):
+                raise ValueError("Group not found")
+            raise ValueError("Error adding member: Member already exists in the group.")
+        membership_index.group_changed(updated_dto)
+        ChatCommandService(self.uow).add_participants(group_id, "group", [member_id])
+        return updated_dto
 
     def remove_member(self, group_id: str, member_id: str) -> GroupDTO:
-        group = self.uow.groups_repository.get(group_id)
-        if not group:
-            raise ValueError("Group not found")
         try:
-            group.remove_member(member_id)
-            self.uow.groups_repository.update(group_id, group)
-            return group.convert_to_dto()
+            updated_dto = self.uow.groups_repository.remove_members(group_id, [member_id], datetime.now().isoformat(), strict=True)
         except Exception as e:
             raise ValueError(f"Error removing member: {e}")
+        if not updated_dto:
+            if not self.uow.groups_repository.get(group_id, None):
+                raise ValueError("Group not found")
+            raise ValueError("Error removing member: Member does not exist in the group.")
+        membership_index.group_changed(updated_dto)
+        ChatCommandService(self.uow).remove_participants(group_id, [member_id])
+        return updated_dto
+
+    def add_members(self, group_id: str, member_ids: list[str]) -> GroupDTO:
+        # Members that are already in the group are left as they are
+        member_ids = validate_member_batch(member_ids)
+        try:
+            updated_dto = self.uow.groups_repository.add_members(group_id, member_ids, datetime.now().isoformat())
+        except Exception as e:
+            raise ValueError(f"Error adding members: {e}")
+        if not updated_dto:
+            raise ValueError("Group not found")
+        membership_index.group_changed(updated_dto)
+        ChatCommandService(self.uow).add_participants(group_id, "group", member_ids)
+        return updated_dto
+
+    def remove_members(self, group_id: str, member_ids: list[str]) -> GroupDTO:
+        # Ids that aren't members are ignored
+        member_ids = validate_member_batch(member_ids)
+        try:
+            updated_dto = self.uow.groups_repository.remove_members(group_id, member_ids, datetime.now().isoformat())
+        except Exception as e:
+            raise ValueError(f"Error removing members: {e}")
+        if not updated_dto:
+            raise ValueError("Group not found")
+        membership_index.group_changed(updated_dto)
+        ChatCommandService(self.uow).remove_participants(group_id, member_ids)
+        return updated_dto
 
     def update_group(self, group_id: str, group_name: str = None, group_description: str = None) -> GroupDTO:
-        group = self.uow.groups_repository.get(group_id)
-        if not group:
+        group_dto = self.uow.groups_repository.get(group_id, None)
+        if not group_dto:
             raise ValueError("Group not found")
+        group = Group.from_dto(group_dto)
         try:
             group.update_group_details(group_name, group_description)
-            self.uow.groups_repository.update(group_id, group)
-            return group.convert_to_dto()
+            updated_dto = self.uow.groups_repository.update(group_id, group.convert_to_dto())
         except Exception as e:
             raise ValueError(f"Error updating group: {e}")
+        if updated_dto is None:
+            raise ValueError("Group not found")
+        membership_index.group_changed(updated_dto)
+        return updated_dto
         
     def change_group_admin(self, group_id: str, new_admin_id: str) -> GroupDTO:
-        group = self.uow.groups_repository.get(group_id)
-        if not group:
+        group_dto = self.uow.groups_repository.get(group_id, None)
+        if not group_dto:
             raise ValueError("Group not found")
+        group = Group.from_dto(group_dto)
         try:
-            group.admin = new_admin_id
-            self.uow.groups_repository.update(group_id, group)
-            return group.convert_to_dto()
+            group.admin_id = new_admin_id
+            updated_dto = self.uow.groups_repository.update(group_id, group.convert_to_dto())
         except Exception as e:
             raise ValueError(f"Error changing group admin: {e}")
+        if updated_dto is None:
+            raise ValueError("Group not found")
+        membership_index.group_changed(updated_dto)
+        return updated_dto
         
     def delete_group(self, group_id: str) -> None:
-        group = self.uow.groups_repository.get(group_id)
+        group = self.uow.groups_repository.get(group_id, None)
         if not group:
             raise ValueError("Group not found")
         try:
             self.uow.groups_repository.delete(group_id)
+            membership_index.group_deleted(group_id)
+            ChatCommandService(self.uow).remove_participants(group_id)
         except Exception as e:
             raise ValueError(f"Error deleting group: {e}")
 
@@ -209,27 +461,68 @@ class DirectMessageCommandService:
         self.uow = uow
 
     def create_dm_chat(self, user1_id: str, user2_id: str) -> DirectMessageDTO:
+        # Get-or-create: opening an existing DM returns that chat instead of a duplicate
+        if not user1_id or not user2_id:
+            raise ValueError("Error creating DM chat: user1_id and user2_id are required")
         try:
             dm = DirectMessage()
             dm.create_dm(user1_id, user2_id)
-            dm_dto = dm.convert_to_dto()
-            self.uow.dm_repository.save(dm_dto)
+            dm_dto, created = self.uow.dm_repository.get_or_create(dm.convert_to_dto())
+            if created:
+                ChatCommandService(self.uow).add_participants(
+                    dm.pair_key, "dm", [user1_id, user2_id], peers={user1_id: user2_id, user2_id: user1_id}
+                )
             return dm_dto
         except Exception as e:
             raise ValueError(f"Error creating DM chat: {e}")
 
     def delete_dm_chat(self, chat_id: str) -> None:
-        dm = self.uow.dm_repository.get(chat_id)
+        dm = self.uow.dm_repository.get(chat_id, None, None)
         if not dm:
             raise ValueError("DM chat not found")
         try:
             self.uow.dm_repository.delete(chat_id)
+            ChatCommandService(self.uow).remove_participants(dm_pair_key(dm.user1_id, dm.user2_id))
         except Exception as e:
             raise ValueError(f"Error deleting DM chat: {e}")
 
+class ChatCommandService:
+    def __init__(self, uow: UnitOfWork):
+        self.uow = uow
 
+    def mark_read(self, user_id: str, chat_id: str, message_id: str | None = None) -> ChatSummaryDTO:
+        # chat_id is a group_id or the dm_pair_key of the two users
+        # Marks the chat read up to message_id, or entirely when it is omitted
+        if not user_id or not chat_id:
+            raise ValueError("user_id and chat_id are required")
+        unread = 0
+        if message_id:
+            message_dto = self.uow.message_repository.get(message_id, None)
+            if message_dto is None or message_chat_id(message_dto) != chat_id:
+                raise ValueError("Message not found in this chat")
+        try:
+            if message_id:
+                unread = self.uow.message_repository.count_unread(
+                    chat_messages_query(chat_id), message_dto.sent_at, message_id, user_id
+                )
+            summary = self.uow.chat_summary_repository.mark_read(user_id, chat_id, message_id, now_millis(), unread)
+        except Exception as e:
+            raise ValueError(f"Error marking chat as read: {e}")
+        if summary is None:
+            raise ValueError("Chat not found")
+        return summary
 
+    # Keep chat_summaries in step with chat membership. Summaries are derived
+    # data, so failures are logged instead of failing the group/DM change.
 
+    def add_participants(self, chat_id: str, chat_type: str, user_ids: list[str], peers: dict | None = None) -> None:
+        try:
+            self.uow.chat_summary_repository.ensure_chats(chat_id, chat_type, user_ids, now_millis(), peers)
+        except Exception as e:
+            logger.error("Error adding chat summaries for %s: %s", chat_id, e)
 
-
-
+    def remove_participants(self, chat_id: str, user_ids: list[str] | None = None) -> None:
+        try:
+            self.uow.chat_summary_repository.remove_chats(chat_id, user_ids)
+        except Exception as e:
+            logger.error("Error removing chat summaries for %s: %s", chat_id, e)
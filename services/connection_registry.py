@@ -0,0 +1,384 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+from fastapi import WebSocket
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Routes WebSocket events to whichever node holds the recipient's socket.
+# Each node keeps its own sockets in a ConnectionRegistry and the broker
+# carries events between nodes:
+#   - InProcessBroker: single process, delivers straight to the local registry
+#   - RedisBroker: every node subscribes to a channel per locally connected user
+#     and publishing to that channel reaches the node(s) holding the socket
+# Node-wide state changes (membership invalidations, presence) go out with
+# registry.broadcast(topic, payload) and reach the handler each other node
+# added with registry.on_broadcast(topic, handler). The InProcessBroker has
+# no other nodes to reach.
+
+Deliver = Callable[[str, dict], Awaitable[None]]
+Receive = Callable[[dict], Awaitable[None]]
+
+# Outbound queue policies, applied when a client's send queue is full:
+#   - drop: discard the new event
+#   - drop_oldest: discard the oldest queued event to make room
+#   - coalesce: replace a queued event with the same "coalesce_key", else drop_oldest
+#   - disconnect: evict the slow consumer, the client reconnects and resyncs
+SEND_QUEUE_POLICIES = ("drop", "drop_oldest", "coalesce", "disconnect")
+DEFAULT_SEND_QUEUE_SIZE = 256
+DEFAULT_SEND_QUEUE_POLICY = "disconnect"
+SLOW_CONSUMER_CLOSE_CODE = 1013  # try again later
+REPLACED_CLOSE_CODE = 4000  # the same user connected again, only the newest socket is kept
+
+class ConnectionMetrics:
+    def __init__(self) -> None:
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.evicted = 0
+        self.send_errors = 0
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+class ClientConnection:
+    """
+    A registered socket with its own bounded outbound queue drained by a
+    writer task, so a slow client only ever delays its own messages and
+    never the sender's receive loop.
+    """
+    def __init__(self, user_id: str, websocket: WebSocket, max_queue: int = DEFAULT_SEND_QUEUE_SIZE,
+                 policy: str = DEFAULT_SEND_QUEUE_POLICY, metrics: ConnectionMetrics | None = None) -> None:
+        if policy not in SEND_QUEUE_POLICIES:
+            raise ValueError(f"Unknown send queue policy: {policy}")
+        self.user_id = user_id
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.metrics = metrics or ConnectionMetrics()
+        self.pending: deque = deque()
+        self.has_items = asyncio.Event()
+        self.has_space = asyncio.Event()
+        self.has_space.set()
+        self.closed = False
+        self.max_depth = 0
+        self.writer = asyncio.create_task(self._write())
+        self.evictor: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self.pending)
+
+    async def send(self, event: dict) -> None:
+        # Replies to this client's own requests wait for queue space
+        while len(self.pending) >= self.max_queue and not self.closed:
+            self.has_space.clear()
+            await self.has_space.wait()
+        if not self.closed:
+            self._push(event)
+
+    def offer(self, event: dict) -> bool:
+        # Fan-out to this client never waits, overflow is handled by the policy
+        if self.closed:
+            return False
+        if len(self.pending) < self.max_queue:
+            self._push(event)
+            return True
+        return self._overflow(event)
+
+    def _push(self, event: dict) -> None:
+        self.pending.append(event)
+        self.metrics.enqueued += 1
+        self.max_depth = max(self.max_depth, len(self.pending))
+        self.has_items.set()
+
+    def _overflow(self, event: dict) -> bool:
+        if self.policy == "disconnect":
+            self.evict()
+            return False
+        if self.policy == "drop":
+            self.metrics.dropped += 1
+            return False
+        if self.policy == "coalesce" and event.get("coalesce_key") is not None:
+            for i, queued in enumerate(self.pending):
+                if queued.get("coalesce_key") == event["coalesce_key"]:
+                    self.pending[i] = event
+                    self.metrics.coalesced += 1
+                    return True
+        # drop_oldest, and coalesce with nothing to merge into
+        self.pending.popleft()
+        self.metrics.dropped += 1
+        self._push(event)
+        return True
+
+    def evict(self) -> None:
+        if self.closed:
+            return
+        logger.warning("Evicting slow consumer: %s (queue depth %s)", self.user_id, len(self.pending))
+        self.closed = True
+        self.metrics.evicted += 1
+        self.metrics.dropped += len(self.pending)
+        self.evictor = asyncio.create_task(self.disconnect(SLOW_CONSUMER_CLOSE_CODE))
+
+    async def disconnect(self, code: int) -> None:
+        # Stops the writer and closes the socket, its receive loop then ends and unregisters
+        await self.close()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def close(self) -> None:
+        self.closed = True
+        self.pending.clear()
+        self.has_space.set()
+        self.writer.cancel()
+        try:
+            await self.writer
+        except asyncio.CancelledError:
+            pass
+
+    async def _write(self) -> None:
+        while True:
+            while not self.pending:
+                self.has_items.clear()
+                await self.has_items.wait()
+            event = self.pending.popleft()
+            self.has_space.set()
+            if "coalesce_key" in event:
+                # fan-out shares one event dict between queues, strip the key on a copy
+                event = {key: value for key, value in event.items() if key != "coalesce_key"}
+            try:
+                await self.websocket.send_json(event)
+                self.metrics.sent += 1
+            except Exception as e:
+                self.metrics.send_errors += 1
+                logger.error("Error sending to receiver with id: %s Exception: %s", self.user_id, e)
+
+class InProcessBroker:
+    def __init__(self) -> None:
+        self.deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver, receive: Optional[Receive] = None) -> None:
+        self.deliver = deliver
+
+    async def stop(self) -> None:
+        self.deliver = None
+
+    async def subscribe(self, user_id: str) -> None:
+        pass
+
+    async def unsubscribe(self, user_id: str) -> None:
+        pass
+
+    async def publish(self, user_id: str, event: dict) -> None:
+        if self.deliver is not None:
+            await self.deliver(user_id, event)
+
+    async def online(self, user_ids: list[str]) -> set[str]:
+        # Only local sockets exist, which the registry already knows about
+        return set()
+
+    async def broadcast(self, event: dict) -> None:
+        pass
+
+class RedisBroker:
+    def __init__(self, url: str | None = None, client=None, channel_prefix: str = "chat:user:") -> None:
+        # client can be any redis.asyncio compatible client (e.g. a local stand-in for tests)
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("RedisBroker requires the 'redis' package")
+            client = redis.from_url(url)
+        self.client = client
+        self.channel_prefix = channel_prefix
+        # Every node listens on its own channel so the pubsub always has a subscription
+        self.node_id = str(uuid.uuid4())
+        self.node_channel = f"{channel_prefix}__node__:{self.node_id}"
+        self.broadcast_channel = f"{channel_prefix}__broadcast__"
+        self.pubsub = None
+        self.deliver: Optional[Deliver] = None
+        self.receive: Optional[Receive] = None
+        self.listener: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver, receive: Optional[Receive] = None) -> None:
+        self.deliver = deliver
+        self.receive = receive
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await self.pubsub.subscribe(self.node_channel, self.broadcast_channel)
+        self.listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self.listener is not None:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+            self.listener = None
+        if self.pubsub is not None:
+            await self.pubsub.close()
+            self.pubsub = None
+        await self.client.close()
+
+    async def subscribe(self, user_id: str) -> None:
+        await self.pubsub.subscribe(self.channel_prefix + user_id)
+
+    async def unsubscribe(self, user_id: str) -> None:
+        await self.pubsub.unsubscribe(self.channel_prefix + user_id)
+
+    async def publish(self, user_id: str, event: dict) -> None:
+        await self.client.publish(self.channel_prefix + user_id, json.dumps(event))
+
+    async def online(self, user_ids: list[str]) -> set[str]:
+        # A user is online on some node if their channel has a subscriber
+        online = set()
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            counts = await self.client.pubsub_numsub(*(self.channel_prefix + u for u in chunk))
+            for channel, count in counts:
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                if count:
+                    online.add(channel[len(self.channel_prefix):])
+        return online
+
+    async def broadcast(self, event: dict) -> None:
+        await self.client.publish(self.broadcast_channel, json.dumps({"node": self.node_id, "event": event}))
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+                if message is None or message.get("type") != "message":
+                    continue
+                channel = message["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                if channel == self.broadcast_channel:
+                    data = json.loads(message["data"])
+                    # our own broadcasts come back too, this node already applied them
+                    if data["node"] != self.node_id and self.receive is not None:
+                        await self.receive(data["event"])
+                    continue
+                user_id = channel[len(self.channel_prefix):]
+                await self.deliver(user_id, json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error handling broker message: %s", e)
+                await asyncio.sleep(1)
+
+class ConnectionRegistry:
+    connections: Dict[str, ClientConnection]
+
+    def __init__(self, broker, max_queue: int = DEFAULT_SEND_QUEUE_SIZE, policy: str = DEFAULT_SEND_QUEUE_POLICY) -> None:
+        self.broker = broker
+        self.max_queue = max_queue
+        self.policy = policy
+        self.metrics = ConnectionMetrics()
+        self.connections = {}
+        self.broadcast_handlers: Dict[str, Receive] = {}
+
+    async def start(self) -> None:
+        await self.broker.start(self.deliver_local, self.deliver_broadcast)
+
+    async def stop(self) -> None:
+        for connection in list(self.connections.values()):
+            await connection.close()
+        self.connections.clear()
+        await self.broker.stop()
+
+    async def register(self, user_id: str, websocket: WebSocket) -> ClientConnection:
+        previous = self.connections.get(user_id)
+        if previous is not None:
+            await previous.disconnect(REPLACED_CLOSE_CODE)
+        connection = ClientConnection(user_id, websocket, self.max_queue, self.policy, self.metrics)
+        self.connections[user_id] = connection
+        await self.broker.subscribe(user_id)
+        return connection
+
+    async def unregister(self, user_id: str, websocket: WebSocket) -> None:
+        # A reconnect may already have replaced this socket, only drop our own
+        connection = self.connections.get(user_id)
+        if connection is not None and connection.websocket is websocket:
+            del self.connections[user_id]
+            await connection.close()
+            await self.broker.unsubscribe(user_id)
+
+    def queue_metrics(self) -> dict:
+        depths = [c.depth for c in self.connections.values()]
+        return {
+            "connections": len(depths),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "queue_depth_high_water": max((c.max_depth for c in self.connections.values()), default=0),
+            "max_queue": self.max_queue,
+            "policy": self.policy,
+            **self.metrics.to_dict(),
+        }
+
+    def is_connected(self, user_id: str) -> bool:
+        return user_id in self.connections
+
+    async def filter_online(self, user_ids: list[str]) -> list[str]:
+        local = [u for u in user_ids if u in self.connections]
+        remote = [u for u in user_ids if u not in self.connections]
+        if remote:
+            try:
+                online = await self.broker.online(remote)
+                local.extend(u for u in remote if u in online)
+            except Exception as e:
+                logger.error("Error checking remote presence: %s", e)
+        return local
+
+    async def send_to_user(self, user_id: str, event: dict) -> None:
+        try:
+            await self.broker.publish(user_id, event)
+        except Exception as e:
+            logger.error("Error publishing event for user: %s Exception: %s", user_id, e)
+
+    async def deliver_local(self, user_id: str, event: dict) -> None:
+        connection = self.connections.get(user_id)
+        if connection is not None:
+            connection.offer(event)
+
+    def on_broadcast(self, topic: str, handler: Receive) -> None:
+        self.broadcast_handlers[topic] = handler
+
+    async def broadcast(self, topic: str, payload: dict) -> None:
+        # Reaches the other nodes only, callers apply the change locally themselves
+        try:
+            await self.broker.broadcast({"topic": topic, "payload": payload})
+        except Exception as e:
+            logger.error("Error broadcasting %s: %s", topic, e)
+
+    async def deliver_broadcast(self, event: dict) -> None:
+        handler = self.broadcast_handlers.get(event.get("topic"))
+        if handler is not None:
+            await handler(event["payload"])
+
+def create_registry() -> "ConnectionRegistry":
+    load_dotenv()
+    return ConnectionRegistry(
+        create_broker(),
+        max_queue=int(os.getenv("SEND_QUEUE_SIZE", str(DEFAULT_SEND_QUEUE_SIZE))),
+        policy=os.getenv("SEND_QUEUE_POLICY", DEFAULT_SEND_QUEUE_POLICY),
+    )
+
+def create_broker():
+    # BROKER_URL=redis://host:6379/0 enables cross-node delivery, otherwise in-process only
+    load_dotenv()
+    broker_url = os.getenv("BROKER_URL")
+    if broker_url and broker_url.startswith(("redis://", "rediss://")):
+        return RedisBroker(broker_url)
+    return InProcessBroker()
+
+registry = create_registry()
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from uow import AsyncUnitOfWork
+from services.connection_registry import ConnectionRegistry, registry
+from services.membership import MembershipIndex, membership_index
+
+logger = logging.getLogger(__name__)
+
+class GroupBroadcaster:
+    """
+    Delivers a group event to every online member except the sender.
+    Members come from the shared membership index (loaded from the database
+    on a miss), are filtered down to online users through the connection
+    registry and sent to concurrently; local sockets only get the event
+    enqueued on their bounded send queue, so a slow member can't hold up
+    delivery to the rest of the group.
+
+    Once started it also keeps the index coherent across workers: changes
+    saved here are broadcast as "membership" events and those from other
+    workers invalidate the local entries.
+    """
+    def __init__(self, registry: ConnectionRegistry, index: MembershipIndex) -> None:
+        self.registry = registry
+        self.index = index
+        self.pending: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.registry.on_broadcast("membership", self._invalidated)
+        # sync routes change groups from FastAPI's threadpool, hand the publish to the loop
+        self.index.publisher = lambda change: loop.call_soon_threadsafe(self._publish, change)
+
+    async def stop(self) -> None:
+        self.index.publisher = None
+        if self.pending:
+            await asyncio.gather(*self.pending, return_exceptions=True)
+
+    def _publish(self, change: dict) -> None:
+        task = asyncio.create_task(self.registry.broadcast("membership", change))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def _invalidated(self, change: dict) -> None:
+        self.index.invalidate(change)
+
+    async def get_members(self, group_id: str) -> set[str]:
+        members = self.index.members(group_id)
+        if members is not None:
+            return members
+        group = await AsyncUnitOfWork().groups_repository.get(group_id, None)
+        if group is None:
+            return set()
+        self.index.put_group(group)
+        return set(group.members)
+
+    async def broadcast(self, group_id: str, event: dict, exclude: str | None = None) -> int:
+        members = [m for m in await self.get_members(group_id) if m != exclude]
+        online = await self.registry.filter_online(members)
+        if not online:
+            return 0
+        await asyncio.gather(*(self.registry.send_to_user(member_id, event) for member_id in online))
+        logger.debug("Broadcast to group %s: %s/%s members online", group_id, len(online), len(members))
+        return len(online)
+
+group_broadcaster = GroupBroadcaster(registry, membership_index)
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+from dotenv import load_dotenv
+from domains.view_models import GroupDTO
+
+class MembershipIndex:
+    """
+    In-memory group membership index shared by the REST queries and the
+    WebSocket fan-out: group -> (group, member set) and member -> group ids.
+    It holds no database handle; the group services load entries on a miss
+    and keep them coherent by calling put_group/remove_group after every
+    mutation. Mutations go through group_changed/group_deleted, which also
+    pass the change to the publisher (set up by the group broadcaster) so
+    other workers drop their copy; entries still expire after ttl seconds
+    in case an invalidation is lost.
+
+    Sync routes use it from FastAPI's threadpool, so every access holds the
+    lock and sets are returned as copies.
+    """
+    groups: Dict[str, Tuple[float, GroupDTO, set]]
+    member_groups: Dict[str, set]
+    loaded_members: Dict[str, float]
+
+    def __init__(self, ttl: float = 300) -> None:
+        self.ttl = ttl
+        self.groups = {}
+        self.member_groups = {}
+        self.loaded_members = {}
+        # re-entrant, reads expire entries through remove_group
+        self.lock = threading.RLock()
+        # called with {"group_id", "members", "deleted"} after every local mutation
+        self.publisher: Optional[Callable[[dict], None]] = None
+
+    def group(self, group_id: str) -> Optional[GroupDTO]:
+        with self.lock:
+            entry = self.groups.get(group_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self.remove_group(group_id)
+                return None
+            return entry[1]
+
+    def members(self, group_id: str) -> Optional[set]:
+        with self.lock:
+            if self.group(group_id) is None:
+                return None
+            return set(self.groups[group_id][2])
+
+    def is_member(self, group_id: str, member_id: str) -> Optional[bool]:
+        # None when the group isn't indexed, callers then fall back to the database
+        with self.lock:
+            if self.group(group_id) is None:
+                return None
+            return member_id in self.groups[group_id][2]
+
+    def group_ids_for_member(self, member_id: str) -> Optional[set]:
+        # None unless every group of this member has been loaded
+        with self.lock:
+            loaded_until = self.loaded_members.get(member_id)
+            if loaded_until is None or loaded_until < time.monotonic():
+                return None
+            return set(self.member_groups.get(member_id, ()))
+
+    def groups_for_member(self, member_id: str) -> Optional[list[GroupDTO]]:
+        with self.lock:
+            group_ids = self.group_ids_for_member(member_id)
+            if group_ids is None:
+                return None
+            groups = [self.group(group_id) for group_id in group_ids]
+            if any(group is None for group in groups):
+                # one of the groups expired, have the caller reload the member
+                self.loaded_members.pop(member_id, None)
+                return None
+            return groups
+
+    def put_group(self, group: GroupDTO) -> None:
+        with self.lock:
+            previous = self.groups.get(group.group_id)
+            old_members = previous[2] if previous else set()
+            new_members = set(group.members)
+            for member_id in old_members - new_members:
+                self.member_groups.get(member_id, set()).discard(group.group_id)
+            for member_id in new_members - old_members:
+                self.member_groups.setdefault(member_id, set()).add(group.group_id)
+            self.groups[group.group_id] = (time.monotonic() + self.ttl, group, new_members)
+
+    def put_member_groups(self, member_id: str, groups: list[GroupDTO]) -> None:
+        with self.lock:
+            for group in groups:
+                self.put_group(group)
+            self.member_groups[member_id] = {group.group_id for group in groups}
+            self.loaded_members[member_id] = time.monotonic() + self.ttl
+
+    def remove_group(self, group_id: str, deleted: bool = False) -> None:
+        with self.lock:
+            entry = self.groups.pop(group_id, None)
+            if entry is None:
+                return
+            for member_id in entry[2]:
+                self.member_groups.get(member_id, set()).discard(group_id)
+                if not deleted:
+                    # the group still exists, so these members' group lists are now incomplete
+                    self.loaded_members.pop(member_id, None)
+
+    def group_changed(self, group: GroupDTO) -> None:
+        # After a create/update/membership change saved by this worker
+        with self.lock:
+            previous = self.groups.get(group.group_id)
+            members = set(group.members) | (previous[2] if previous else set())
+            self.put_group(group)
+        self._publish({"group_id": group.group_id, "members": sorted(members), "deleted": False})
+
+    def group_deleted(self, group_id: str) -> None:
+        with self.lock:
+            entry = self.groups.get(group_id)
+            members = entry[2] if entry else set()
+            self.remove_group(group_id, deleted=True)
+        self._publish({"group_id": group_id, "members": sorted(members), "deleted": True})
+
+    def invalidate(self, change: dict) -> None:
+        # Another worker changed this group, drop it and the affected members' group lists
+        with self.lock:
+            self.remove_group(change["group_id"], deleted=change["deleted"])
+            for member_id in change["members"]:
+                if change["deleted"]:
+                    # dropping a deleted group leaves the member's list complete
+                    self.member_groups.get(member_id, set()).discard(change["group_id"])
+                else:
+                    self.loaded_members.pop(member_id, None)
+
+    def _publish(self, change: dict) -> None:
+        if self.publisher is not None:
+            self.publisher(change)
+
+def create_membership_index() -> MembershipIndex:
+    load_dotenv()
+    return MembershipIndex(ttl=float(os.getenv("MEMBERSHIP_CACHE_TTL", "300")))
+
+membership_index = create_membership_index()
@@ -1,85 +1,99 @@
-from uow import UnitOfWork
-from services.commands import (
-    MessageCommandService,
-    GroupCommandService,
-    DirectMessageCommandService,
-    UserCommandService
+from uow import AsyncUnitOfWork
+from repos.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from services.write_behind import message_write_buffer
+from services.presence import presence_service
+from services.group_fanout import group_broadcaster
+from services.async_commands import (
+    AsyncMessageCommandService,
+    AsyncGroupCommandService,
+    AsyncDirectMessageCommandService,
+    AsyncUserCommandService,
+    AsyncChatCommandService,
+    run_in_background
 )
-from services.queries import (
-    MessageQueryService,
-    GroupQueryService,
-    DirectMessageQueryService,
-    UserQueryService
+from services.async_queries import (
+    AsyncMessageQueryService,
+    AsyncGroupQueryService,
+    AsyncDirectMessageQueryService,
+    AsyncUserQueryService,
+    AsyncChatQueryService
 )
 
-class MessageHandler:
-    def __init__(self,uow: UnitOfWork):
+class AsyncMessageHandler:
+    # One per WebSocket session, dispatches each frame's action to the async
+    # services so the receive loop never blocks the event loop on the database.
+    def __init__(self,uow: AsyncUnitOfWork):
         self.uow = uow
+        # Set by the WebSocket endpoint once the socket has authenticated
+        self.user_id = None
         # Command services
-        self.message_command = MessageCommandService(self.uow)
-        self.group_command = GroupCommandService(self.uow)
-        self.dm_command = DirectMessageCommandService(self.uow)
-        self.user_command = UserCommandService(self.uow)
+        self.message_command = AsyncMessageCommandService(self.uow, message_write_buffer, defer=run_in_background)
+        self.group_command = AsyncGroupCommandService(self.uow)
+        self.dm_command = AsyncDirectMessageCommandService(self.uow)
+        self.user_command = AsyncUserCommandService(self.uow)
+        self.chat_command = AsyncChatCommandService(self.uow, message_write_buffer)
         # Query services
-        self.message_query = MessageQueryService(self.uow)
-        self.group_query = GroupQueryService(self.uow)
-        self.dm_query = DirectMessageQueryService(self.uow)
-        self.user_query = UserQueryService(self.uow)
-
-    def handle(self, action: str, payload: dict) -> dict:
-        """
-        Dispatches the action to the appropriate handler.
-        Expected actions:
-            - create_message
-            - update_message
-            - delete_message
-            - get_message_by_id
-            - get_messages_by_sender
-            - create_group
-            - update_group
-            - add_group_member
-            - remove_group_member
-            - create_dm_chat
-            - get_user  (query user info)
-        """
+        self.message_query = AsyncMessageQueryService(self.uow, message_write_buffer)
+        self.group_query = AsyncGroupQueryService(self.uow)
+        self.dm_query = AsyncDirectMessageQueryService(self.uow)
+        self.user_query = AsyncUserQueryService(self.uow)
+        self.chat_query = AsyncChatQueryService(self.uow)
+        # Action dispatch table, one entry per supported WebSocket action
+        self.actions = {
+            "create_message": self.handle_create_message,
+            "create_messages": self.handle_create_messages,
+            "update_message": self.handle_update_message,
+            "delete_message": self.handle_delete_message,
+            "get_message_by_id": self.handle_get_message_by_id,
+            "get_messages_by_sender": self.handle_get_messages_by_sender,
+            "create_group": self.handle_create_group,
+            "update_group": self.handle_update_group,
+            "add_group_member": self.handle_add_group_member,
+            "remove_group_member": self.handle_remove_group_member,
+            "add_group_members": self.handle_add_group_members,
+            "remove_group_members": self.handle_remove_group_members,
+            "create_dm_chat": self.handle_create_dm_chat,
+            "get_user": self.handle_get_user,
+            "get_all_user_statuses": self.handle_get_all_user_statuses,
+            "mark_read": self.handle_mark_read,
+            "get_unread_counts": self.handle_get_unread_counts,
+            "get_inbox": self.handle_get_inbox,
+            "subscribe_presence": self.handle_subscribe_presence,
+            "unsubscribe_presence": self.handle_unsubscribe_presence,
+        }
+
+    async def handle(self, action: str, payload: dict) -> dict:
         try:
-            if action == "create_message":
-                return self.handle_create_message(payload)
-            elif action == "update_message":
-                return self.handle_update_message(payload)
-            elif action == "delete_message":
-                return self.handle_delete_message(payload)
-            elif action == "get_message_by_id":
-                return self.handle_get_message_by_id(payload)
-            elif action == "get_messages_by_sender":
-                return self.handle_get_messages_by_sender(payload)
-            elif action == "create_group":
-                return self.handle_create_group(payload)
-            elif action == "update_group":
-                return self.handle_update_group(payload)
-            elif action == "add_group_member":
-                return self.handle_add_group_member(payload)
-            elif action == "remove_group_member":
-                return self.handle_remove_group_member(payload)
-            elif action == "create_dm_chat":
-                return self.handle_create_dm_chat(payload)
-            elif action == "get_user":
-                return self.handle_get_user(payload)
-            elif action == "get_all_user_statuses":
-                return self.handle_get_all_user_statuses(payload)
-
-            else:
+            handler = self.actions.get(action)
+            if handler is None:
                 raise ValueError("Error : Unknown action '{}'".format(action))
+            return await handler(payload)
         except Exception as e:
             return {"error": str(e)}
 
-    def handle_create_message(self, payload: dict) -> dict:
-        sender_id = payload.get("sender_id")
+    def acting_user(self, payload: dict, key: str) -> str:
+        # Frames always act as the authenticated user, naming anyone else is rejected
+        claimed = payload.get(key)
+        if claimed is not None and claimed != self.user_id:
+            raise ValueError(f"{key} does not match the authenticated user")
+        return self.user_id
+
+    async def administered_group(self, group_id: str):
+        # Membership and group details may only be changed by the group admin
+        group_dto = await self.group_query.get_group_by_id(group_id)
+        if group_dto is None:
+            raise ValueError("Group not found")
+        if group_dto.admin != self.user_id:
+            raise ValueError("Only the group admin can change this group")
+        return group_dto
+
+    async def handle_create_message(self, payload: dict) -> dict:
+        sender_id = self.acting_user(payload, "sender_id")
         content = payload.get("content")
         receiver_user_id = payload.get("reciever_user_id")  # Note the spelling matches frontend
         receiver_group_id = payload.get("reciever_group_id")
         
-        msg_dto = self.message_command.create_message(
+        msg_dto = await self.message_command.create_message(
             sender_id,
             content,
             receiver_user_id,
@@ -94,84 +108,131 @@ class MessageHandler:
                 "content": content,
                 "reciever_user_id": receiver_user_id,
                 "reciever_group_id": receiver_group_id,
-                "timestamp": msg_dto.sent_at.isoformat() if hasattr(msg_dto, 'sent_at') else None
+                "timestamp": msg_dto.sent_at
             }
         }
 
-    def handle_update_message(self, payload: dict) -> dict:
+    async def handle_create_messages(self, payload: dict) -> dict:
+        items = [{**item, "sender_id": self.acting_user(item, "sender_id")} for item in payload.get("messages", [])]
+        results = await self.message_command.create_messages(items)
+        return {"results": results}
+
+    async def handle_update_message(self, payload: dict) -> dict:
         message_id = payload.get("message_id")
         new_content = payload.get("new_content")
-        msg_dto = self.message_command.update_message(message_id, new_content)
+        msg_dto = await self.message_command.update_message(message_id, new_content, self.user_id)
         return msg_dto.dict()
 
-    def handle_delete_message(self, payload: dict) -> dict:
+    async def handle_delete_message(self, payload: dict) -> dict:
         message_id = payload.get("message_id")
-        self.message_command.delete_message(message_id)
+        await self.message_command.delete_message(message_id, self.user_id)
         return {"status": "deleted", "message_id": message_id}
 
-    def handle_get_message_by_id(self, payload: dict) -> dict:
+    async def handle_get_message_by_id(self, payload: dict) -> dict:
         message_id = payload.get("message_id")
-        msg_dto = self.message_query.get_message_by_id(message_id)
+        msg_dto = await self.message_query.get_message_by_id(message_id)
         if msg_dto:
             return msg_dto.dict()
         return {}
 
-    def handle_get_messages_by_sender(self, payload: dict) -> dict:
+    async def handle_get_messages_by_sender(self, payload: dict) -> dict:
         sender_id = payload.get("sender_id")
-        messages = self.message_query.get_messages_by_sender(sender_id)
+        if "limit" in payload:
+            page = await self.message_query.get_messages_by_sender_page(
+                sender_id, min(int(payload["limit"]), MAX_PAGE_SIZE), payload.get("before"), payload.get("after")
+            )
+            return {"messages": [msg.dict() for msg in page.messages], "next_cursor": page.next_cursor}
+        messages = await self.message_query.get_messages_by_sender(sender_id)
         return {"messages": [msg.dict() for msg in messages]}
 
-    def handle_create_group(self, payload: dict) -> dict:
+    async def handle_create_group(self, payload: dict) -> dict:
         group_name = payload.get("group_name")
-        admin_id = payload.get("admin_id")
+        admin_id = self.acting_user(payload, "admin_id")
         group_description = payload.get("group_description")
-        group_dto = self.group_command.create_group(group_name, admin_id, group_description)
+        group_dto = await self.group_command.create_group(group_name, admin_id, group_description)
         return group_dto.dict()
 
-    def handle_update_group(self, payload: dict) -> dict:
+    async def handle_update_group(self, payload: dict) -> dict:
         group_id = payload.get("group_id")
         group_name = payload.get("group_name")
         group_description = payload.get("group_description")
-        group_dto = self.group_command.update_group(group_id, group_name, group_description)
+        await self.administered_group(group_id)
+        group_dto = await self.group_command.update_group(group_id, group_name, group_description)
         return group_dto.dict()
 
-    def handle_add_group_member(self, payload: dict) -> dict:
+    async def handle_add_group_member(self, payload: dict) -> dict:
         group_id = payload.get("group_id")
         member_id = payload.get("member_id")
-        group_dto = self.group_command.add_member(group_id, member_id)
+        await self.administered_group(group_id)
+        group_dto = await self.group_command.add_member(group_id, member_id)
         return group_dto.dict()
 
-    def handle_remove_group_member(self, payload: dict) -> dict:
+    async def handle_remove_group_member(self, payload: dict) -> dict:
         group_id = payload.get("group_id")
         member_id = payload.get("member_id")
-        group_dto = self.group_command.remove_member(group_id, member_id)
+        await self.administered_group(group_id)
+        group_dto = await self.group_command.remove_member(group_id, member_id)
         return group_dto.dict()
 
-    def handle_create_dm_chat(self, payload: dict) -> dict:
-        user1_id = payload.get("user1_id")
+    async def handle_add_group_members(self, payload: dict) -> dict:
+        group_id = payload.get("group_id")
+        member_ids = payload.get("member_ids") or []
+        await self.administered_group(group_id)
+        group_dto = await self.group_command.add_members(group_id, member_ids)
+        return group_dto.dict()
+
+    async def handle_remove_group_members(self, payload: dict) -> dict:
+        group_id = payload.get("group_id")
+        member_ids = payload.get("member_ids") or []
+        await self.administered_group(group_id)
+        group_dto = await self.group_command.remove_members(group_id, member_ids)
+        return group_dto.dict()
+
+    async def handle_create_dm_chat(self, payload: dict) -> dict:
+        user1_id = payload.get("user1_id") or self.user_id
         user2_id = payload.get("user2_id")
-        dm_dto = self.dm_command.create_dm_chat(user1_id, user2_id)
+        if self.user_id not in (user1_id, user2_id):
+            raise ValueError("A DM chat must include the authenticated user")
+        dm_dto = await self.dm_command.create_dm_chat(user1_id, user2_id)
         return dm_dto.dict()
 
-    def handle_get_user(self, payload: dict) -> dict:
+    async def handle_get_user(self, payload: dict) -> dict:
         user_id = payload.get("user_id")
-        user_dto = self.user_query.get_user_by_id(user_id)
+        user_dto = await self.user_query.get_user_by_id(user_id)
         if user_dto:
             return user_dto.dict()
         return {}
 
-    def handle_get_all_user_statuses(self, payload: dict) -> dict:
-        users = self.user_query.get_all_user_statuses()
-        return {"users": [user.dict() for user in users]}
-    
-# # Example usage (to be integrated with the API layer later):
-# if __name__ == "__main__":
-#     handler = MessageHandler()
-#     # Example: Create a message
-#     payload = {
-#         "sender_id": "user123",
-#         "content": "Hello, world!",
-#         "receiver_user_id": "user456"
-#     }
-#     response = handler.handle("create_message", payload)
-#     print(response)
\ No newline at end of file
+    async def handle_get_all_user_statuses(self, payload: dict) -> dict:
+        users = await self.user_query.get_all_user_statuses()
+        return {"users": users}
+
+    async def handle_mark_read(self, payload: dict) -> dict:
+        user_id = self.acting_user(payload, "user_id")
+        read_dto = await self.chat_command.mark_read(user_id, payload.get("chat_id"), payload.get("message_id"))
+        return read_dto.dict()
+
+    async def handle_get_unread_counts(self, payload: dict) -> dict:
+        chats = await self.chat_query.get_unread_counts(self.acting_user(payload, "user_id"))
+        return {"chats": [chat.dict() for chat in chats], "total_unread": sum(chat.unread for chat in chats)}
+
+    async def handle_get_inbox(self, payload: dict) -> dict:
+        limit = min(int(payload.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        page = await self.chat_query.get_inbox(self.acting_user(payload, "user_id"), limit, payload.get("before"))
+        return page.dict()
+
+    async def handle_subscribe_presence(self, payload: dict) -> dict:
+        # Watch explicit user_ids (contacts) and/or the members of group_id,
+        # returns a versioned snapshot, "presence" deltas follow
+        user_ids = list(payload.get("user_ids") or [])
+        group_id = payload.get("group_id")
+        if group_id:
+            members = await group_broadcaster.get_members(group_id)
+            if self.user_id not in members:
+                raise ValueError("Not a member of this group")
+            user_ids.extend(members)
+        return await presence_service.subscribe(self.user_id, user_ids)
+
+    async def handle_unsubscribe_presence(self, payload: dict) -> dict:
+        presence_service.unsubscribe(self.user_id)
+        return {}
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+from domains.models import now_millis
+from uow import AsyncUnitOfWork
+from services.connection_registry import ConnectionRegistry, registry
+
+logger = logging.getLogger(__name__)
+
+MAX_PRESENCE_SUBSCRIPTIONS = 1000
+
+class PresenceService:
+    """
+    Tracks online/offline/last seen for users connected to this process and
+    pushes changes to the sockets subscribed to them (a contact list or the
+    peers of a group). Changes are batched every flush_interval_ms: each
+    subscriber gets at most one "presence" event per flush holding only the
+    users that changed since the previous one.
+
+    Every subscriber has its own version counter. subscribe returns a
+    snapshot at the current version and each delta carries from_version and
+    version; a client that sees a gap (e.g. a delta replaced on a full send
+    queue) subscribes again to resync. Each flush also broadcasts this
+    node's changes through the registry's broker, and the other nodes fold
+    them into their next flush for their own subscribers. Snapshots ask the
+    broker which users are online on other nodes.
+    """
+    presence: Dict[str, dict]
+    pending: Dict[str, dict]
+    watchers: Dict[str, set]
+    subscriptions: Dict[str, set]
+    versions: Dict[str, int]
+
+    def __init__(self, registry: ConnectionRegistry, flush_interval_ms: int = 250) -> None:
+        self.registry = registry
+        self.flush_interval = flush_interval_ms / 1000
+        self.presence = {}
+        self.pending = {}
+        # changes broadcast by other nodes, only delivered to local watchers
+        self.remote_pending = {}
+        self.watchers = {}
+        self.subscriptions = {}
+        self.versions = {}
+        self.task: Optional[asyncio.Task] = None
+        self.stopping = False
+        self.stats = {"changes": 0, "flushes": 0, "deltas_sent": 0}
+
+    async def start(self) -> None:
+        self.registry.on_broadcast("presence", self._remote_changes)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.stopping = True
+            await self.task
+            self.task = None
+        await self.flush()
+
+    def metrics(self) -> dict:
+        return {
+            "tracked": len(self.presence),
+            "pending": len(self.pending),
+            "subscribers": len(self.subscriptions),
+            **self.stats,
+        }
+
+    def connected(self, user_id: str) -> None:
+        self._change(user_id, {"user_id": user_id, "status": "online", "last_seen": None})
+
+    async def disconnected(self, user_id: str) -> None:
+        self.unsubscribe(user_id)
+        self.versions.pop(user_id, None)
+        # still online if another node holds a socket for this user
+        if await self.registry.filter_online([user_id]):
+            return
+        self._change(user_id, {"user_id": user_id, "status": "offline", "last_seen": now_millis()})
+
+    def _change(self, user_id: str, entry: dict) -> None:
+        self.presence[user_id] = entry
+        self.pending[user_id] = entry
+        self.stats["changes"] += 1
+
+    async def subscribe(self, subscriber_id: str, user_ids: list[str]) -> dict:
+        # Replaces the subscriber's watch list and returns the snapshot to sync from
+        user_ids = list(dict.fromkeys(u for u in user_ids if u and u != subscriber_id))
+        if len(user_ids) > MAX_PRESENCE_SUBSCRIPTIONS:
+            raise ValueError(f"Too many presence subscriptions, at most {MAX_PRESENCE_SUBSCRIPTIONS} allowed")
+        self.unsubscribe(subscriber_id)
+        self.subscriptions[subscriber_id] = set(user_ids)
+        for user_id in user_ids:
+            self.watchers.setdefault(user_id, set()).add(subscriber_id)
+        version = self.versions.get(subscriber_id, 0) + 1
+        self.versions[subscriber_id] = version
+        return {"version": version, "presence": await self.snapshot(user_ids)}
+
+    async def _remote_changes(self, payload: dict) -> None:
+        for entry in payload["changes"]:
+            self.remote_pending[entry["user_id"]] = entry
+
+    def unsubscribe(self, subscriber_id: str) -> None:
+        for user_id in self.subscriptions.pop(subscriber_id, set()):
+            watchers = self.watchers.get(user_id)
+            if watchers is not None:
+                watchers.discard(subscriber_id)
+                if not watchers:
+                    del self.watchers[user_id]
+
+    async def snapshot(self, user_ids: list[str]) -> list[dict]:
+        entries = {u: self.presence[u] for u in user_ids if u in self.presence}
+        unknown = [u for u in user_ids if u not in entries or entries[u]["status"] == "offline"]
+        if unknown:
+            online = set(await self.registry.filter_online(unknown))
+            missing = [u for u in unknown if u not in entries and u not in online]
+            last_seen = {}
+            if missing:
+                try:
+                    last_seen = await AsyncUnitOfWork().user_repository.get_last_seen(missing)
+                except Exception as e:
+                    logger.error("Error loading last seen times: %s", e)
+            for user_id in unknown:
+                if user_id in online:
+                    entries[user_id] = {"user_id": user_id, "status": "online", "last_seen": None}
+                elif user_id not in entries:
+                    entries[user_id] = {"user_id": user_id, "status": "offline", "last_seen": last_seen.get(user_id)}
+        return [entries[u] for u in user_ids]
+
+    async def _run(self) -> None:
+        while not self.stopping:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Presence flush failed: %s", e)
+
+    async def flush(self) -> None:
+        if not self.pending and not self.remote_pending:
+            return
+        changes, self.pending = self.pending, {}
+        remote_changes, self.remote_pending = self.remote_pending, {}
+        self.stats["flushes"] += 1
+        if changes:
+            await self.registry.broadcast("presence", {"changes": jsonable_encoder(list(changes.values()))})
+
+        deltas: Dict[str, list] = {}
+        for user_id, entry in {**remote_changes, **changes}.items():
+            for subscriber_id in self.watchers.get(user_id, ()):
+                deltas.setdefault(subscriber_id, []).append(entry)
+        sends = []
+        for subscriber_id, entries in deltas.items():
+            from_version = self.versions.get(subscriber_id, 0)
+            self.versions[subscriber_id] = from_version + 1
+            event = {
+                "action": "presence",
+                "payload": {"from_version": from_version, "version": from_version + 1, "changes": entries},
+                # a newer delta may replace a queued one, the client sees the gap and resyncs
+                "coalesce_key": "presence",
+            }
+            sends.append(self.registry.send_to_user(subscriber_id, jsonable_encoder(event)))
+        if sends:
+            await asyncio.gather(*sends)
+            self.stats["deltas_sent"] += len(sends)
+
+        last_seen = {u: e["last_seen"] for u, e in changes.items() if e["last_seen"] is not None}
+        if last_seen:
+            try:
+                await AsyncUnitOfWork().user_repository.set_last_seen(last_seen)
+            except Exception as e:
+                logger.error("Error saving last seen times: %s", e)
+        for user_id, entry in changes.items():
+            # forget offline users nobody watches, their last seen is in the database now
+            if entry["status"] == "offline" and user_id not in self.watchers:
+                self.presence.pop(user_id, None)
+
+def create_presence_service() -> PresenceService:
+    load_dotenv()
+    return PresenceService(registry, flush_interval_ms=int(os.getenv("PRESENCE_FLUSH_MS", "250")))
+
+presence_service = create_presence_service()
@@ -1,16 +1,16 @@
 from typing import List
 from uow import UnitOfWork
-from domains.view_models import UserDTO, GroupDTO, MessageDTO, DirectMessageDTO, UserDTODBO
+from domains.view_models import UserDTO, UserDirectoryPage, GroupDTO, MessageDTO, MessagePage, DirectMessageDTO, UserDTODBO, ChatSummaryDTO, InboxPage
+from repos.pagination import DEFAULT_PAGE_SIZE, EXPORT_BATCH_SIZE, DEFAULT_USER_DIRECTORY_FIELDS
+from services.membership import membership_index
 
 class UserQueryService:
     def __init__(self, uow: UnitOfWork):
         self.uow = uow  
     
     def get_user_by_id(self, user_id: str) -> UserDTO:
-        user = self.uow.connection.db["users"].find_one({"user_id": user_id})
-        if not user:
-            return None
-        return UserDTO(**user)
+        # goes through the cached user repository
+        return self.uow.user_repository.get(user_id)
     
     def get_user_by_username(self, username: str) -> UserDTODBO:
         user = self.uow.connection.db["users"].find_one({"username": username})
@@ -18,21 +18,11 @@ class UserQueryService:
             return None
         return UserDTODBO(**user)
     
-    def get_all_users(self) -> list[UserDTO]:
-        users = self.uow.connection.db["users"].find()
-        users = [UserDTO(**user) for user in users]
-        if not users:
-            return []
-        # Return the list of user DTOs
-        return users
+    def get_user_directory(self, prefix: str | None = None, limit: int = DEFAULT_PAGE_SIZE, after: str | None = None, fields=DEFAULT_USER_DIRECTORY_FIELDS) -> UserDirectoryPage:
+        return self.uow.user_repository.find_directory(prefix, limit, after, fields)
 
     def get_user_groups(self, user_id: str) -> list[GroupDTO]:
-        groups = self.uow.connection.db["groups"].find({"members": user_id})
-        groups = [GroupDTO(**group) for group in groups]
-        if not groups:
-            return []
-        # Return the list of group DTOs
-        return groups
+        return GroupQueryService(self.uow).get_groups_by_member(user_id)
 
     def get_user_messages(self, user_id: str) -> list[MessageDTO]:
         messages = self.uow.connection.db["messages"].find({"$or": [{"sender_id": user_id}, {"reciever_user_id": user_id}, {"reciever_group_id": user_id}]})
@@ -42,7 +32,8 @@ class UserQueryService:
         return messages
     
     def get_chats_for_user(self, user_id):
-        # gets all the chats for a user which includes their groups as well as dms
+        # gets all the chats for a user which includes their groups as well as dms,
+        # ChatQueryService.get_inbox is the paginated, recency ordered alternative
         # first dms
         dms = self.uow.connection.db["direct_messages"].find({"$or": [{"user1_id": user_id}, {"user2_id": user_id}]})
         
@@ -50,8 +41,8 @@ class UserQueryService:
         gcs = self.uow.connection.db["groups"].find({"members": user_id})
         
         chats = {
-            "direct_messages": dms.dict() if dms else None,
-            "group_chats": gcs.dict() if gcs else None
+            "direct_messages": [DirectMessageDTO(**dm).dict() for dm in dms],
+            "group_chats": [GroupDTO(**gc).dict() for gc in gcs]
         }
         
         return chats
@@ -128,21 +119,45 @@ class MessageQueryService:
         
         return message_dtos
 
+    # Keyset-paginated variants, see MessageRepository.find_page
+    def get_conversation_page(self, user1: str, user2: str, limit: int = DEFAULT_PAGE_SIZE, before: str | None = None, after: str | None = None, raw: bool = False) -> MessagePage | dict:
+        return self.uow.message_repository.get_conversation_page(user1, user2, limit, before, after, raw)
+
+    def get_messages_for_user_page(self, user_id: str, limit: int = DEFAULT_PAGE_SIZE, before: str | None = None, after: str | None = None, raw: bool = False) -> MessagePage | dict:
+        return self.uow.message_repository.get_messages_for_user_page(user_id, limit, before, after, raw)
+
+    def get_messages_by_sender_page(self, sender_id: str, limit: int = DEFAULT_PAGE_SIZE, before: str | None = None, after: str | None = None, raw: bool = False) -> MessagePage | dict:
+        return self.uow.message_repository.get_messages_by_sender_page(sender_id, limit, before, after, raw)
+
+    # Streaming exports, see MessageRepository.export
+    def export_conversation(self, user1: str, user2: str, batch_size: int = EXPORT_BATCH_SIZE, after: str | None = None):
+        return self.uow.message_repository.export_conversation(user1, user2, batch_size, after)
+
+    def export_messages_for_user(self, user_id: str, batch_size: int = EXPORT_BATCH_SIZE, after: str | None = None):
+        return self.uow.message_repository.export_messages_for_user(user_id, batch_size, after)
+
 class GroupQueryService:
     def __init__(self, uow: UnitOfWork):
         self.uow = uow
 
     def get_group_by_id(self, group_id: str) -> GroupDTO:
+        cached = membership_index.group(group_id)
+        if cached is not None:
+            return cached
         group = self.uow.connection.db["groups"].find_one({"group_id": group_id})
         if not group:
             return None
-        return GroupDTO(**group)
+        group_dto = GroupDTO(**group)
+        membership_index.put_group(group_dto)
+        return group_dto
 
     def get_groups_by_member(self, member_id: str) -> list[GroupDTO]:
+        cached = membership_index.groups_for_member(member_id)
+        if cached is not None:
+            return cached
         groups = self.uow.connection.db["groups"].find({"members": member_id})
         groups = [GroupDTO(**group) for group in groups]
-        if not groups:
-            return []
+        membership_index.put_member_groups(member_id, groups)
         return groups
     
     def get_all_groups(self) -> list[GroupDTO]:
@@ -163,8 +178,7 @@ class GroupQueryService:
         return UserDTO(**admin)
     
     def get_groups_by_user_id(self, user_id: str) -> List[GroupDTO]:
-        groups = self.uow.groups.get_by_member(user_id)
-        return [GroupDTO.from_entity(group) for group in groups]
+        return self.get_groups_by_member(user_id)
 
 class DirectMessageQueryService:
     def __init__(self, uow: UnitOfWork):
@@ -184,7 +198,17 @@ class DirectMessageQueryService:
         return chats
     
     def get_direct_messages_between_users(self, user1_id: str, user2_id: str) -> DirectMessageDTO:
-        chat = self.uow.connection.db["direct_messages"].find_one({"$or": [{"user1_id": user1_id, "user2_id": user2_id}, {"user1_id": user2_id, "user2_id": user1_id}]})
-        if not chat:
-            return None
-        return DirectMessageDTO(**chat)
\ No newline at end of file
+        # one lookup on the unique pair_key index
+        return self.uow.dm_repository.get_by_pair(user1_id, user2_id)
+
+class ChatQueryService:
+    def __init__(self, uow: UnitOfWork):
+        self.uow = uow
+
+    def get_unread_counts(self, user_id: str) -> list[ChatSummaryDTO]:
+        # One indexed read of the user's read state rows, no message scan
+        return self.uow.chat_summary_repository.get_for_user(user_id)
+
+    def get_inbox(self, user_id: str, limit: int = DEFAULT_PAGE_SIZE, before: str | None = None) -> InboxPage:
+        # The user's chats with last message preview, most recent first
+        return self.uow.chat_summary_repository.find_inbox(user_id, limit, before)
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dotenv import load_dotenv
+from domains.view_models import MessageDTO
+from uow import AsyncUnitOfWork
+from services.async_commands import AsyncMessageCommandService
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = "E11000"
+
+class WriteBehindBuffer:
+    """
+    Buffers new messages in memory and persists them in groups through
+    MessageRepository.save_many, every flush_interval_ms or as soon as
+    max_batch messages are pending, then updates the chat summaries for the
+    messages written, so the per-member summary writes of a group message
+    stay off the send path too. Batches that fail to flush are appended to
+    a local JSON lines spool file, which is replayed on start and retried
+    every spool_retry_s while the buffer runs. Reads and writes of a single
+    message (edits, deletes, mark read, get by id) call persist first, so
+    it is in the database even if it was acknowledged moments ago.
+    """
+    pending: list[MessageDTO]
+
+    def __init__(self, flush_interval_ms: int = 50, max_batch: int = 200, spool_path: str = "message_spool.jsonl", spool_retry_s: float = 30) -> None:
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.spool_path = spool_path
+        self.spool_retry = spool_retry_s
+        self.next_replay = 0.0
+        self.pending = []
+        # ids enqueued but not yet written (or spooled)
+        self.unsaved: set[str] = set()
+        self.flush_lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.stopping = False
+        self.stats = {"enqueued": 0, "flushed": 0, "flushes": 0, "spooled": 0, "replayed": 0}
+
+    async def start(self) -> None:
+        await self.replay_spool()
+        self.next_replay = time.monotonic() + self.spool_retry
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # Let the flush loop finish its current batch instead of cancelling it mid-write
+        if self.task is not None:
+            self.stopping = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+        await self.flush()
+
+    def enqueue(self, message_dto: MessageDTO) -> None:
+        self.pending.append(message_dto)
+        self.unsaved.add(message_dto.message_id)
+        self.stats["enqueued"] += 1
+        if len(self.pending) >= self.max_batch:
+            self.wakeup.set()
+
+    def metrics(self) -> dict:
+        return {"pending": len(self.pending), **self.stats}
+
+    async def _run(self) -> None:
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+            if time.monotonic() >= self.next_replay:
+                self.next_replay = time.monotonic() + self.spool_retry
+                try:
+                    await self.replay_spool()
+                except Exception as e:
+                    logger.error("Spool replay failed: %s", e)
+
+    async def flush(self) -> None:
+        # The lock also makes callers wait for a batch another flush is writing
+        async with self.flush_lock:
+            while self.pending:
+                batch = self.pending[:self.max_batch]
+                self.pending = self.pending[self.max_batch:]
+                await self._persist(batch)
+
+    async def persist(self, message_id: str) -> None:
+        # Writes the message now if it is still buffered
+        if message_id in self.unsaved:
+            await self.flush()
+
+    async def _persist(self, batch: list[MessageDTO]) -> None:
+        self.stats["flushes"] += 1
+        try:
+            try:
+                errors = await AsyncUnitOfWork().message_repository.save_many(batch)
+            except Exception as e:
+                logger.error("Write-behind flush failed, spooling %s messages: %s", len(batch), e)
+                await self._spool(batch)
+                return
+            # A duplicate key means the message is already stored (e.g. a replayed spool)
+            failed = [batch[i] for i, err in errors.items() if DUPLICATE_KEY_ERROR not in err]
+            self.stats["flushed"] += len(batch) - len(failed)
+            if failed:
+                logger.error("Write-behind flush rejected %s messages, spooling them", len(failed))
+                await self._spool(failed)
+            inserted = [message_dto for i, message_dto in enumerate(batch) if i not in errors]
+            if inserted:
+                await self._record_summaries(inserted)
+        finally:
+            self.unsaved.difference_update(message_dto.message_id for message_dto in batch)
+
+    async def _record_summaries(self, batch: list[MessageDTO]) -> None:
+        # Same update as the unbuffered send, once per batch (record_summaries logs its own errors)
+        await AsyncMessageCommandService(AsyncUnitOfWork()).record_summaries(batch)
+
+    async def _spool(self, batch: list[MessageDTO]) -> None:
+        # File writes and fsync run on a worker thread, off the event loop
+        try:
+            await asyncio.to_thread(self._write_spool, [message_dto.json() for message_dto in batch])
+            self.stats["spooled"] += len(batch)
+        except Exception as e:
+            logger.critical("Unable to spool %s messages, they are lost: %s", len(batch), e)
+
+    def _write_spool(self, lines: list[str]) -> None:
+        with open(self.spool_path, "a", encoding="utf-8") as spool:
+            for line in lines:
+                spool.write(line + "\n")
+            spool.flush()
+            os.fsync(spool.fileno())
+
+    async def replay_spool(self) -> None:
+        # Workers sharing a spool take turns through a lock file, whoever gets it
+        # replays and the others skip. The lock is released if the process dies.
+        with open(self.spool_path + ".lock", "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    logger.info("Spool %s is being replayed by another process", self.spool_path)
+                    return
+            replay_path = self.spool_path + ".replay"
+            try:
+                messages = await asyncio.to_thread(self._claim_spool, replay_path)
+            except FileNotFoundError:
+                return
+            if messages is None:
+                return
+            logger.info("Replaying %s spooled messages", len(messages))
+            for i in range(0, len(messages), self.max_batch):
+                await self._persist(messages[i:i + self.max_batch])
+            self.stats["replayed"] += len(messages)
+            try:
+                os.remove(replay_path)
+            except FileNotFoundError:
+                pass
+
+    def _claim_spool(self, replay_path: str) -> list[MessageDTO] | None:
+        # Move the spool aside first so messages that fail again are re-spooled to a fresh
+        # file, a leftover .replay file means a previous replay was interrupted
+        if not os.path.exists(replay_path):
+            if not os.path.exists(self.spool_path):
+                return None
+            os.replace(self.spool_path, replay_path)
+        with open(replay_path, encoding="utf-8") as spool:
+            return [MessageDTO(**json.loads(line)) for line in spool if line.strip()]
+
+def create_write_buffer() -> WriteBehindBuffer | None:
+    # WRITE_BEHIND_ENABLED=true acknowledges real-time messages before they are persisted
+    load_dotenv()
+    if os.getenv("WRITE_BEHIND_ENABLED", "false").lower() != "true":
+        return None
+    if os.getenv("SERVERLESS", "false").lower() == "true":
+        # nothing would flush the buffer between invocations
+        logger.warning("WRITE_BEHIND_ENABLED is ignored in serverless mode")
+        return None
+    return WriteBehindBuffer(
+        flush_interval_ms=int(os.getenv("WRITE_BEHIND_FLUSH_MS", "50")),
+        max_batch=int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200")),
+        spool_path=os.getenv("WRITE_BEHIND_SPOOL", "message_spool.jsonl"),
+        spool_retry_s=float(os.getenv("WRITE_BEHIND_SPOOL_RETRY_S", "30")),
+    )
+
+message_write_buffer = create_write_buffer()
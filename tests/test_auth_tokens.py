@@ -0,0 +1,57 @@
+import hashlib
+import time
+from datetime import timedelta
+import pytest
+from jose import jwt
+import auth
+from auth import InvalidToken, create_access_token, decode_token, token_cache
+
+@pytest.fixture(autouse=True)
+def empty_token_cache():
+    token_cache.entries.clear()
+    yield
+    token_cache.entries.clear()
+
+@pytest.fixture
+def jwt_decodes(monkeypatch):
+    # Counts signature checks, i.e. decode_token calls that missed the cache
+    calls = []
+    real_decode = jwt.decode
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return real_decode(*args, **kwargs)
+    monkeypatch.setattr(jwt, "decode", counting_decode)
+    return calls
+
+def digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def test_valid_token_is_verified_once(jwt_decodes):
+    token = create_access_token({"sub": "alice"}, timedelta(minutes=5))
+    assert decode_token(token)["sub"] == "alice"
+    assert decode_token(token)["sub"] == "alice"
+    assert len(jwt_decodes) == 1
+
+def test_cached_claims_expire_with_the_token():
+    token = create_access_token({"sub": "alice"}, timedelta(seconds=30))
+    decode_token(token)
+    expires_at, _ = token_cache.entries[digest(token)]
+    assert expires_at - time.monotonic() <= 31
+
+def test_expired_token_is_rejected_and_not_cached():
+    token = create_access_token({"sub": "alice"}, timedelta(seconds=-1))
+    with pytest.raises(InvalidToken):
+        decode_token(token)
+    assert digest(token) not in token_cache.entries
+
+def test_forged_token_is_rejected():
+    token = jwt.encode({"sub": "mallory", "exp": time.time() + 60}, auth.SECRET_KEY + "x", algorithm=auth.ALGORITHM)
+    with pytest.raises(InvalidToken):
+        decode_token(token)
+
+def test_evicted_token_is_verified_again(jwt_decodes):
+    token = create_access_token({"sub": "alice"}, timedelta(minutes=5))
+    decode_token(token)
+    token_cache.delete(digest(token))
+    assert decode_token(token)["sub"] == "alice"
+    assert len(jwt_decodes) == 2
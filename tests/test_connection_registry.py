@@ -0,0 +1,215 @@
+import asyncio
+import pytest
+from services.connection_registry import (
+    ClientConnection,
+    ConnectionRegistry,
+    InProcessBroker,
+    RedisBroker,
+    REPLACED_CLOSE_CODE,
+    SLOW_CONSUMER_CLOSE_CODE,
+)
+
+class StalledWebSocket:
+    # Never finishes a send, so whatever is queued stays queued
+    def __init__(self) -> None:
+        self.sent = []
+        self.closed_with = None
+
+    async def send_json(self, event: dict) -> None:
+        self.sent.append(event)
+        await asyncio.Event().wait()
+
+    async def close(self, code: int = 1000) -> None:
+        self.closed_with = code
+
+def run(scenario):
+    async def main():
+        websocket = StalledWebSocket()
+        return await scenario(websocket)
+    return asyncio.run(main())
+
+def fill(connection: ClientConnection, count: int) -> None:
+    # offer never yields, so the writer task hasn't taken anything yet
+    for n in range(count):
+        connection.offer({"n": n})
+
+def test_drop_discards_the_new_event():
+    async def scenario(websocket):
+        connection = ClientConnection("u", websocket, max_queue=2, policy="drop")
+        fill(connection, 2)
+        assert connection.offer({"n": 2}) is False
+        assert list(connection.pending) == [{"n": 0}, {"n": 1}]
+        assert connection.metrics.dropped == 1
+        await connection.close()
+    run(scenario)
+
+def test_drop_oldest_makes_room():
+    async def scenario(websocket):
+        connection = ClientConnection("u", websocket, max_queue=2, policy="drop_oldest")
+        fill(connection, 2)
+        assert connection.offer({"n": 2}) is True
+        assert list(connection.pending) == [{"n": 1}, {"n": 2}]
+        assert connection.metrics.dropped == 1
+        await connection.close()
+    run(scenario)
+
+def test_coalesce_replaces_event_with_the_same_key():
+    async def scenario(websocket):
+        connection = ClientConnection("u", websocket, max_queue=2, policy="coalesce")
+        connection.offer({"n": 0, "coalesce_key": "presence"})
+        connection.offer({"n": 1})
+        assert connection.offer({"n": 2, "coalesce_key": "presence"}) is True
+        assert list(connection.pending) == [{"n": 2, "coalesce_key": "presence"}, {"n": 1}]
+        assert connection.metrics.coalesced == 1 and connection.metrics.dropped == 0
+        # nothing to merge into, falls back to drop_oldest
+        connection.offer({"n": 3, "coalesce_key": "typing"})
+        assert list(connection.pending) == [{"n": 1}, {"n": 3, "coalesce_key": "typing"}]
+        await connection.close()
+    run(scenario)
+
+def test_disconnect_evicts_the_slow_consumer():
+    async def scenario(websocket):
+        connection = ClientConnection("u", websocket, max_queue=2, policy="disconnect")
+        fill(connection, 2)
+        assert connection.offer({"n": 2}) is False
+        assert connection.closed and connection.metrics.evicted == 1
+        await connection.evictor
+        assert websocket.closed_with == SLOW_CONSUMER_CLOSE_CODE
+        assert connection.offer({"n": 3}) is False
+    run(scenario)
+
+def test_writer_strips_coalesce_key_without_mutating_shared_events():
+    async def scenario(websocket):
+        event = {"action": "presence", "coalesce_key": "presence"}
+        connection = ClientConnection("u", websocket, max_queue=2, policy="coalesce")
+        connection.offer(event)
+        await asyncio.sleep(0)
+        assert websocket.sent == [{"action": "presence"}]
+        assert event == {"action": "presence", "coalesce_key": "presence"}
+        await connection.close()
+    run(scenario)
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        ClientConnection("u", StalledWebSocket(), policy="bogus")
+
+class RecordingWebSocket:
+    def __init__(self) -> None:
+        self.sent = []
+        self.closed_with = None
+
+    async def send_json(self, event: dict) -> None:
+        self.sent.append(event)
+
+    async def close(self, code: int = 1000) -> None:
+        self.closed_with = code
+
+async def settle() -> None:
+    # Lets listener and writer tasks pass messages along
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+def test_reconnect_closes_the_replaced_socket():
+    async def main():
+        registry = ConnectionRegistry(InProcessBroker())
+        await registry.start()
+        old, new = RecordingWebSocket(), RecordingWebSocket()
+        first = await registry.register("u", old)
+        await registry.register("u", new)
+        assert first.closed and old.closed_with == REPLACED_CLOSE_CODE
+        # the old socket's receive loop ending must not drop the new connection
+        await registry.unregister("u", old)
+        assert registry.is_connected("u")
+        await registry.send_to_user("u", {"n": 1})
+        await settle()
+        assert new.sent == [{"n": 1}] and old.sent == []
+        await registry.stop()
+    asyncio.run(main())
+
+class FakeRedisServer:
+    def __init__(self) -> None:
+        self.subscribers: dict = {}
+
+class FakePubSub:
+    def __init__(self, server: FakeRedisServer) -> None:
+        self.server = server
+        self.messages = asyncio.Queue()
+
+    async def subscribe(self, *channels: str) -> None:
+        for channel in channels:
+            self.server.subscribers.setdefault(channel, set()).add(self)
+
+    async def unsubscribe(self, *channels: str) -> None:
+        for channel in channels:
+            self.server.subscribers.get(channel, set()).discard(self)
+
+    async def get_message(self, timeout: float | None = None):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self) -> None:
+        for subscribers in self.server.subscribers.values():
+            subscribers.discard(self)
+
+class FakeRedis:
+    # Local stand-in for a redis.asyncio client, nodes sharing a server see each other's messages
+    def __init__(self, server: FakeRedisServer) -> None:
+        self.server = server
+        self.closed = False
+
+    def pubsub(self, ignore_subscribe_messages: bool = False) -> FakePubSub:
+        return FakePubSub(self.server)
+
+    async def publish(self, channel: str, data: str) -> int:
+        subscribers = self.server.subscribers.get(channel, set())
+        for pubsub in subscribers:
+            pubsub.messages.put_nowait({"type": "message", "channel": channel.encode(), "data": data.encode()})
+        return len(subscribers)
+
+    async def pubsub_numsub(self, *channels: str) -> list:
+        return [(channel.encode(), len(self.server.subscribers.get(channel, ()))) for channel in channels]
+
+    async def close(self) -> None:
+        self.closed = True
+
+def test_redis_broker_routes_events_between_nodes():
+    async def main():
+        server = FakeRedisServer()
+        node_a = ConnectionRegistry(RedisBroker(client=FakeRedis(server)))
+        node_b = ConnectionRegistry(RedisBroker(client=FakeRedis(server)))
+        await node_a.start()
+        await node_b.start()
+        websocket = RecordingWebSocket()
+        await node_a.register("alice", websocket)
+
+        assert await node_b.filter_online(["alice", "bob"]) == ["alice"]
+        await node_b.send_to_user("alice", {"action": "new_message", "payload": {"content": "hi"}})
+        await settle()
+        assert websocket.sent == [{"action": "new_message", "payload": {"content": "hi"}}]
+
+        await node_a.unregister("alice", websocket)
+        assert await node_b.filter_online(["alice"]) == []
+        await node_a.stop()
+        await node_b.stop()
+        assert node_a.broker.client.closed
+    asyncio.run(main())
+
+def test_redis_broker_broadcasts_reach_the_other_nodes_only():
+    async def main():
+        server = FakeRedisServer()
+        nodes = [ConnectionRegistry(RedisBroker(client=FakeRedis(server))) for _ in range(3)]
+        received = {i: [] for i in range(3)}
+        for i, node in enumerate(nodes):
+            async def handler(payload, i=i):
+                received[i].append(payload)
+            node.on_broadcast("membership", handler)
+            await node.start()
+        await nodes[0].broadcast("membership", {"group_id": "g"})
+        await nodes[0].broadcast("unhandled", {"ignored": True})
+        await settle()
+        assert received == {0: [], 1: [{"group_id": "g"}], 2: [{"group_id": "g"}]}
+        for node in nodes:
+            await node.stop()
+    asyncio.run(main())
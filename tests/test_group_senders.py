@@ -0,0 +1,51 @@
+import pytest
+from domains.view_models import GroupDTO
+from services.commands import MessageCommandService, build_message_batch
+from services.membership import membership_index
+
+def group(group_id: str, members: list[str]) -> GroupDTO:
+    return GroupDTO(group_id=group_id, group_name=group_id, group_description=None,
+                    created_at="2024-05-01T12:00:00", updated_at="2024-05-01T12:00:00", members=members, admin=members[0])
+
+class FakeGroupsRepository:
+    def __init__(self, *groups: GroupDTO) -> None:
+        self.groups = {g.group_id: g for g in groups}
+        self.reads = 0
+
+    def get(self, group_id: str, session=None):
+        self.reads += 1
+        return self.groups.get(group_id)
+
+class FakeUnitOfWork:
+    def __init__(self, *groups: GroupDTO) -> None:
+        self.groups_repository = FakeGroupsRepository(*groups)
+
+@pytest.fixture(autouse=True)
+def empty_index():
+    membership_index.remove_group("g", deleted=True)
+    yield
+    membership_index.remove_group("g", deleted=True)
+
+def test_batch_rejects_unknown_groups_and_non_members():
+    items = [
+        {"sender_id": "a", "reciever_group_id": "g", "content": "hi"},
+        {"sender_id": "b", "reciever_group_id": "g", "content": "hi"},
+        {"sender_id": "a", "reciever_group_id": "missing", "content": "hi"},
+    ]
+    results, valid = build_message_batch(items, {"a", "b"}, {"g": {"a"}, "missing": None})
+    assert [index for index, _ in valid] == [0]
+    assert results[1]["error"] == "Sender is not a member of group: g"
+    assert results[2]["error"] == "Group not found: missing"
+
+def test_group_sender_falls_back_to_the_repository_once():
+    service = MessageCommandService(FakeUnitOfWork(group("g", ["a", "b"])))
+    service.check_group_sender("a", "g")
+    service.check_group_sender("b", "g")
+    assert service.uow.groups_repository.reads == 1
+    with pytest.raises(ValueError, match="not a member"):
+        service.check_group_sender("mallory", "g")
+
+def test_unknown_group_is_rejected():
+    service = MessageCommandService(FakeUnitOfWork())
+    with pytest.raises(ValueError, match="Group not found"):
+        service.check_group_sender("a", "g")
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from domains.view_models import GroupDTO
+from services.membership import MembershipIndex
+
+def group(group_id: str, members: list[str]) -> GroupDTO:
+    return GroupDTO(group_id=group_id, group_name=group_id, group_description=None,
+                    created_at="2024-05-01T12:00:00", updated_at="2024-05-01T12:00:00", members=members, admin=members[0])
+
+def test_unknown_group_is_a_miss():
+    index = MembershipIndex()
+    assert index.members("g") is None
+    assert index.is_member("g", "a") is None
+
+def test_put_group_indexes_members_both_ways():
+    index = MembershipIndex()
+    index.put_group(group("g", ["a", "b"]))
+    assert index.members("g") == {"a", "b"}
+    assert index.is_member("g", "a") is True and index.is_member("g", "c") is False
+    assert index.member_groups["a"] == {"g"}
+
+def test_put_group_moves_changed_members():
+    index = MembershipIndex()
+    index.put_member_groups("a", [group("g", ["a", "b"])])
+    index.put_group(group("g", ["b", "c"]))
+    assert index.members("g") == {"b", "c"}
+    assert index.group_ids_for_member("a") == set()
+    assert index.member_groups["c"] == {"g"}
+
+def test_member_groups_are_only_complete_once_loaded():
+    index = MembershipIndex()
+    index.put_group(group("g", ["a"]))
+    assert index.groups_for_member("a") is None
+    index.put_member_groups("a", [group("g", ["a"]), group("h", ["a", "b"])])
+    assert {g.group_id for g in index.groups_for_member("a")} == {"g", "h"}
+
+def test_removing_a_group_invalidates_member_lists_unless_deleted():
+    index = MembershipIndex()
+    index.put_member_groups("a", [group("g", ["a"]), group("h", ["a"])])
+    index.remove_group("g", deleted=True)
+    assert index.group_ids_for_member("a") == {"h"}
+    index.remove_group("h")
+    assert index.group_ids_for_member("a") is None
+
+def test_entries_expire():
+    index = MembershipIndex(ttl=0.01)
+    index.put_member_groups("a", [group("g", ["a"])])
+    time.sleep(0.02)
+    assert index.members("g") is None
+    assert index.groups_for_member("a") is None
+
+def test_returned_sets_are_copies():
+    index = MembershipIndex()
+    index.put_member_groups("a", [group("g", ["a", "b"])])
+    index.members("g").add("intruder")
+    index.group_ids_for_member("a").add("h")
+    assert index.members("g") == {"a", "b"}
+    assert index.group_ids_for_member("a") == {"g"}
+
+def test_mutations_are_published_with_old_and_new_members():
+    index = MembershipIndex()
+    changes = []
+    index.publisher = changes.append
+    index.put_group(group("g", ["a", "b"]))
+    assert changes == []
+    index.group_changed(group("g", ["a", "c"]))
+    index.group_deleted("g")
+    assert changes == [
+        {"group_id": "g", "members": ["a", "b", "c"], "deleted": False},
+        {"group_id": "g", "members": ["a", "c"], "deleted": True},
+    ]
+
+def test_invalidation_from_another_worker():
+    here, there = MembershipIndex(), MembershipIndex()
+    here.publisher = there.invalidate
+    there.put_member_groups("a", [group("g", ["a", "b"])])
+    there.put_member_groups("c", [])
+    here.group_changed(group("g", ["a", "c"]))
+    assert there.members("g") is None
+    # c's cached group list doesn't know about g yet, so it must be reloaded
+    assert there.groups_for_member("c") is None
+    assert there.groups_for_member("a") is None
+
+def test_deleted_group_invalidation_keeps_complete_member_lists():
+    here, there = MembershipIndex(), MembershipIndex()
+    here.publisher = there.invalidate
+    there.put_member_groups("a", [group("g", ["a"]), group("h", ["a"])])
+    here.put_group(group("g", ["a"]))
+    here.group_deleted("g")
+    assert there.members("g") is None
+    assert there.group_ids_for_member("a") == {"h"}
+
+class BroadcastingRegistry:
+    # Stands in for the connection registry of a node
+    def __init__(self) -> None:
+        self.handlers = {}
+        self.sent = []
+
+    def on_broadcast(self, topic, handler) -> None:
+        self.handlers[topic] = handler
+
+    async def broadcast(self, topic, payload) -> None:
+        self.sent.append((topic, payload))
+
+def test_broadcaster_publishes_changes_and_applies_remote_ones():
+    from services.group_fanout import GroupBroadcaster
+    async def main():
+        registry, index = BroadcastingRegistry(), MembershipIndex()
+        broadcaster = GroupBroadcaster(registry, index)
+        await broadcaster.start()
+        index.group_changed(group("g", ["a"]))
+        await asyncio.sleep(0)
+        await broadcaster.stop()
+        assert registry.sent == [("membership", {"group_id": "g", "members": ["a"], "deleted": False})]
+        await registry.handlers["membership"]({"group_id": "g", "members": ["a"], "deleted": False})
+        assert index.members("g") is None
+        assert index.publisher is None
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+import asyncio
+import gzip
+import json
+import zlib
+from datetime import datetime, timezone
+from api.responses import dumps, ndjson_stream
+
+BATCHES = [
+    ([{"message_id": "m1", "content": "hi"}, {"message_id": "m2", "content": "héllo"}], "cursor-1"),
+    ([{"message_id": "m3", "content": "bye"}], "cursor-2"),
+]
+
+def collect(compress: bool) -> list[bytes]:
+    async def batches():
+        for batch in BATCHES:
+            yield batch
+    async def main():
+        return [chunk async for chunk in ndjson_stream(batches(), compress=compress)]
+    return asyncio.run(main())
+
+def lines(data: bytes) -> list[dict]:
+    return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+
+EXPECTED = [
+    {"message_id": "m1", "content": "hi"},
+    {"message_id": "m2", "content": "héllo"},
+    {"checkpoint": "cursor-1"},
+    {"message_id": "m3", "content": "bye"},
+    {"checkpoint": "cursor-2"},
+]
+
+def test_plain_stream_has_a_checkpoint_after_each_batch():
+    chunks = collect(compress=False)
+    assert len(chunks) == 2
+    assert lines(b"".join(chunks)) == EXPECTED
+
+def test_gzip_stream_is_a_single_valid_gzip_member():
+    assert lines(gzip.decompress(b"".join(collect(compress=True)))) == EXPECTED
+
+def test_gzip_stream_flushes_whole_batches():
+    # Each batch decompresses on its own, so a client sees it without waiting for the end
+    decompressor = zlib.decompressobj(wbits=31)
+    chunks = collect(compress=True)
+    first = decompressor.decompress(chunks[0])
+    assert lines(first) == EXPECTED[:3]
+    rest = b"".join(decompressor.decompress(chunk) for chunk in chunks[1:])
+    assert lines(rest) == EXPECTED[3:]
+    assert decompressor.eof
+
+def test_dumps_serializes_datetimes():
+    sent_at = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert json.loads(dumps({"sent_at": sent_at})) == {"sent_at": "2024-01-02T03:04:05+00:00"}
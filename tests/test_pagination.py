@@ -0,0 +1,40 @@
+from datetime import datetime
+import pytest
+from repos.pagination import encode_cursor, decode_cursor, keyset_branches, conversation_query
+
+SENT_AT = datetime(2024, 5, 1, 12, 30, 15, 123000)
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(SENT_AT, "m1")) == (SENT_AT, "m1")
+
+def test_cursor_accepts_unmigrated_string_dates():
+    assert decode_cursor(encode_cursor(SENT_AT.isoformat(), "m1")) == (SENT_AT, "m1")
+
+def test_cursor_is_urlsafe_without_padding():
+    cursor = encode_cursor(SENT_AT, "m1")
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+
+@pytest.mark.parametrize("cursor", ["not-base64!", encode_cursor(SENT_AT, "m1")[:-4], "WyJ4Il0"])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def test_keyset_without_cursor_returns_query():
+    query = {"sender_id": "a"}
+    assert keyset_branches(query, None, older=True) is query
+
+def test_keyset_older_splits_single_query():
+    query = keyset_branches({"sender_id": "a"}, encode_cursor(SENT_AT, "m1"), older=True)
+    assert query == {"$or": [
+        {"sender_id": "a", "sent_at": {"$lt": SENT_AT}},
+        {"sender_id": "a", "sent_at": SENT_AT, "message_id": {"$lt": "m1"}},
+    ]}
+
+def test_keyset_newer_splits_every_or_branch():
+    query = keyset_branches(conversation_query("a", "b"), encode_cursor(SENT_AT, "m1"), older=False)
+    assert query["$or"] == [
+        {"sender_id": "a", "reciever_user_id": "b", "sent_at": {"$gt": SENT_AT}},
+        {"sender_id": "a", "reciever_user_id": "b", "sent_at": SENT_AT, "message_id": {"$gt": "m1"}},
+        {"sender_id": "b", "reciever_user_id": "a", "sent_at": {"$gt": SENT_AT}},
+        {"sender_id": "b", "reciever_user_id": "a", "sent_at": SENT_AT, "message_id": {"$gt": "m1"}},
+    ]
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import pytest
+from auth import PasswordHasherPool, PasswordPoolBusy
+
+def run(scenario):
+    pool = PasswordHasherPool(max_workers=1, max_queue=1)
+    gate = threading.Event()
+    try:
+        return asyncio.run(scenario(pool, gate))
+    finally:
+        gate.set()
+        pool.shutdown()
+
+async def started(pool: PasswordHasherPool, count: int) -> None:
+    # Lets the submitted jobs be admitted before the scenario goes on
+    while pool.metrics()["in_flight"] < count:
+        await asyncio.sleep(0)
+
+def test_rejects_beyond_workers_plus_queue():
+    async def scenario(pool, gate):
+        running = asyncio.ensure_future(pool.run(gate.wait))
+        queued = asyncio.ensure_future(pool.run(gate.wait))
+        await started(pool, 2)
+        assert pool.metrics()["queued"] == 1
+        with pytest.raises(PasswordPoolBusy):
+            await pool.run(gate.wait)
+        gate.set()
+        assert await asyncio.gather(running, queued) == [True, True]
+        return pool.metrics()
+    metrics = run(scenario)
+    assert metrics["rejected"] == 1
+    assert metrics["completed"] == 2
+    assert metrics["in_flight"] == 0
+
+def test_cancelled_queued_job_releases_its_slot():
+    async def scenario(pool, gate):
+        running = asyncio.ensure_future(pool.run(gate.wait))
+        queued = asyncio.ensure_future(pool.run(gate.wait))
+        await started(pool, 2)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert pool.metrics()["in_flight"] == 1
+        # The freed slot admits a new job instead of failing with PasswordPoolBusy
+        retry = asyncio.ensure_future(pool.run(gate.wait))
+        await started(pool, 2)
+        gate.set()
+        await asyncio.gather(running, retry)
+        return pool.metrics()
+    metrics = run(scenario)
+    assert metrics["in_flight"] == 0
+    assert metrics["completed"] == 2
+
+def test_failing_job_releases_its_slot():
+    def fail():
+        raise RuntimeError("bad hash")
+    async def scenario(pool, gate):
+        with pytest.raises(RuntimeError):
+            await pool.run(fail)
+        return pool.metrics()
+    metrics = run(scenario)
+    assert metrics["in_flight"] == 0
+    assert metrics["completed"] == 1
+
+def test_run_blocking_shares_the_admission_limit():
+    async def scenario(pool, gate):
+        running = asyncio.ensure_future(pool.run(gate.wait))
+        queued = asyncio.ensure_future(pool.run(gate.wait))
+        await started(pool, 2)
+        with pytest.raises(PasswordPoolBusy):
+            pool.run_blocking(gate.wait)
+        gate.set()
+        await asyncio.gather(running, queued)
+        return pool.run_blocking(lambda: "hashed")
+    assert run(scenario) == "hashed"
@@ -0,0 +1,126 @@
+import asyncio
+import pytest
+import services.presence
+from services.presence import PresenceService
+
+class FakeRegistry:
+    # Records what the presence service sends and broadcasts
+    def __init__(self) -> None:
+        self.online_elsewhere: set = set()
+        self.sent = []
+        self.broadcasts = []
+        self.handlers = {}
+
+    async def filter_online(self, user_ids: list[str]) -> list[str]:
+        return [u for u in user_ids if u in self.online_elsewhere]
+
+    async def send_to_user(self, user_id: str, event: dict) -> None:
+        self.sent.append((user_id, event))
+
+    def on_broadcast(self, topic, handler) -> None:
+        self.handlers[topic] = handler
+
+    async def broadcast(self, topic: str, payload: dict) -> None:
+        self.broadcasts.append((topic, payload))
+
+class FakeUserRepository:
+    def __init__(self) -> None:
+        self.saved = {}
+
+    async def get_last_seen(self, user_ids: list[str]) -> dict:
+        return {u: self.saved[u] for u in user_ids if u in self.saved}
+
+    async def set_last_seen(self, last_seen: dict) -> None:
+        self.saved.update(last_seen)
+
+@pytest.fixture
+def users(monkeypatch):
+    repository = FakeUserRepository()
+    class FakeUnitOfWork:
+        user_repository = repository
+    monkeypatch.setattr(services.presence, "AsyncUnitOfWork", FakeUnitOfWork)
+    return repository
+
+def run(scenario):
+    async def main():
+        registry = FakeRegistry()
+        return await scenario(PresenceService(registry), registry)
+    return asyncio.run(main())
+
+def deltas(registry: FakeRegistry, subscriber_id: str) -> list[dict]:
+    return [event["payload"] for user_id, event in registry.sent if user_id == subscriber_id]
+
+def test_deltas_continue_from_the_snapshot_version(users):
+    async def scenario(presence, registry):
+        snapshot = await presence.subscribe("s", ["a", "b"])
+        assert snapshot["version"] == 1
+        assert [entry["status"] for entry in snapshot["presence"]] == ["offline", "offline"]
+        presence.connected("a")
+        await presence.flush()
+        presence.connected("b")
+        await presence.flush()
+        return deltas(registry, "s"), await presence.subscribe("s", ["a", "b"])
+    sent, resync = run(scenario)
+    assert [(d["from_version"], d["version"]) for d in sent] == [(1, 2), (2, 3)]
+    assert [[c["user_id"] for c in d["changes"]] for d in sent] == [["a"], ["b"]]
+    # subscribing again starts a new version for the client to sync from
+    assert resync["version"] == 4
+    assert [entry["status"] for entry in resync["presence"]] == ["online", "online"]
+
+def test_one_coalescable_delta_per_subscriber_per_flush(users):
+    async def scenario(presence, registry):
+        await presence.subscribe("s", ["a", "b"])
+        await presence.subscribe("t", ["b", "c"])
+        presence.connected("a")
+        presence.connected("b")
+        presence.connected("d")
+        await presence.flush()
+        await presence.flush()
+        return registry.sent
+    sent = run(scenario)
+    assert sorted(user_id for user_id, _ in sent) == ["s", "t"]
+    assert all(event["coalesce_key"] == "presence" for _, event in sent)
+    changes = {user_id: [c["user_id"] for c in event["payload"]["changes"]] for user_id, event in sent}
+    assert changes == {"s": ["a", "b"], "t": ["b"]}
+
+def test_unsubscribed_users_get_no_deltas(users):
+    async def scenario(presence, registry):
+        await presence.subscribe("s", ["a"])
+        presence.unsubscribe("s")
+        presence.connected("a")
+        await presence.flush()
+        return registry.sent
+    assert run(scenario) == []
+
+def test_disconnect_is_not_offline_while_another_node_has_the_user(users):
+    async def scenario(presence, registry):
+        await presence.subscribe("s", ["a"])
+        presence.connected("a")
+        await presence.flush()
+        registry.online_elsewhere.add("a")
+        await presence.disconnected("a")
+        await presence.flush()
+        assert len(deltas(registry, "s")) == 1
+        registry.online_elsewhere.clear()
+        await presence.disconnected("a")
+        await presence.flush()
+        return deltas(registry, "s")
+    sent = run(scenario)
+    assert [c["status"] for d in sent for c in d["changes"]] == ["online", "offline"]
+    assert "a" in users.saved
+
+def test_changes_are_broadcast_and_remote_ones_delivered_locally(users):
+    async def scenario(presence, registry):
+        await presence.start()
+        await presence.subscribe("s", ["a", "remote"])
+        presence.connected("a")
+        await registry.handlers["presence"]({"changes": [{"user_id": "remote", "status": "offline", "last_seen": "2024-05-01T12:00:00"}]})
+        await presence.flush()
+        await presence.stop()
+        return registry
+    registry = run(scenario)
+    # only this node's change goes out, the remote one isn't echoed back
+    assert registry.broadcasts == [("presence", {"changes": [{"user_id": "a", "status": "online", "last_seen": None}]})]
+    assert [[c["user_id"] for c in d["changes"]] for d in deltas(registry, "s")] == [["remote", "a"]]
+    # the node that saw the disconnect saves the last seen time, not this one
+    assert users.saved == {}
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+from domains.models import dm_pair_key
+from domains.view_models import MessageDTO, MessagePage
+from repos.pagination import chat_messages_query
+from services.commands import MessageCommandService, summary_updates, message_chat_id
+
+START = datetime(2024, 5, 1, 12, 0)
+
+def message(n: int, sender: str, user: str | None = None, group: str | None = None) -> MessageDTO:
+    sent_at = START + timedelta(seconds=n)
+    return MessageDTO(sender_id=sender, content=f"m{n}", sent_at=sent_at, updated_at=sent_at,
+                      message_id=f"m{n}", reciever_user_id=user, reciever_group_id=group)
+
+def test_chat_ids():
+    assert message_chat_id(message(1, "b", user="a")) == dm_pair_key("a", "b") == "a|b"
+    assert message_chat_id(message(1, "a", group="g")) == "g"
+    assert message_chat_id(message(1, "a")) is None
+
+def test_dm_counts_unread_for_receiver_and_reads_for_sender():
+    m1, m2 = message(1, "a", user="b"), message(2, "a", user="b")
+    updates = summary_updates([m1, m2], {})
+    assert updates[("b", "a|b")] == {"chat_type": "dm", "peer_id": "a", "unread": 2, "read": None, "last": m2}
+    assert updates[("a", "a|b")] == {"chat_type": "dm", "peer_id": "b", "unread": 0, "read": (m2, 0), "last": m2}
+
+def test_reply_resets_read_position_and_counts_what_follows():
+    m1, m2, m3 = message(1, "a", user="b"), message(2, "b", user="a"), message(3, "a", user="b")
+    updates = summary_updates([m1, m2, m3], {})
+    assert updates[("b", "a|b")]["read"] == (m2, 1)
+    assert updates[("a", "a|b")]["read"] == (m3, 0)
+    assert updates[("b", "a|b")]["last"] is m3
+
+def test_group_message_fans_out_to_members():
+    m1 = message(1, "a", group="g")
+    updates = summary_updates([m1], {"g": {"a", "b", "c"}})
+    assert set(updates) == {("a", "g"), ("b", "g"), ("c", "g")}
+    assert updates[("b", "g")]["unread"] == 1 and updates[("b", "g")]["peer_id"] is None
+    assert updates[("a", "g")]["read"] == (m1, 0)
+
+def test_messages_without_chat_are_skipped():
+    assert summary_updates([message(1, "a")], {}) == {}
+
+class FakeMessageRepository:
+    def __init__(self, *messages: MessageDTO) -> None:
+        self.messages = {m.message_id: m for m in messages}
+        self.queries = []
+
+    def get(self, message_id, sender_id):
+        return self.messages.get(message_id)
+
+    def save(self, message_dto) -> None:
+        self.messages[message_dto.message_id] = message_dto
+
+    def update(self, message_id, message_dto) -> None:
+        self.messages[message_id] = message_dto
+
+    def delete(self, message_id) -> None:
+        self.messages.pop(message_id, None)
+
+    def find_page(self, query, limit):
+        self.queries.append(query)
+        newest = sorted(self.messages.values(), key=lambda m: (m.sent_at, m.message_id), reverse=True)
+        return MessagePage(messages=newest[:limit], next_cursor=None)
+
+class FakeChatSummaryRepository:
+    def __init__(self) -> None:
+        self.calls = []
+
+    def record_messages(self, updates) -> None:
+        self.calls.append(("record", sorted(updates)))
+
+    def message_edited(self, chat_id, message_dto) -> None:
+        self.calls.append(("edited", chat_id, message_dto.content))
+
+    def message_deleted(self, chat_id, message_dto, latest) -> None:
+        self.calls.append(("deleted", chat_id, message_dto.message_id, latest.message_id if latest else None))
+
+class FakeUsers:
+    def get(self, user_id):
+        return user_id
+
+class FakeUnitOfWork:
+    def __init__(self, *messages: MessageDTO) -> None:
+        self.message_repository = FakeMessageRepository(*messages)
+        self.chat_summary_repository = FakeChatSummaryRepository()
+        self.user_repository = FakeUsers()
+
+def recent(n: int, sender: str, user: str) -> MessageDTO:
+    # delete_message only allows deleting recent messages
+    sent_at = datetime.now(timezone.utc) - timedelta(seconds=10 - n)
+    return MessageDTO(sender_id=sender, content=f"m{n}", sent_at=sent_at, updated_at=sent_at,
+                      message_id=f"m{n}", reciever_user_id=user)
+
+def test_summary_writes_are_deferred_until_after_the_reply():
+    deferred = []
+    uow = FakeUnitOfWork()
+    service = MessageCommandService(uow, defer=lambda fn, *args: deferred.append((fn, args)))
+    service.create_message("a", "hi", "b", None)
+    assert uow.chat_summary_repository.calls == []
+    for fn, args in deferred:
+        fn(*args)
+    assert uow.chat_summary_repository.calls == [("record", [("a", "a|b"), ("b", "a|b")])]
+
+def test_edit_refreshes_the_preview():
+    uow = FakeUnitOfWork(recent(1, "a", "b"))
+    MessageCommandService(uow).update_message("m1", "edited")
+    assert uow.chat_summary_repository.calls == [("edited", "a|b", "edited")]
+
+def test_delete_falls_back_to_the_newest_remaining_message():
+    uow = FakeUnitOfWork(recent(1, "a", "b"), recent(2, "b", "a"))
+    service = MessageCommandService(uow)
+    service.delete_message("m2")
+    service.delete_message("m1")
+    assert uow.message_repository.queries == [chat_messages_query("a|b")] * 2
+    assert uow.chat_summary_repository.calls == [("deleted", "a|b", "m2", "m1"), ("deleted", "a|b", "m1", None)]
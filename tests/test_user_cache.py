@@ -0,0 +1,133 @@
+import pytest
+import repos.cache
+from domains.view_models import UserDTO
+from repos.cache import CachedUserRepository, TTLCache, user_id_key, username_key
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(repos.cache.time, "monotonic", clock)
+    return clock
+
+class FakeUserRepository:
+    # Counts reads so tests can tell cache hits from database reads
+    def __init__(self, *users: UserDTO) -> None:
+        self.users = {user.user_id: user for user in users}
+        self.reads = 0
+
+    def get(self, user_id: str):
+        self.reads += 1
+        return self.users.get(user_id)
+
+    def get_by_username(self, username: str):
+        self.reads += 1
+        return next((u for u in self.users.values() if u.username == username), None)
+
+    def existing_user_ids(self, user_ids: list[str]) -> set[str]:
+        self.reads += 1
+        return {u for u in user_ids if u in self.users}
+
+    def update(self, user_id: str, user_dto: UserDTO) -> None:
+        self.users[user_id] = user_dto
+
+    def delete(self, user_id: str) -> None:
+        self.users.pop(user_id, None)
+
+def user(user_id: str = "u1", username: str = "alice", status: str = "online") -> UserDTO:
+    return UserDTO(user_id=user_id, username=username, email=f"{username}@example.com", status=status, joined_at="2024-01-01T00:00:00", updated_at="2024-01-01T00:00:00")
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(ttl=10)
+    cache.set("a", 1)
+    clock.now += 9
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a") is None
+    assert "a" not in cache.entries
+
+def test_per_entry_ttl_overrides_the_default(clock):
+    cache = TTLCache(ttl=60)
+    cache.set("short", 1, ttl=1)
+    cache.set("long", 2)
+    clock.now += 2
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_delete_and_stats():
+    cache = TTLCache()
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.delete("a", "missing")
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.stats() == {"backend": "memory", "size": 1, "hits": 1, "misses": 1}
+
+def test_reads_are_served_from_the_cache():
+    repository = FakeUserRepository(user())
+    cached = CachedUserRepository(repository, TTLCache())
+    assert cached.get("u1").username == "alice"
+    assert cached.get("u1").username == "alice"
+    assert cached.get_by_username("alice").user_id == "u1"
+    assert repository.reads == 1
+
+def test_update_invalidates_both_keys_including_the_old_username():
+    repository = FakeUserRepository(user())
+    cache = TTLCache()
+    cached = CachedUserRepository(repository, cache)
+    cached.get("u1")
+    cached.update("u1", user(username="alicia", status="away"))
+    assert cache.get(user_id_key("u1")) is None
+    assert cache.get(username_key("alice")) is None
+    assert cached.get("u1").status == "away"
+    assert cached.get_by_username("alice") is None
+    assert cached.get_by_username("alicia").user_id == "u1"
+
+def test_delete_invalidates_the_cached_user():
+    repository = FakeUserRepository(user())
+    cached = CachedUserRepository(repository, TTLCache())
+    cached.get("u1")
+    cached.delete("u1")
+    assert cached.get("u1") is None
+    assert cached.get_by_username("alice") is None
+
+def test_existing_user_ids_only_queries_uncached_ids():
+    repository = FakeUserRepository(user(), user("u2", "bob"))
+    cached = CachedUserRepository(repository, TTLCache())
+    cached.get("u1")
+    repository.reads = 0
+    assert cached.existing_user_ids(["u1", "u2", "u3"]) == {"u1", "u2"}
+    assert repository.reads == 1
+
+class BrokenCache:
+    def get(self, key):
+        raise ConnectionError("cache down")
+
+    def set(self, key, value):
+        raise ConnectionError("cache down")
+
+    def delete(self, *keys):
+        raise ConnectionError("cache down")
+
+def test_cache_failures_fall_back_to_the_repository():
+    repository = FakeUserRepository(user())
+    cached = CachedUserRepository(repository, BrokenCache())
+    assert cached.get("u1").username == "alice"
+    cached.update("u1", user(status="away"))
+    assert cached.get("u1").status == "away"
@@ -0,0 +1,147 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+import pytest
+import services.write_behind
+from domains.view_models import MessageDTO
+from services.write_behind import DUPLICATE_KEY_ERROR, WriteBehindBuffer
+
+class FakeMessageRepository:
+    # Shared by every unit of work the buffer opens, fail_next makes save_many raise
+    def __init__(self) -> None:
+        self.stored: dict[str, MessageDTO] = {}
+        self.fail_next = 0
+        self.calls = 0
+
+    async def save_many(self, batch: list[MessageDTO]) -> dict[int, str]:
+        self.calls += 1
+        if self.fail_next:
+            self.fail_next -= 1
+            raise ConnectionError("database unavailable")
+        errors = {}
+        for i, message_dto in enumerate(batch):
+            if message_dto.message_id in self.stored:
+                errors[i] = f"{DUPLICATE_KEY_ERROR} duplicate key error"
+            else:
+                self.stored[message_dto.message_id] = message_dto
+        return errors
+
+@pytest.fixture
+def repository(monkeypatch):
+    repository = FakeMessageRepository()
+    summarized = []
+    class FakeUnitOfWork:
+        message_repository = repository
+    class FakeMessageCommandService:
+        def __init__(self, uow) -> None:
+            pass
+        async def record_summaries(self, message_dtos) -> None:
+            summarized.extend(m.message_id for m in message_dtos)
+    monkeypatch.setattr(services.write_behind, "AsyncUnitOfWork", FakeUnitOfWork)
+    monkeypatch.setattr(services.write_behind, "AsyncMessageCommandService", FakeMessageCommandService)
+    repository.summarized = summarized
+    return repository
+
+@pytest.fixture
+def spool_path(tmp_path):
+    return str(tmp_path / "spool.jsonl")
+
+def message(n: int) -> MessageDTO:
+    now = datetime(2024, 5, 1, 12, 0, n, tzinfo=timezone.utc)
+    return MessageDTO(sender_id="a", content=f"m{n}", sent_at=now, message_id=f"m{n}", updated_at=now, reciever_user_id="b")
+
+def test_flush_writes_batches_and_records_their_summaries(repository, spool_path):
+    async def main():
+        buffer = WriteBehindBuffer(max_batch=2, spool_path=spool_path)
+        for n in range(5):
+            buffer.enqueue(message(n))
+        assert buffer.unsaved == {f"m{n}" for n in range(5)}
+        await buffer.flush()
+        return buffer
+    buffer = asyncio.run(main())
+    assert repository.calls == 3
+    assert sorted(repository.stored) == [f"m{n}" for n in range(5)]
+    assert repository.summarized == [f"m{n}" for n in range(5)]
+    assert buffer.unsaved == set() and buffer.pending == []
+
+def test_persist_only_flushes_buffered_messages(repository, spool_path):
+    async def main():
+        buffer = WriteBehindBuffer(spool_path=spool_path)
+        await buffer.persist("m0")
+        assert repository.calls == 0
+        buffer.enqueue(message(0))
+        await buffer.persist("m0")
+    asyncio.run(main())
+    assert "m0" in repository.stored
+
+def test_failed_batch_is_spooled_and_replayed(repository, spool_path):
+    async def main():
+        buffer = WriteBehindBuffer(spool_path=spool_path)
+        buffer.enqueue(message(0))
+        buffer.enqueue(message(1))
+        repository.fail_next = 1
+        await buffer.flush()
+        assert buffer.stats["spooled"] == 2 and buffer.unsaved == set()
+        assert repository.stored == {} and repository.summarized == []
+        assert len(open(spool_path).readlines()) == 2
+        await buffer.replay_spool()
+        return buffer
+    buffer = asyncio.run(main())
+    assert sorted(repository.stored) == ["m0", "m1"]
+    assert repository.stored["m0"] == message(0)
+    assert repository.summarized == ["m0", "m1"]
+    assert buffer.stats["replayed"] == 2
+    assert not os.path.exists(spool_path) and not os.path.exists(spool_path + ".replay")
+
+def test_replay_skips_messages_that_are_already_stored(repository, spool_path):
+    async def main():
+        buffer = WriteBehindBuffer(spool_path=spool_path)
+        await buffer._spool([message(0), message(1)])
+        # m0 made it to the database before the failure was reported
+        repository.stored["m0"] = message(0)
+        await buffer.replay_spool()
+        return buffer
+    buffer = asyncio.run(main())
+    assert sorted(repository.stored) == ["m0", "m1"]
+    assert repository.summarized == ["m1"]
+    assert buffer.stats["spooled"] == 2
+
+def test_messages_failing_again_go_to_a_fresh_spool(repository, spool_path):
+    async def main():
+        buffer = WriteBehindBuffer(spool_path=spool_path)
+        await buffer._spool([message(0)])
+        repository.fail_next = 1
+        await buffer.replay_spool()
+        assert not os.path.exists(spool_path + ".replay")
+        assert len(open(spool_path).readlines()) == 1
+        await buffer.replay_spool()
+    asyncio.run(main())
+    assert list(repository.stored) == ["m0"]
+
+def test_interrupted_replay_is_resumed(repository, spool_path):
+    async def main():
+        buffer = WriteBehindBuffer(spool_path=spool_path)
+        await buffer._spool([message(0)])
+        os.replace(spool_path, spool_path + ".replay")
+        await buffer._spool([message(1)])
+        await buffer.replay_spool()
+        assert list(repository.stored) == ["m0"]
+        await buffer.replay_spool()
+    asyncio.run(main())
+    assert sorted(repository.stored) == ["m0", "m1"]
+
+def test_running_buffer_retries_the_spool(repository, spool_path):
+    async def main():
+        buffer = WriteBehindBuffer(flush_interval_ms=1, spool_path=spool_path, spool_retry_s=0)
+        await buffer.start()
+        repository.fail_next = 1
+        buffer.enqueue(message(0))
+        for _ in range(200):
+            if "m0" in repository.stored:
+                break
+            await asyncio.sleep(0.005)
+        await buffer.stop()
+        return buffer
+    buffer = asyncio.run(main())
+    assert "m0" in repository.stored
+    assert buffer.stats["spooled"] == 1 and buffer.stats["replayed"] == 1
@@ -3,11 +3,14 @@ from dotenv import load_dotenv
 import os
 import certifi
 import logging
-from repos.repository import UserRepository,MessageRepository,GroupRepository,DirectMessageRepository
+from repos.repository import UserRepository,MessageRepository,GroupRepository,DirectMessageRepository,ChatSummaryRepository
+from repos.async_repository import AsyncUserRepository,AsyncMessageRepository,AsyncGroupRepository,AsyncDirectMessageRepository,AsyncChatSummaryRepository
+from repos.cache import CachedUserRepository, AsyncCachedUserRepository, user_cache
 from pymongo.mongo_client import MongoClient
 from pymongo.database import Database
+from pymongo.asynchronous.mongo_client import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class Connection:
@@ -18,41 +21,143 @@ class Connection:
         self.client = client
         self.db = db
 
+def pool_settings() -> dict:
+    load_dotenv()
+    max_idle_time_ms = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0"))
+    return {
+        "uri": os.getenv("MONGO_URI"),
+        "db_name": os.getenv("DB_NAME", "baqir_chat_app"),
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": max_idle_time_ms or None,
+    }
+
+class ConnectionPool:
+    """
+    Process-wide MongoClient shared by every UnitOfWork.
+    MongoClient already maintains its own pool of sockets, so we create it once
+    (at app startup or lazily on first use) and close it at shutdown.
+    Pool sizing is configured through the environment:
+        - MONGO_MAX_POOL_SIZE (default 100)
+        - MONGO_MIN_POOL_SIZE (default 0)
+        - MONGO_MAX_IDLE_TIME_MS (default 0 = no limit)
+    """
+    connection: Connection | None
+
+    def __init__(self) -> None:
+        self.connection = None
+
+    def open(self) -> Connection:
+        if self.connection is not None:
+            return self.connection
+        try:
+            settings = pool_settings()
+            logger.info("Connecting to DataBase (pool size %s-%s)", settings['minPoolSize'], settings['maxPoolSize'])
+            client = MongoClient(
+                settings["uri"],
+                maxPoolSize=settings["maxPoolSize"],
+                minPoolSize=settings["minPoolSize"],
+                maxIdleTimeMS=settings["maxIdleTimeMS"],
+                # BSON dates are UTC, read them back as aware datetimes
+                tz_aware=True,
+            )
+            self.connection = Connection(client, client[settings["db_name"]])
+            logger.info("Successfully created DataBase connection pool")
+            return self.connection
+        except Exception as e:
+            logger.error("Failed to connect to Database: %s", e)
+            raise
+
+    def get_connection(self) -> Connection:
+        # Lazily open the pool for entry points that skip the startup hook
+        if self.connection is None:
+            return self.open()
+        return self.connection
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.client.close()
+            self.connection = None
+            logger.info("Closed DataBase connection pool")
+
+pool = ConnectionPool()
+
+class AsyncConnection:
+    client: AsyncMongoClient
+    db: AsyncDatabase
+
+    def __init__(self, client: AsyncMongoClient, db: AsyncDatabase) -> None:
+        self.client = client
+        self.db = db
+
+class AsyncConnectionPool:
+    """
+    Async counterpart of ConnectionPool backed by pymongo's AsyncMongoClient,
+    used by the WebSocket path and async routes so database calls never block
+    the event loop. Uses the same MONGO_* pool settings.
+    """
+    connection: AsyncConnection | None
+
+    def __init__(self) -> None:
+        self.connection = None
+
+    def open(self) -> AsyncConnection:
+        if self.connection is not None:
+            return self.connection
+        try:
+            settings = pool_settings()
+            logger.info("Connecting to DataBase asynchronously (pool size %s-%s)", settings['minPoolSize'], settings['maxPoolSize'])
+            client = AsyncMongoClient(
+                settings["uri"],
+                maxPoolSize=settings["maxPoolSize"],
+                minPoolSize=settings["minPoolSize"],
+                maxIdleTimeMS=settings["maxIdleTimeMS"],
+                # BSON dates are UTC, read them back as aware datetimes
+                tz_aware=True,
+            )
+            self.connection = AsyncConnection(client, client[settings["db_name"]])
+            return self.connection
+        except Exception as e:
+            logger.error("Failed to connect to Database: %s", e)
+            raise
+
+    def get_connection(self) -> AsyncConnection:
+        if self.connection is None:
+            return self.open()
+        return self.connection
+
+    async def close(self) -> None:
+        if self.connection is not None:
+            await self.connection.client.close()
+            self.connection = None
+            logger.info("Closed async DataBase connection pool")
+
+async_pool = AsyncConnectionPool()
+
 class UnitOfWork:
     connection: Connection
     message_repository: MessageRepository
-    user_repository: UserRepository
+    user_repository: CachedUserRepository
     groups_repository: GroupRepository
     dm_repository : DirectMessageRepository
+    chat_summary_repository: ChatSummaryRepository
 
-    def __init__(self) -> None:
-        try:
-            load_dotenv()
-            mongodb_uri = os.getenv("MONGO_URI")
-            db_name = os.getenv("DB_NAME", "baqir_chat_app")
-            
-            logger.info(f"Connecting to DataBase")
-            self.client = MongoClient(mongodb_uri)
-            self.db = self.client[db_name]
-            
-            # Test connection
-            self.client.admin.command('ping')
-            logger.info("Successfully connected to DataBase")
-            
-            self.connection = Connection(self.client, self.db)
-            
-            # Initialize repositories
-            self.message_repository = MessageRepository(self.connection)
-            self.user_repository = UserRepository(self.connection)
-            self.groups_repository = GroupRepository(self.connection)
-            self.dm_repository = DirectMessageRepository(self.connection)
-            
-        except Exception as e:
-            logger.error(f"Failed to connect to Database: {e}")
-            raise
+    def __init__(self, connection: Connection | None = None) -> None:
+        # Borrow the shared pooled client, this is a cheap per-request handle
+        self.connection = connection or pool.get_connection()
+        self.client = self.connection.client
+        self.db = self.connection.db
+
+        # Initialize repositories
+        self.message_repository = MessageRepository(self.connection)
+        self.user_repository = CachedUserRepository(UserRepository(self.connection), user_cache)
+        self.groups_repository = GroupRepository(self.connection)
+        self.dm_repository = DirectMessageRepository(self.connection)
+        self.chat_summary_repository = ChatSummaryRepository(self.connection)
 
     def close(self) -> None:
-        self.client.close()
+        # The client belongs to the process-wide pool, nothing to release per request
+        pass
 
     def commit_close(self) -> None:
         # For MongoDB, there's no explicit commit needed
@@ -63,7 +168,38 @@ class UnitOfWork:
             self.client.admin.command('ping')
             return True
         except Exception as e:
-            logger.error(f"Connection test failed: {e}")
+            logger.error("Connection test failed: %s", e)
             return False
 
+class AsyncUnitOfWork:
+    connection: AsyncConnection
+    message_repository: AsyncMessageRepository
+    user_repository: AsyncCachedUserRepository
+    groups_repository: AsyncGroupRepository
+    dm_repository : AsyncDirectMessageRepository
+    chat_summary_repository: AsyncChatSummaryRepository
+
+    def __init__(self, connection: AsyncConnection | None = None) -> None:
+        self.connection = connection or async_pool.get_connection()
+        self.client = self.connection.client
+        self.db = self.connection.db
+
+        self.message_repository = AsyncMessageRepository(self.connection)
+        self.user_repository = AsyncCachedUserRepository(AsyncUserRepository(self.connection), user_cache)
+        self.groups_repository = AsyncGroupRepository(self.connection)
+        self.dm_repository = AsyncDirectMessageRepository(self.connection)
+        self.chat_summary_repository = AsyncChatSummaryRepository(self.connection)
+
+    async def close(self) -> None:
+        pass
 
+    async def commit_close(self) -> None:
+        await self.close()
+
+    async def test_connection(self) -> bool:
+        try:
+            await self.client.admin.command('ping')
+            return True
+        except Exception as e:
+            logger.error("Connection test failed: %s", e)
+            return False